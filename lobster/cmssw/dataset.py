@@ -1,70 +1,324 @@
-import hashlib
+from collections import defaultdict
+import glob
+import json
 import logging
 import math
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
 import os
-import pickle
 import re
 import requests
 from retrying import retry
+import sqlite3
+import threading
+import time
 import xdg.BaseDirectory
 
-from lobster.core.dataset import DatasetInfo
+from lobster.core.dataset import DatasetInfo, LumiArray
 from lobster.util import Configurable
 
 from dbs.apis.dbsClient import DbsApi
 from WMCore.Credential.Proxy import Proxy
-from WMCore.DataStructs.LumiList import LumiList
 
 logger = logging.getLogger('lobster.cmssw.dataset')
 
 
 class DASWrapper(DbsApi):
 
-    @retry(stop_max_attempt_number=10)
+    @retry(stop_max_attempt_number=10, wait_exponential_multiplier=1000, wait_exponential_max=60000)
     def listFileLumis(self, *args, **kwargs):
         return super(DASWrapper, self).listFileLumis(*args, **kwargs)
 
-    @retry(stop_max_attempt_number=10)
+    @retry(stop_max_attempt_number=10, wait_exponential_multiplier=1000, wait_exponential_max=60000)
     def listFileSummaries(self, *args, **kwargs):
         return super(DASWrapper, self).listFileSummaries(*args, **kwargs)
 
-    @retry(stop_max_attempt_number=10)
+    @retry(stop_max_attempt_number=10, wait_exponential_multiplier=1000, wait_exponential_max=60000)
     def listFiles(self, *args, **kwargs):
         return super(DASWrapper, self).listFiles(*args, **kwargs)
 
-    @retry(stop_max_attempt_number=10)
+    @retry(stop_max_attempt_number=10, wait_exponential_multiplier=1000, wait_exponential_max=60000)
     def listBlocks(self, *args, **kwargs):
         return super(DASWrapper, self).listBlocks(*args, **kwargs)
 
 
-class Cache(object):
+class BlockQuery(object):
 
-    def __init__(self):
-        self.cachedir = xdg.BaseDirectory.save_cache_path('lobster')
+    """Retrieve the luminosity sections of DBS blocks concurrently.
 
-    def __cachename(self, name, mask):
-        m = hashlib.sha256()
-        m.update(name)
-        if mask:
-            m.update(mask)
-        return os.path.join(self.cachedir,
-                            "{}-{}.pkl".format(name.strip('/').split('/')[0], m.hexdigest()))
+    Every thread of the pool uses its own DBS client.  Calls that fail or
+    do not return within `timeout` are retried with exponential backoff,
+    using a new client.
 
-    def cache(self, name, mask, baseinfo, dataset):
-        logger.debug("writing dataset '{}' to cache".format(name))
-        with open(self.__cachename(name, mask), 'wb') as fd:
-            pickle.dump((baseinfo, dataset), fd)
+    The DBS calls themselves run on a second pool of twice as many
+    workers, shared by all queries of this instance.  A call that times
+    out can not be interrupted and keeps its worker busy until DBS
+    answers, so retries may queue behind hanging calls and time out, too.
+    No further threads are started for such calls, and at most `attempts`
+    are made per block.
 
-    def cached(self, name, mask, baseinfo):
+    Parameters
+    ----------
+        factory : callable
+            Creates a new DBS client.
+        threads : int
+            How many blocks to query at the same time.
+        timeout : float
+            How many seconds to wait for a single call to DBS.
+        attempts : int
+            How often to try to retrieve a block before giving up.
+        backoff : float
+            How many seconds to wait before the first retry.  Doubles with
+            every further attempt.
+    """
+
+    def __init__(self, factory, threads=8, timeout=300, attempts=5, backoff=2):
+        self.factory = factory
+        self.threads = threads
+        self.timeout = timeout
+        self.attempts = attempts
+        self.backoff = backoff
+        self.__local = threading.local()
+        self.__calls = None
+
+    def __call(self, block):
+        if getattr(self.__local, 'dbs', None) is None:
+            self.__local.dbs = self.factory()
+        dbs = self.__local.dbs
+
+        result = self.__calls.apply_async(dbs.listFileLumis, (), {'block_name': block})
         try:
-            with open(self.__cachename(name, mask), 'rb') as fd:
-                info, dset = pickle.load(fd)
-                if baseinfo == info:
-                    logger.debug("retrieved dataset '{}' from cache".format(name))
-                    return dset
-                return None
+            return result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            # do not reuse a client that may still be busy
+            self.__local.dbs = None
+            raise IOError("timed out after {0}s".format(self.timeout))
         except Exception:
-            return None
+            self.__local.dbs = None
+            raise
+
+    def __fetch(self, block):
+        for attempt in range(self.attempts):
+            try:
+                return self.__call(block)
+            except Exception as e:
+                if attempt + 1 == self.attempts:
+                    raise IOError("unable to retrieve block '{0}': {1}".format(block, e))
+                delay = self.backoff * 2 ** attempt
+                logger.debug("retrying block '{0}' in {1}s after error: {2}".format(block, delay, e))
+                time.sleep(delay)
+
+    def __call__(self, blocks):
+        """Query the luminosity sections of `blocks`.
+
+        Returns
+        -------
+            lumis : iterator
+                A list of file luminosity sections as returned by
+                `DbsApi.listFileLumis` for each block, in the order of
+                `blocks`.
+        """
+        if self.__calls is None:
+            self.__calls = ThreadPool(2 * self.threads)
+        pool = ThreadPool(self.threads)
+        try:
+            results = [pool.apply_async(self.__fetch, (block,)) for block in blocks]
+            for n, result in enumerate(results, 1):
+                yield result.get()
+                if n % 100 == 0:
+                    logger.info("retrieved {0} of {1} blocks".format(n, len(results)))
+        finally:
+            pool.terminate()
+
+
+class LumiMask(object):
+
+    """A luminosity section mask for bulk application.
+
+    Stores the certified luminosity sections of a JSON mask as sorted
+    interval arrays, to check whole blocks of luminosity sections at once
+    with a binary search.
+
+    Parameters
+    ----------
+        filename : str
+            The JSON mask, as customary in CMS: a mapping of runs to lists
+            of `[first, last]` luminosity section ranges.
+    """
+
+    def __init__(self, filename):
+        with open(filename) as f:
+            mask = json.load(f)
+        ranges = sorted((int(run), first, last) for run, lumis in mask.items() for first, last in lumis)
+        self.__starts = np.array([self.__key(run, first) for run, first, _ in ranges], dtype=np.int64)
+        self.__ends = np.array([self.__key(run, last) for run, _, last in ranges], dtype=np.int64)
+
+    @staticmethod
+    def __key(runs, lumis):
+        return (np.asarray(runs, dtype=np.int64) << 32) + lumis
+
+    def contains(self, runs, lumis):
+        """Returns a boolean array indicating which `(run, lumi)` pairs
+        of the arrays `runs` and `lumis` are within the mask.
+        """
+        keys = self.__key(runs, lumis)
+        index = np.searchsorted(self.__starts, keys, side='right') - 1
+        return (index >= 0) & (keys <= self.__ends[np.maximum(index, 0)])
+
+    def apply(self, files):
+        """Mask the luminosity sections of a list of files.
+
+        Parameters
+        ----------
+            files : list
+                A list of `(filename, LumiArray)` tuples.
+
+        Returns
+        -------
+            files : list
+                A list of `(filename, LumiArray)` tuples, containing only
+                the luminosity sections within the mask.
+            masked : int
+                The number of luminosity sections removed.
+        """
+        files = [(fn, lumis) for fn, lumis in files if len(lumis) > 0]
+        if len(files) == 0:
+            return [], 0
+        runs = np.concatenate([np.frombuffer(lumis.runs, dtype=np.int32) for _, lumis in files])
+        lumis = np.concatenate([np.frombuffer(lumis.lumis, dtype=np.int32) for _, lumis in files])
+        keep = self.contains(runs, lumis)
+        bounds = np.cumsum([0] + [len(ls) for _, ls in files])
+
+        res = []
+        for (fn, _), start, end in zip(files, bounds[:-1], bounds[1:]):
+            selected = keep[start:end]
+            res.append((fn, LumiArray.fromstring(runs[start:end][selected].tostring(), lumis[start:end][selected].tostring())))
+        return res, int(len(keep) - keep.sum())
+
+
+class Cache(object):
+
+    """Cache of the luminosity sections of DBS blocks.
+
+    Blocks are stored in an SQLite database, with the runs and
+    luminosity sections of each file packed into arrays, and are
+    validated individually against the information returned by
+    `listBlocks`.  Least recently used blocks are removed to keep the
+    cache within a given size, see :meth:`evict`.
+
+    Parameters
+    ----------
+        cachedir : str
+            The directory to store the cache in.  Defaults to the
+            `lobster` directory of the XDG cache path.
+    """
+
+    def __init__(self, cachedir=None):
+        self.cachedir = cachedir if cachedir else xdg.BaseDirectory.save_cache_path('lobster')
+        self.__db = None
+
+    @property
+    def db(self):
+        if self.__db is None:
+            # remove whole-dataset pickles of previous versions, named
+            # after the primary dataset and a SHA256 digest
+            for fn in glob.glob(os.path.join(self.cachedir, '*-*.pkl')):
+                if re.match(r'.+-[0-9a-f]{64}\.pkl$', os.path.basename(fn)):
+                    os.unlink(fn)
+            self.__db = sqlite3.connect(os.path.join(self.cachedir, 'blocks.db'), timeout=90)
+            self.__db.execute("""create table if not exists blocks(
+                name text primary key,
+                dataset text,
+                signature text,
+                size int,
+                accessed real)""")
+            self.__db.execute("""create table if not exists files(
+                block text,
+                filename text,
+                runs blob,
+                lumis blob)""")
+            self.__db.execute("create index if not exists index_b_accessed on blocks(accessed)")
+            self.__db.execute("create index if not exists index_b_dataset on blocks(dataset)")
+            self.__db.execute("create index if not exists index_f_block on files(block)")
+            self.__db.commit()
+        return self.__db
+
+    @staticmethod
+    def signature(block):
+        """Returns a string identifying the state of a block, as returned
+        by `listBlocks` with `detail=True`.
+        """
+        return json.dumps([block.get(k) for k in ('file_count', 'block_size', 'last_modification_date')])
+
+    def cached(self, dataset, blocks):
+        """Retrieve valid blocks of a dataset from the cache.
+
+        Parameters
+        ----------
+            dataset : str
+                The name of the dataset.
+            blocks : dict
+                A mapping of block names to their signature.
+
+        Returns
+        -------
+            files : dict
+                A mapping of the names of valid cached blocks to a list of
+                `(filename, LumiArray)` tuples.
+        """
+        res = {}
+        with self.db as db:
+            for name, signature in db.execute("select name, signature from blocks where dataset=?", (dataset,)):
+                if blocks.get(name) == signature:
+                    res[name] = []
+            names = res.keys()
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                db.executemany("update blocks set accessed=? where name=?", ((time.time(), name) for name in chunk))
+                query = "select block, filename, runs, lumis from files where block in ({0})".format(', '.join('?' * len(chunk)))
+                for block, filename, runs, lumis in db.execute(query, chunk):
+                    res[block].append((filename, LumiArray.fromstring(runs, lumis)))
+        return res
+
+    def cache(self, dataset, block, signature, files):
+        """Store the files of a block in the cache.
+
+        Parameters
+        ----------
+            dataset : str
+                The name of the dataset.
+            block : str
+                The name of the block.
+            signature : str
+                The signature of the block.
+            files : list
+                A list of `(filename, LumiArray)` tuples.
+        """
+        rows = [(block, fn, buffer(lumis.runs.tostring()), buffer(lumis.lumis.tostring())) for fn, lumis in files]
+        size = sum(len(fn) + len(runs) + len(lumis) for _, fn, runs, lumis in rows)
+        with self.db as db:
+            db.execute("delete from files where block=?", (block,))
+            db.execute("insert or replace into blocks values (?, ?, ?, ?, ?)", (block, dataset, signature, size, time.time()))
+            db.executemany("insert into files values (?, ?, ?, ?)", rows)
+
+    def evict(self, max_size):
+        """Remove the least recently used blocks until the cache is
+        within `max_size` bytes.
+        """
+        with self.db as db:
+            (total,) = db.execute("select ifnull(sum(size), 0) from blocks").fetchone()
+            if total <= max_size:
+                return
+            remove = []
+            for name, size in db.execute("select name, size from blocks order by accessed"):
+                if total <= max_size:
+                    break
+                remove.append((name,))
+                total -= size
+            db.executemany("delete from files where block=?", remove)
+            db.executemany("delete from blocks where name=?", remove)
+        logger.debug("removed {0} blocks from the DBS cache".format(len(remove)))
 
 
 class Dataset(Configurable):
@@ -89,20 +343,32 @@ class Dataset(Configurable):
             Process whole files instead of single luminosity sections.
         dbs_instance : str
             Which DBS instance to query for the `dataset`.
+        watch : bool
+            Periodically look for new files and process them, too.  Lobster
+            will keep running until stopped.  See
+            :attr:`~lobster.core.config.AdvancedOptions.watch_interval`.
+        cache_size : int
+            How many MB the cache of DBS block information, shared by all
+            datasets, may use.  The least recently used blocks are removed
+            once the cache exceeds this size.
     """
     _mutable = {}
 
     __apis = {}
     __dsets = {}
+    __queries = {}
     __cache = Cache()
 
-    def __init__(self, dataset, lumis_per_task=25, events_per_task=None, lumi_mask=None, file_based=False, dbs_instance='global'):
+    def __init__(self, dataset, lumis_per_task=25, events_per_task=None, lumi_mask=None, file_based=False, dbs_instance='global',
+                 watch=False, cache_size=1024):
         self.dataset = dataset
         self.lumi_mask = lumi_mask
         self.lumis_per_task = lumis_per_task
         self.events_per_task = events_per_task
         self.file_based = file_based
         self.dbs_instance = 'https://cmsweb.cern.ch/dbs/prod/{0}/DBSReader'.format(dbs_instance)
+        self.watch = watch
+        self.cache_size = cache_size
 
         self.total_units = 0
 
@@ -136,7 +402,8 @@ class Dataset(Configurable):
         return True
 
     def get_info(self):
-        if self.dataset not in Dataset.__dsets:
+        # rescans of watched datasets need current information
+        if self.dataset not in Dataset.__dsets or self.watch:
             if self.lumi_mask:
                 self.lumi_mask = self.__get_mask(self.lumi_mask)
             res = self.query_database()
@@ -162,10 +429,6 @@ class Dataset(Configurable):
         if baseinfo is None or (len(baseinfo) == 1 and baseinfo[0] is None):
             raise ValueError('unable to retrive information for dataset {}'.format(self.dataset))
 
-        if not self.file_based:
-            result = self.__cache.cached(self.dataset, self.lumi_mask, baseinfo)
-            if result:
-                return result
         total_lumis = sum([info['num_lumi'] for info in baseinfo])
 
         result = DatasetInfo()
@@ -181,25 +444,36 @@ class Dataset(Configurable):
                 fn = info['logical_file_name']
                 result.files[fn].lumis = [(-2, -2)]
         else:
-            blocks = dbs.listBlocks(dataset=self.dataset)
-            if self.lumi_mask:
-                unmasked_lumis = LumiList(filename=self.lumi_mask)
-            for block in blocks:
-                runs = dbs.listFileLumis(block_name=block['block_name'])
-                for run in runs:
-                    fn = run['logical_file_name']
-                    for lumi in run['lumi_section_num']:
-                        if not self.lumi_mask or ((run['run_num'], lumi) in unmasked_lumis):
-                            result.files[fn].lumis.append((run['run_num'], lumi))
-                        elif self.lumi_mask and ((run['run_num'], lumi) not in unmasked_lumis):
-                            result.masked_units += 1
+            blocks = [(block['block_name'], Cache.signature(block)) for block in dbs.listBlocks(dataset=self.dataset, detail=True)]
+            cached = Dataset.__cache.cached(self.dataset, dict(blocks))
+            missing = [name for name, _ in blocks if name not in cached]
+            logger.debug("found {0} of {1} blocks of {2} in the cache".format(len(blocks) - len(missing), len(blocks), self.dataset))
+
+            if self.dbs_instance not in Dataset.__queries:
+                Dataset.__queries[self.dbs_instance] = BlockQuery(lambda: DbsApi(self.dbs_instance, ca_info=cred.getProxyFilename()))
+            queried = Dataset.__queries[self.dbs_instance](missing)
+
+            mask = LumiMask(self.lumi_mask) if self.lumi_mask else None
+            for name, signature in blocks:
+                if name in cached:
+                    files = cached[name]
+                else:
+                    files = defaultdict(LumiArray)
+                    for run in next(queried):
+                        files[run['logical_file_name']].extend((run['run_num'], lumi) for lumi in run['lumi_section_num'])
+                    files = files.items()
+                    Dataset.__cache.cache(self.dataset, name, signature, files)
+                if mask:
+                    files, masked = mask.apply(files)
+                    result.masked_units += masked
+                for fn, lumis in files:
+                    result.files[fn].lumis.extend(lumis)
+            queried.close()
+            Dataset.__cache.evict(self.cache_size * 1024 ** 2)
 
         result.unmasked_units = sum([len(f.lumis) for f in result.files.values()])
         result.total_units = result.unmasked_units + result.masked_units
 
-        if not self.file_based:
-            self.__cache.cache(self.dataset, self.lumi_mask, baseinfo, result)
-
         result.stop_on_file_boundary = (result.total_units != total_lumis) and not self.file_based
         if result.stop_on_file_boundary:
             logger.debug("split lumis detected in {} - "
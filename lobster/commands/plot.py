@@ -12,7 +12,6 @@ import multiprocessing
 import os
 import pickle
 import shutil
-import sqlite3
 import signal
 import time
 import re
@@ -403,7 +402,6 @@ class Plotter(object):
     def __init__(self, config, outdir=None, paper=False):
         self.config = config
         self.__paper = paper
-        self.__store = unit.UnitStore(config)
 
         util.verify(self.config.workdir)
 
@@ -440,8 +438,7 @@ class Plotter(object):
 
     def readdb(self):
         logger.debug('reading database')
-        db = sqlite3.connect(os.path.join(
-            self.config.workdir, 'lobster.db'), timeout=90)
+        db = self.__store.db
 
         self.wflow_ids = {}
         self.wflow_labels = {}
@@ -472,42 +469,39 @@ class Plotter(object):
         summary_data = list(self.__store.workflow_status())[1:]
 
         # for cases where units per task changes during run, get per-unit info
-        total_units = 0
-        start_units = 0
-        completed_units = []
-        units_processed = {}
-        transfers = {}
-        for (label,) in db.execute("select label from workflows"):
-            total_units += db.execute(
-                "select count(*) from units_{0}".format(label)).fetchone()[0]
-            start_units += db.execute("""
-                select count(*)
-                from units_{0}, tasks
-                where units_{0}.task == tasks.id
-                    and (units_{0}.status=2 or units_{0}.status=6)
-                    and time_retrieved<=?""".format(label), (self.__xmin,)).fetchone()[0]
-            completed_units.append(np.array(db.execute("""
-                select units_{0}.id, tasks.time_retrieved
-                from units_{0}, tasks
-                where units_{0}.task == tasks.id
-                    and (units_{0}.status=2 or units_{0}.status=6)
-                    and time_retrieved>=? and time_retrieved<=?""".format(label),
-                                                       (self.__xmin, self.__xmax)).fetchall(),
-                                            dtype=[('id', 'i4'), ('time_retrieved', 'i4')]))
-            units_processed[label] = db.execute("""
-                select units_{0}.run,
-                units_{0}.lumi
-                from units_{0}, tasks
-                where units_{0}.task == tasks.id
-                    and (units_{0}.status in (2, 6))""".format(label)).fetchall()
-            transfers[label] = json.loads(db.execute("""
-                select transfers
-                from workflows
-                where label=?""", (label,)).fetchone()[0])
+        # units may be stored as ranges of luminosity sections
+        total_units = db.execute(
+            "select ifnull(sum(lumi_last - lumi + 1), 0) from units").fetchone()[0]
+        start_units = db.execute("""
+            select ifnull(sum(lumi_last - lumi + 1), 0)
+            from units, tasks
+            where units.task == tasks.id
+                and (units.status=2 or units.status=6)
+                and time_retrieved<=?""", (self.__xmin,)).fetchone()[0]
+        completed = db.execute("""
+            select units.id, tasks.time_retrieved, units.lumi_last - units.lumi + 1
+            from units, tasks
+            where units.task == tasks.id
+                and (units.status=2 or units.status=6)
+                and time_retrieved>=? and time_retrieved<=?""", (self.__xmin, self.__xmax)).fetchall()
+        completed = np.array(completed, dtype=[('id', 'i4'), ('time_retrieved', 'i4'), ('width', 'i4')])
+        completed_units = np.repeat(completed[['id', 'time_retrieved']], completed['width'])
+
+        units_processed = dict((label, []) for label in self.wflow_ids)
+        for label, run, first, last in db.execute("""
+                select workflows.label, units.run, units.lumi, units.lumi_last
+                from units, tasks, workflows
+                where units.task == tasks.id
+                    and units.workflow == workflows.id
+                    and (units.status in (2, 6))"""):
+            units_processed[label].extend((run, lumi) for lumi in range(first, last + 1))
+
+        transfers = dict((label, json.loads(data)) for (label, data) in db.execute(
+            "select label, transfers from workflows"))
 
         logger.debug('finished reading database')
 
-        return success_tasks, failed_tasks, summary_data, np.concatenate(completed_units), total_units, total_units - start_units, units_processed, transfers
+        return success_tasks, failed_tasks, summary_data, completed_units, total_units, total_units - start_units, units_processed, transfers
 
     def readlog(self, filename=None, category='all'):
         if filename:
@@ -590,10 +584,11 @@ class Plotter(object):
                     codes[exit_code][1].append(str(id))
                     work.append([s, t])
 
-        for label, _, _, _, _, _, _, _, _, failed, skipped, _, _, _ in list(self.__store.workflow_status())[1:-1]:
-            if failed + skipped == 0:
+        for summary in self.__store.workflow_status(structured=True)[:-1]:
+            if summary.units_failed + summary.units_skipped == 0:
                 continue
 
+            label = summary.label
             failed = self.__store.failed_units(label)
             skipped = self.__store.skipped_files(label)
 
@@ -806,6 +801,8 @@ class Plotter(object):
         ]
         lobster_labels = ['status', 'create', 'action', 'update', 'fetch', 'return']
         return_labels = ['dash', 'handler', 'updates', 'elk', 'transfers', 'cleanup', 'propagate', 'sqlite']
+        if 'total_source_process_time' in headers:
+            return_labels.insert(0, 'process')
 
         times = stats[:, headers['timestamp']]
         centers = ((times + np.roll(times, 1, 0)) * 0.5)[1:]
@@ -927,6 +924,13 @@ class Plotter(object):
             label=['running']
         )
 
+        if 'runtime_prediction_error' in headers:
+            self.plot(
+                [(stats[:, headers['timestamp']], stats[:, headers['runtime_prediction_error']])],
+                'Runtime prediction error', os.path.join(category, 'runtime-error'),
+                modes=[Plotter.PLOT | Plotter.TIME]
+            )
+
         self.plot(
             [
                 (stats[:, headers['timestamp']],
@@ -1302,6 +1306,10 @@ class Plotter(object):
                 continue
             self.__category_stats[label] = self.readlog(category=label)
 
+        # Only read from the database, to not interfere with a running
+        # Lobster process.
+        self.__store = unit.UnitStore(self.config, readonly=True)
+
         good_tasks, failed_tasks, summary_data, completed_units, total_units, start_units, units_processed, transfers = self.readdb()
 
         success_tasks = good_tasks[good_tasks['type'] == 0] if len(
@@ -1484,6 +1492,8 @@ class Plotter(object):
                 categories=categories
             ).encode('utf-8'))
 
+        self.__store.disconnect()
+
         p = multiprocessing.Pool(10, reset_signals)
         p.map(mp_call, self.__plotargs)
         p.close()
@@ -68,15 +68,14 @@ class Process(Command, util.Timing):
             self.log_attributes = [m for (m, o) in inspect.getmembers(wq.work_queue_stats)
                                    if not inspect.isroutine(o) and not m.startswith('__')]
 
+        columns = ["#timestamp", "units_left"]
+        columns += ["total_{}_time".format(k) for k in sorted(self.times.keys())]
+        columns += ["total_source_{}_time".format(k) for k in sorted(self.source.times.keys())]
+        columns += ["runtime_prediction_error"]
+        columns += self.log_attributes
+
         with open(filename, "a") as statsfile:
-            statsfile.write(
-                " ".join(
-                    ["#timestamp", "units_left"] +
-                    ["total_{}_time".format(k) for k in sorted(self.times.keys())] +
-                    ["total_source_{}_time".format(k) for k in sorted(self.source.times.keys())] +
-                    self.log_attributes
-                ) + "\n"
-            )
+            statsfile.write(" ".join(columns) + "\n")
 
     def log(self, category, left):
         filename = os.path.join(self.config.workdir, "lobster_stats_{}.log".format(category))
@@ -85,15 +84,17 @@ class Process(Command, util.Timing):
         else:
             stats = self.queue.stats_category(category)
 
+        error = self.source.prediction_error(category)
+
+        now = datetime.datetime.now()
+        values = [int(int(now.strftime('%s')) * 1e6 + now.microsecond), left]
+        values += [self.times[k] for k in sorted(self.times.keys())]
+        values += [self.source.times[k] for k in sorted(self.source.times.keys())]
+        values += [error if error is not None else float('nan')]
+        values += [getattr(stats, a) for a in self.log_attributes]
+
         with open(filename, "a") as statsfile:
-            now = datetime.datetime.now()
-            statsfile.write(" ".join(map(str,
-                                         [int(int(now.strftime('%s')) * 1e6 + now.microsecond), left] +
-                                         [self.times[k] for k in sorted(self.times.keys())] +
-                                         [self.source.times[k] for k in sorted(self.source.times.keys())] +
-                                         [getattr(stats, a) for a in self.log_attributes]
-                                         )) + "\n"
-                            )
+            statsfile.write(" ".join(map(str, values)) + "\n")
 
         if self.config.elk:
             stats = self.queue.stats_hierarchy
@@ -275,7 +276,12 @@ class Process(Command, util.Timing):
                     have[c] = {'running': cstats.tasks_running, 'queued': cstats.tasks_waiting}
 
                 stats = self.queue.stats_hierarchy
-                tasks = self.source.obtain(stats.total_cores, have)
+                total = {
+                    'cores': stats.total_cores,
+                    'memory': stats.total_memory,
+                    'disk': stats.total_disk
+                }
+                tasks = self.source.obtain(total, have)
 
                 expiry = None
                 if self.config.advanced.proxy:
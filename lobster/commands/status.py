@@ -17,7 +17,7 @@ class Status(Command):
     def run(self, args):
         config = args.config
         logger = logging.getLogger('lobster.status')
-        store = unit.UnitStore(config)
+        store = unit.UnitStore(config, readonly=True)
         data = list(store.workflow_status())
         headers = [x.split() for x in data.pop(0)]
         header_rows = max([len(x) for x in headers])
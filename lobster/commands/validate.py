@@ -83,7 +83,7 @@ class Validate(Command):
         return delete, missing
 
     def run(self, args):
-        store = UnitStore(args.config)
+        store = UnitStore(args.config, readonly=True)
         stats = dict((w.label, [0, 0, 0]) for w in args.config.workflows)
 
         missing = []
@@ -105,7 +105,7 @@ class Validate(Command):
 
         if len(missing) > 0:
             if not args.dry_run:
-                store.update_missing(missing)
+                UnitStore(args.config).update_missing(missing)
 
             verb = 'would have' if args.dry_run else 'have'
             template = 'the following {0} been marked as failed because their output could not be found: {1}'
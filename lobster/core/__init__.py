@@ -1,5 +1,6 @@
 from config import AdvancedOptions, Config
 from create import Algo
+from model import EWMARuntimeModel, RuntimeModel
 from sandbox import Sandbox
 from task import TaskHandler, MergeTaskHandler
 from workflow import Category, Workflow
@@ -10,6 +11,7 @@ from lobster.se import StorageConfiguration
 
 __all__ = [
     'Algo', 'Config', 'AdvancedOptions', 'Category', 'Workflow',
+    'EWMARuntimeModel', 'RuntimeModel',
     'Dataset', 'EmptyDataset', 'ParentDataset', 'ProductionDataset',
     'MultiGridpackDataset', 'ParentMultiGridpackDataset', 'MultiProductionDataset',
     'Sandbox', 'StorageConfiguration',
@@ -3,6 +3,7 @@ import getpass
 import os
 import pickle
 
+from lobster.core.model import EWMARuntimeModel
 from lobster.core.workflow import Category
 from lobster.util import Configurable
 
@@ -152,7 +153,10 @@ class AdvancedOptions(Configurable):
 
     Attributes modifiable at runtime:
 
+    * `isolation`
     * `payload`
+    * `speculation_multiplier`
+    * `speculation_threshold`
     * `threshold_for_failure`
     * `threshold_for_skipping`
 
@@ -178,6 +182,13 @@ class AdvancedOptions(Configurable):
             The email address you want to receive emails from Lobster.
         full_monitoring : bool
             Produce full monitoring output.  Useful to debug `WorkQueue`.
+        isolation : str
+            How to find the units failing tasks once they reach
+            `threshold_for_failure`.  With `bisect`, the units of a failed
+            task are split in halves, which are processed in separate
+            tasks, until the failing units are processed by themselves.
+            With `unit`, every unit is processed in a separate task right
+            away.
         log_level : int
             How much logging output to show.  Goes from 1 to 5, where 1 is
             the most verbose (including a lot of debug output), and 5 is
@@ -191,12 +202,57 @@ class AdvancedOptions(Configurable):
         proxy : :class:`~lobster.cmssw.Proxy`
             An authentication mechanism to access data.  Set to `False` to
             disable.
+        registration_chunk_size : int
+            How many units to insert into the database at once when
+            registering a dataset.  Bounds the memory used for the
+            registration, which is logged after every chunk.
+        release_threads : int
+            How many threads to use to process the logs, reports, and
+            directories of returned tasks.
+        runtime_model : :class:`~lobster.core.model.RuntimeModel`
+            The model used to predict the runtime of tasks, and to size
+            tasks to match the runtime of their category.  Defaults to a
+            :class:`~lobster.core.model.EWMARuntimeModel`.
+        speculation_multiplier : float
+            How many times its predicted runtime a task may run at the end
+            of a workflow before it is duplicated.  The first of the two
+            tasks to succeed is kept, and the other one is cancelled.
+            Tasks are only duplicated while their category has no tasks
+            waiting in the queue.  Their runtime counts from their
+            submission or from when the queue emptied, whichever is later.
+        speculation_threshold : float
+            The fraction of the units of a workflow left below which
+            straggling tasks are duplicated.  Set to 0 to disable.
         threshold_for_failure : int
             How often a single unit may fail to be processed before Lobster
-            will not attempt to process it any longer.
+            will isolate it, see `isolation`.  Units failing once more when
+            processed by themselves will not be attempted any longer.
         threshold_for_skipping : int
             How often a single file may fail to be accessed before Lobster
             will not attempt to process it any longer.
+        unit_ranges : bool
+            Store contiguous luminosity sections of a file as one range in
+            the database, which is only split up when needed.  Reduces the
+            database size and the time spent registering datasets with
+            many luminosity sections.
+        watch_interval : int
+            How many seconds to wait between rescans of datasets that are
+            watched for new files.
+        write_ahead_log : bool
+            Use a write-ahead log for the database.  Commands that only
+            read the database, like `lobster status` or `lobster plot`,
+            will then neither block nor be blocked by a running Lobster
+            process.  Disable when the working directory is on a network
+            filesystem.
+        write_behind_size : int
+            How many returned tasks to collect before writing their
+            updates to the database in one transaction.  Updates are
+            always written before creating new tasks, and after every
+            batch of returned tasks when indexing to ELK.  Set to 0 to
+            write updates immediately.
+        write_behind_time : int
+            How many seconds returned tasks may be kept before their
+            updates are written to the database.
         wq_max_retries : int
             How often `WorkQueue` will attempt to process a task before
             handing it back to Lobster.  `WorkQueue` will only reprocess
@@ -211,7 +267,10 @@ class AdvancedOptions(Configurable):
 
     _mutable = {
         'bad_exit_codes': (None, [], False),
+        'isolation': (None, [], False),
         'payload': (None, [], False),
+        'speculation_multiplier': (None, [], False),
+        'speculation_threshold': (None, [], False),
         'threshold_for_failure': ('source.update_stuck', [], False),
         'threshold_for_skipping': ('source.update_stuck', [], False),
         'xrootd_servers': ('source.copy_siteconf', [], False)
@@ -225,12 +284,23 @@ class AdvancedOptions(Configurable):
                  dump_core=False,
                  email=None,
                  full_monitoring=False,
+                 isolation='bisect',
                  log_level=2,
                  osg_version=None,
                  payload=10,
                  proxy=None,
+                 registration_chunk_size=100000,
+                 release_threads=8,
+                 runtime_model=None,
+                 speculation_multiplier=2.,
+                 speculation_threshold=0.05,
                  threshold_for_failure=30,
                  threshold_for_skipping=30,
+                 unit_ranges=False,
+                 watch_interval=300,
+                 write_ahead_log=True,
+                 write_behind_size=1000,
+                 write_behind_time=60,
                  wq_max_retries=10,
                  wq_port=-1,
                  xrootd_servers=None):
@@ -255,11 +325,22 @@ class AdvancedOptions(Configurable):
         self.dump_core = dump_core
         self.email = email
         self.full_monitoring = full_monitoring
+        self.isolation = isolation
         self.log_level = log_level
         self.payload = payload
         self.proxy = proxy if proxy is not None else cmssw.Proxy()
+        self.registration_chunk_size = registration_chunk_size
+        self.release_threads = release_threads
+        self.runtime_model = runtime_model if runtime_model else EWMARuntimeModel()
+        self.speculation_multiplier = speculation_multiplier
+        self.speculation_threshold = speculation_threshold
         self.threshold_for_failure = threshold_for_failure
         self.threshold_for_skipping = threshold_for_skipping
+        self.unit_ranges = unit_ranges
+        self.watch_interval = watch_interval
+        self.write_ahead_log = write_ahead_log
+        self.write_behind_size = write_behind_size
+        self.write_behind_time = write_behind_time
         self.wq_max_retries = wq_max_retries
         self.wq_port = wq_port
         self.xrootd_servers = xrootd_servers if xrootd_servers else ['cmsxrootd.fnal.gov']
@@ -12,7 +12,14 @@ class Algo(object):
 
     Attempts to be fair when creating tasks by making sure that tasks are
     created evenly for every category and every workflow in each category
-    based on the remaining work per workflow and cores used.
+    based on the remaining work per workflow and resources used.
+
+    Resources are handled as vectors of cores, memory, and disk.  Tasks
+    are created for all categories in proportion to their remaining work
+    until one resource is used up.  Categories that need this resource
+    are then done, and the remaining resources are filled with tasks of
+    the other categories.  The number of tasks of a category is thus
+    limited by the resource its tasks exhaust first.
 
     Parameters
     ----------
@@ -20,10 +27,77 @@ class Algo(object):
             The Lobster configuration to use.
     """
 
+    resources = ('cores', 'memory', 'disk')
+
     def __init__(self, config):
         self.__config = config
 
-    def run(self, total_cores, queued, remaining):
+    def __fill(self, total):
+        """Determine how much of each resource to occupy.
+
+        Have at least 10% of the available resources provisioned with
+        waiting work.  With no workers connected, only the cores are
+        filled, up to the payload.
+        """
+        fill = {'cores': total.get('cores', 0) + max(int(0.1 * total.get('cores', 0)), self.__config.advanced.payload)}
+        for resource in self.resources[1:]:
+            if total.get(resource, 0) > 0:
+                fill[resource] = int(1.1 * total[resource])
+        return fill
+
+    def __requirements(self, category, fill):
+        """Returns the resource vector of a task of `category`, limited to
+        the resources specified by the category that are available.
+        """
+        req = {'cores': category.cores or 1}
+        for resource in self.resources[1:]:
+            if getattr(category, resource) and resource in fill:
+                req[resource] = getattr(category, resource)
+        return req
+
+    def __allocate(self, fill, demands):
+        """Fill the resources progressively with tasks.
+
+        Parameters
+        ----------
+            fill : dict
+                How much of each resource to occupy.
+            demands : dict
+                Category names as keys, and a tuple of the tasks the
+                category could create and the resource vector of a task
+                as values.
+
+        Returns
+        -------
+            allocation : dict
+                Category names as keys, and a tuple of how many tasks to
+                create and the name of the binding resource as values.
+        """
+        left = dict(fill)
+        active = set(c for c in demands if demands[c][0] > 0)
+        allocation = dict((c, (0, 'cores')) for c in demands)
+        tasks = dict((c, 0.) for c in demands)
+
+        while len(active) > 0:
+            usage = defaultdict(float)
+            for category in active:
+                count, req = demands[category]
+                for resource, amount in req.items():
+                    usage[resource] += count * amount
+
+            scale, binding = min((max(left[r], 0) / usage[r], r) for r in usage)
+            for category in active:
+                tasks[category] += scale * demands[category][0]
+            for resource in usage:
+                left[resource] -= scale * usage[resource]
+            for category in list(active):
+                if binding in demands[category][1]:
+                    active.remove(category)
+                    allocation[category] = (tasks[category], binding)
+
+        return allocation
+
+    def run(self, total, queued, remaining):
         """Run the task creation algorithm.
 
         If not enough tasks can be created for a workflow, the available
@@ -32,27 +106,28 @@ class Algo(object):
 
         Steps
         -----
-        1. Calculate remaining workload, weighed by cores, per category
-        2. Determine how many cores need to be filled
-        3. Go through workflows:
-           1. Determine the fraction of category workload versus the total
-              workload
-           2. Do the same for the workflow workload versus the category
-              workload
-           3. Use the first fraction to calculate how many tasks should be
-              created for the category
-           4. Adjust for mininum queued and maximum total task requirements
-           5. Subtract already queued tasks
-           6. Calculate how many tasks should be created for the current
+        1. Calculate remaining workload, in tasks, per category
+        2. Determine how much of each resource needs to be filled
+        3. Distribute the resources between categories, in proportion to
+           their workload, until the resource binding each category is
+           used up
+        4. Go through workflows:
+           1. Determine the fraction of the workflow workload versus the
+              category workload
+           2. Adjust for mininum queued and maximum total task requirements
+              of the category
+           3. Subtract already queued tasks
+           4. Calculate how many tasks should be created for the current
               workflow based on the previously calculated fraction
-           7. Adjust task size taper based on available tasks and needed
+           5. Adjust task size taper based on available tasks and needed
               tasks
 
         Parameters
         ----------
-            total_cores : int
-                The number of cores that `WorkQueue` currently is in
-                control of.
+            total : dict or int
+                The resources that `WorkQueue` currently is in control
+                of, as a dictionary with the keys `cores`, `memory`, and
+                `disk`.  A number is taken as the number of cores.
             queued : dict
                 A dictionary containing information about the queue on a
                 per category basis.  Keys are category names, values are
@@ -72,35 +147,35 @@ class Algo(object):
                 A list containing workflow label, how many tasks to create,
                 and the task taper adjustment.
         """
+        if not isinstance(total, dict):
+            total = {'cores': total}
+
+        # How much of each resource we need to occupy
+        fill = self.__fill(total)
+
         # Remaining workload
-        workloads = defaultdict(int)
+        demands = {}
         for wflow, (complete, units, tasks) in remaining.items():
             if not complete and tasks < 1.:
                 logger.debug("workflow {} has not enough units available to form new tasks".format(wflow.label))
                 continue
             elif units == 0:
                 continue
-            task_cores = wflow.category.cores or 1
-            workloads[wflow.category.name] += task_cores * tasks
-
-        # How many cores we need to occupy: have at least 10% of the
-        # available cores provisioned with waiting work
-        fill_cores = total_cores + max(int(0.1 * total_cores), self.__config.advanced.payload)
-        total_workload = sum(workloads.values())
+            count, req = demands.get(wflow.category.name, (0, self.__requirements(wflow.category, fill)))
+            demands[wflow.category.name] = (count + tasks, req)
 
-        if total_workload == 0:
+        if sum(count for count, _ in demands.values()) == 0:
             return []
 
+        allocation = self.__allocate(fill, demands)
+
         # contains (workflow label, tasks, taper)
         data = []
         for wflow, (complete, units, tasks) in remaining.items():
             if not complete and tasks < 1. or units == 0:
                 continue
-            task_cores = wflow.category.cores or 1
-            category_fraction = workloads[wflow.category.name] / float(total_workload)
-            workflow_fraction = task_cores * tasks / float(workloads[wflow.category.name])
-
-            needed_category_tasks = category_fraction * fill_cores / task_cores
+            needed_category_tasks, binding = allocation[wflow.category.name]
+            workflow_fraction = tasks / float(demands[wflow.category.name][0])
 
             if wflow.category.tasks_max:
                 allowed = wflow.category.tasks_max - sum(queued[wflow.category.name].values())
@@ -121,10 +196,11 @@ class Algo(object):
 
             logger.debug(("creating tasks for {w.label} (category: {w.category.name}):\n" +
                           "\tcategory task limit: ({w.category.tasks_min}, {w.category.tasks_max})\n" +
-                          "\tcategory tasks needed: {0}\n" +
+                          "\tcategory tasks needed: {0} (limited by {5})\n" +
                           "\tworkflow tasks needed: {1}\n" +
                           "\tworkflow tasks available: {2} (complete: {4})\n" +
-                          "\ttask taper: {3}").format(needed_category_tasks, needed_workflow_tasks, tasks, taper, complete, w=wflow))
+                          "\ttask taper: {3}").format(needed_category_tasks, needed_workflow_tasks, tasks,
+                                                      taper, complete, binding, w=wflow))
 
             data.append((wflow.label, needed_workflow_tasks, taper))
 
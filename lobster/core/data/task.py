@@ -1200,6 +1200,12 @@ if __name__ == '__main__':
     configfile = sys.argv[1]
     with open(configfile) as f:
         config = json.load(f)
+    # parameters shared by the tasks of a workflow
+    if 'template' in config:
+        with open(config.pop('template')) as f:
+            template = json.load(f)
+        template.update(config)
+        config = template
 
     monitor.configure(config)
 
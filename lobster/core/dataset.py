@@ -1,7 +1,11 @@
+from array import array
 from collections import defaultdict
 import fnmatch
+import itertools
 import math
+from multiprocessing.pool import ThreadPool
 import os
+import weakref
 
 from lobster import fs
 from lobster.util import Configurable
@@ -12,8 +16,13 @@ __all__ = [
 ]
 
 
-def flatten(files, matches=None):
-    """Flatten a list of directories or files to a single list of files.
+def discover(files, matches=None, recursive=False, threads=8):
+    """Find the files in a list of directories or files.
+
+    Directories are listed in parallel, one level of the directory tree
+    at a time, using the type and size information of the listing
+    instead of querying every entry separately.  Files are yielded as
+    soon as the directory containing them has been listed.
 
     Parameters
     ----------
@@ -22,44 +31,234 @@ def flatten(files, matches=None):
         matches : list
             A list of patterns to match files against. Only successfully
             matched files will be returned.
+        recursive : bool
+            Descend into subdirectories.  Otherwise, the entries of
+            directories passed in `files` are returned, including
+            subdirectories.
+        threads : int
+            How many directories to list at the same time.
 
     Returns
     -------
-        files : list
-            A list of files found in the paths passed in the input
-            parameter `files`, optionally matching the extensions in
-            `exts`.
+        files : iterator
+            Yields a tuple of the path and size of each file found.  The
+            size is `None` for files passed in `files` directly.
     """
     def matchfn(fn):
+        if not matches:
+            return True
         base = os.path.basename(fn)
         for m in matches:
             if fnmatch.fnmatch(base, m):
                 return True
         return False
-    res = []
+
     if not isinstance(files, list):
         files = [files]
+    dirs = []
     for entry in files:
         entry = os.path.expanduser(entry)
         if fs.isdir(entry):
-            res.extend(fs.ls(entry))
-        elif fs.isfile(entry):
-            res.append(entry)
-    if matches:
-        return [fn for fn in res if matchfn(fn)]
-    return res
+            dirs.append(entry)
+        elif fs.isfile(entry) and matchfn(entry):
+            yield entry, None
+
+    if len(dirs) == 0:
+        return
+
+    pool = ThreadPool(threads)
+    try:
+        while len(dirs) > 0:
+            subdirs = []
+            for listing in pool.imap_unordered(fs.lsl, dirs):
+                for path, isdir, size in listing:
+                    if isdir and recursive:
+                        subdirs.append(path)
+                    elif matchfn(path):
+                        yield path, size
+            dirs = subdirs
+    finally:
+        pool.terminate()
+
+
+def flatten(files, matches=None, recursive=False):
+    """Flatten a list of directories or files to a single list of files.
+
+    Parameters
+    ----------
+        files : str or list
+            A list of paths to expand. Can also be a string containing a path.
+        matches : list
+            A list of patterns to match files against. Only successfully
+            matched files will be returned.
+        recursive : bool
+            Descend into subdirectories.
+
+    Returns
+    -------
+        files : list
+            A list of files found in the paths passed in the input
+            parameter `files`, optionally matching the extensions in
+            `exts`.
+    """
+    return [fn for fn, _ in discover(files, matches, recursive)]
+
+
+class LumiRange(object):
+
+    """A contiguous range of luminosity sections within a run.
+
+    Behaves like the list of `(run, lumi)` tuples it describes, without
+    holding them in memory.
+
+    Parameters
+    ----------
+        run : int
+            The run number.
+        first : int
+            The first luminosity section.
+        last : int
+            The last luminosity section, inclusive.
+    """
+
+    def __init__(self, run, first, last):
+        self.run = run
+        self.first = first
+        self.last = last
+
+    def __iter__(self):
+        for lumi in xrange(self.first, self.last + 1):
+            yield (self.run, lumi)
+
+    def __len__(self):
+        return max(self.last - self.first + 1, 0)
+
+    def __repr__(self):
+        return 'LumiRange({0}, {1}, {2})'.format(self.run, self.first, self.last)
+
+
+class LumiArray(object):
+
+    """A list of `(run, lumi)` tuples stored in typed arrays.
+
+    Uses a fraction of the memory and pickle size of a list of tuples,
+    which matters for datasets with millions of luminosity sections.
+    Supports the list operations used on `FileInfo.lumis`.
+
+    Parameters
+    ----------
+        lumis : iterable
+            Initial `(run, lumi)` tuples.
+    """
+    __slots__ = ('runs', 'lumis')
+
+    def __init__(self, lumis=None):
+        self.runs = array('i')
+        self.lumis = array('i')
+        if lumis is not None:
+            self.extend(lumis)
+
+    def append(self, lumi):
+        run, lumi = lumi
+        self.runs.append(run)
+        self.lumis.append(lumi)
+
+    def extend(self, lumis):
+        if isinstance(lumis, LumiArray):
+            self.runs.extend(lumis.runs)
+            self.lumis.extend(lumis.lumis)
+        else:
+            for lumi in lumis:
+                self.append(lumi)
+
+    def __iadd__(self, lumis):
+        self.extend(lumis)
+        return self
+
+    def __add__(self, lumis):
+        return list(self) + list(lumis)
+
+    def __radd__(self, lumis):
+        return list(lumis) + list(self)
+
+    def __iter__(self):
+        return itertools.izip(self.runs, self.lumis)
+
+    def __len__(self):
+        return len(self.runs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            res = LumiArray()
+            res.runs = self.runs[index]
+            res.lumis = self.lumis[index]
+            return res
+        return (self.runs[index], self.lumis[index])
+
+    def __eq__(self, other):
+        try:
+            return list(self) == [tuple(lumi) for lumi in other]
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    @classmethod
+    def fromstring(cls, runs, lumis):
+        """Create a `LumiArray` from the machine representation of its
+        runs and luminosity sections, as obtained by `array.tostring()`.
+        """
+        res = cls()
+        res.runs.fromstring(runs)
+        res.lumis.fromstring(lumis)
+        return res
+
+    def __getstate__(self):
+        return (self.runs.tostring(), self.lumis.tostring())
+
+    def __setstate__(self, state):
+        self.runs = array('i')
+        self.lumis = array('i')
+        self.runs.fromstring(state[0])
+        self.lumis.fromstring(state[1])
+
+    def __repr__(self):
+        return 'LumiArray({0})'.format(list(self))
 
 
 class FileInfo(object):
+    __slots__ = ('_lumis', 'events', 'size')
 
     def __init__(self):
-        self.lumis = []
+        self._lumis = LumiArray()
         self.events = 0
         self.size = 0
 
+    @property
+    def lumis(self):
+        return self._lumis
+
+    @lumis.setter
+    def lumis(self, lumis):
+        if not isinstance(lumis, (LumiArray, LumiRange)):
+            lumis = LumiArray(lumis)
+        self._lumis = lumis
+
+    def __getstate__(self):
+        return (self._lumis, self.events, self.size)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # pickled before FileInfo used slots
+            state = (state['lumis'], state['events'], state['size'])
+        lumis, self.events, self.size = state
+        self.lumis = lumis
+
     def __repr__(self):
-        descriptions = ['{a}={v}'.format(a=attribute, v=getattr(self, attribute)) for attribute in self.__dict__]
-        return 'FileInfo({0})'.format(',\n'.join(descriptions))
+        return 'FileInfo(lumis={0},\nevents={1},\nsize={2})'.format(self.lumis, self.events, self.size)
 
 
 class DatasetInfo(object):
@@ -67,6 +266,7 @@ class DatasetInfo(object):
     def __init__(self):
         self.file_based = False
         self.files = defaultdict(FileInfo)
+        self.split_by = None
         self.stop_on_file_boundary = False
         self.tasksize = 1
         self.total_events = 0
@@ -96,31 +296,110 @@ class Dataset(Configurable):
         patterns: list
             A list of shell-style file patterns to match filenames against.
             Defaults to `None` and will use all files considered.
+        watch : bool
+            Periodically look for new files and process them, too.  Lobster
+            will keep running until stopped.  See
+            :attr:`~lobster.core.config.AdvancedOptions.watch_interval`.
+        recursive : bool
+            Also process files in subdirectories of the directories
+            specified.
+        sizes : bool
+            Record the size of the files.
+        events_reader : callable
+            Called with the path of each file, relative to the input
+            storage, to determine the number of events it contains.  Used
+            with `events_per_task`.  Has to be a function defined at the
+            top level of a module, as the configuration is pickled.
+        events_per_task : int
+            Combine files into tasks of about this many events, instead of
+            a fixed number of files.  Requires `events_reader`.  Files
+            exceeding the target are processed in a task of their own.
+            Can be changed by Lobster to match the user-specified task
+            runtime.
+        bytes_per_task : int
+            Combine files into tasks of about this many bytes, instead of
+            a fixed number of files.
+        probe_threads : int
+            How many files to read the number of events of at the same
+            time.
     """
     _mutable = {}
 
-    def __init__(self, files, files_per_task=1, patterns=None):
+    # probed files of each dataset, to not probe them again on rescans
+    __probed = weakref.WeakKeyDictionary()
+
+    def __init__(self, files, files_per_task=1, patterns=None, watch=False, recursive=False, sizes=False,
+                 events_reader=None, events_per_task=None, bytes_per_task=None, probe_threads=8):
         self.files = files
         self.files_per_task = files_per_task
         self.patterns = patterns
+        self.watch = watch
+        self.recursive = recursive
+        self.sizes = sizes or bytes_per_task is not None
+        self.events_reader = events_reader
+        self.events_per_task = events_per_task
+        self.bytes_per_task = bytes_per_task
+        self.probe_threads = probe_threads
         self.total_units = 0
 
+        if events_per_task and bytes_per_task:
+            raise AttributeError("only one of `events_per_task` and `bytes_per_task` can be specified")
+        if events_per_task and not events_reader:
+            raise AttributeError("`events_per_task` requires an `events_reader`")
+
     def validate(self):
-        return len(flatten(self.files, self.patterns)) > 0
+        files = discover(self.files, self.patterns, self.recursive)
+        try:
+            return next(files, None) is not None
+        finally:
+            files.close()
+
+    def __probe(self, entry):
+        fn, size = entry
+        if self.sizes and size is None:
+            size = fs.getsize(fn)
+        events = self.events_reader(fn) if self.events_reader else 0
+        return fn, int(size or 0), int(events or 0)
 
     def get_info(self):
         dset = DatasetInfo()
         dset.file_based = True
-
-        files = flatten(self.files, self.patterns)
         dset.tasksize = self.files_per_task
-        dset.total_units = len(files)
-        self.total_units = len(files)
-
-        for fn in files:
-            # hack because it will be slow to stat and open
-            # all the input files to read the size/run/lumi info
+        if self.events_per_task:
+            dset.split_by = 'events'
+            dset.tasksize = self.events_per_task
+        elif self.bytes_per_task:
+            dset.split_by = 'bytes'
+            dset.tasksize = self.bytes_per_task
+
+        files = discover(self.files, self.patterns, self.recursive)
+        if self.events_reader or self.sizes:
+            # only probe files that are new or changed in size since the
+            # last scan
+            probed = Dataset.__probed.get(self, {})
+            files = list(files)
+            missing = [entry for entry in files if entry not in probed]
+            if len(missing) > 0:
+                pool = ThreadPool(self.probe_threads)
+                try:
+                    probed.update(zip(missing, pool.map(self.__probe, missing)))
+                finally:
+                    pool.terminate()
+            Dataset.__probed[self] = dict((entry, probed[entry]) for entry in files)
+            files = [probed[entry] for entry in files]
+        else:
+            files = ((fn, 0, 0) for fn, _ in files)
+
+        for fn, size, events in files:
+            # hack because it will be slow to open
+            # all the input files to read the run/lumi info
             dset.files[fn].lumis = [(-1, -1)]
+            dset.files[fn].size = size
+            dset.files[fn].events = events
+
+        dset.total_events = sum(info.events for info in dset.files.itervalues())
+        dset.total_units = len(dset.files)
+        self.total_units = len(dset.files)
 
         return dset
 
@@ -188,7 +467,7 @@ class ProductionDataset(Configurable):
         dset = DatasetInfo()
         dset.file_based = True
 
-        dset.files[None].lumis = [(1, x) for x in range(1, self.total_units + 1)]
+        dset.files[None].lumis = LumiRange(1, 1, self.total_units)
         dset.total_units = self.total_units
         dset.tasksize = self.lumis_per_task
 
@@ -237,7 +516,7 @@ class MultiProductionDataset(ProductionDataset):
 
         files = flatten(self.gridpacks)
         for run, fn in enumerate(files):
-            dset.files[fn].lumis = [(run, x) for x in range(1, self.lumis_per_gridpack + 1)]
+            dset.files[fn].lumis = LumiRange(run, 1, self.lumis_per_gridpack)
 
         self.total_units = len(files) * self.lumis_per_gridpack
         dset.total_units = self.total_units
@@ -0,0 +1,169 @@
+import math
+
+from lobster.util import Configurable
+
+
+class RuntimeModel(Configurable):
+
+    """
+    Base class of models predicting the runtime of tasks.
+
+    Models are fed the runtime of every successful processing task, and are
+    used to size new tasks to match the runtime of their
+    :class:`~lobster.core.workflow.Category`.  Sizes are measured in
+    units, or in events for workflows split by events.
+
+    The state of a model is built up while Lobster is running, and is not
+    saved with the configuration.
+    """
+
+    _mutable = {}
+
+    def __init__(self):
+        self._workflows = {}
+        self._hosts = {}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_workflows'] = {}
+        state['_hosts'] = {}
+        return state
+
+    def known(self, workflow):
+        """Returns whether the model has seen tasks of `workflow`.
+        """
+        return workflow in self._workflows
+
+    def observe(self, workflow, size, runtime, cache=None, host=None):
+        """Add the runtime of a task to the model.
+
+        Parameters
+        ----------
+            workflow : str
+                The label of the workflow the task belongs to.
+            size : int
+                The size of the task.
+            runtime : float
+                The time the task spent processing, in seconds.
+            cache : int
+                The state of the cache the task saw: 0 for a cold, 1 for
+                a hot cache.
+            host : str
+                The host the task ran on.
+
+        Returns
+        -------
+            error : float
+                The relative error of the runtime predicted for the task,
+                or `None` if the model could not make a prediction.
+        """
+        raise NotImplementedError
+
+    def predict(self, workflow, size, cache=None, host=None):
+        """Returns the predicted runtime of a task, or `None`.
+        """
+        raise NotImplementedError
+
+    def tasksize(self, workflow, runtime):
+        """Returns the size of a task of `workflow` to run for `runtime`
+        seconds, or `None` if the model does not know enough about the
+        workflow yet.
+        """
+        raise NotImplementedError
+
+    def error(self, workflows):
+        """Returns the average relative error of the runtime predictions
+        for `workflows`, or `None`.
+        """
+        raise NotImplementedError
+
+
+class EWMARuntimeModel(RuntimeModel):
+
+    """
+    Estimates the cost per unit of a workflow with an exponentially
+    weighted moving average.
+
+    The cost is tracked separately for each cache state, and tasks are
+    sized with the cost expected from the recent mix of cache states.
+    The speed of hosts relative to the expected cost is tracked, too, and
+    the cost of tasks is normalized by the speed of their host before
+    entering the average.
+
+    Parameters
+    ----------
+        alpha : float
+            The weight of the latest task in the averages.  Larger values
+            will follow changes in the runtime more quickly.
+        minimum : int
+            How many tasks of a workflow to observe before making
+            predictions.
+    """
+
+    _mutable = {}
+
+    def __init__(self, alpha=0.05, minimum=10):
+        super(EWMARuntimeModel, self).__init__()
+        self.alpha = alpha
+        self.minimum = minimum
+
+    def __average(self, old, new):
+        if old is None:
+            return new
+        return (1 - self.alpha) * old + self.alpha * new
+
+    def __cost(self, state, cache):
+        if cache in state['cost']:
+            return state['cost'][cache]
+        return self.__expected_cost(state)
+
+    def __expected_cost(self, state):
+        total = sum(state['mix'].values())
+        return sum(state['mix'][c] * state['cost'][c] for c in state['mix']) / total
+
+    def observe(self, workflow, size, runtime, cache=None, host=None):
+        if size <= 0 or runtime <= 0:
+            return None
+
+        error = None
+        prediction = self.predict(workflow, size, cache, host)
+        state = self._workflows.setdefault(workflow, {'cost': {}, 'mix': {}, 'count': 0, 'error': None})
+        if prediction is not None:
+            error = abs(prediction - runtime) / runtime
+            state['error'] = self.__average(state['error'], error)
+
+        factor = self._hosts.get(host, 1.)
+        cost = runtime / float(size)
+
+        if host is not None and cache in state['cost']:
+            # Clip the ratio to not let single outliers dominate the
+            # speed of a host.
+            ratio = min(max(cost / self.__cost(state, cache), .1), 10.)
+            self._hosts[host] = self.__average(factor, ratio)
+
+        state['cost'][cache] = self.__average(state['cost'].get(cache), cost / factor)
+        for c in state['mix']:
+            state['mix'][c] *= 1 - self.alpha
+        state['mix'][cache] = state['mix'].get(cache, 0) + self.alpha
+        state['count'] += 1
+
+        return error
+
+    def predict(self, workflow, size, cache=None, host=None):
+        state = self._workflows.get(workflow)
+        if state is None or state['count'] < self.minimum:
+            return None
+        return size * self.__cost(state, cache) * self._hosts.get(host, 1.)
+
+    def tasksize(self, workflow, runtime):
+        state = self._workflows.get(workflow)
+        if state is None or state['count'] < self.minimum:
+            return None
+        return max(1, int(math.ceil(runtime / self.__expected_cost(state))))
+
+    def error(self, workflows):
+        errors = [self._workflows[w]['error'] for w in workflows
+                  if self.known(w) and self._workflows[w]['error'] is not None]
+        if len(errors) == 0:
+            return None
+        return sum(errors) / len(errors)
@@ -3,15 +3,19 @@ import glob
 import json
 import logging
 import os
+import Queue
 import re
 import shutil
 import socket
 import subprocess
 import sys
+import threading
+import time
 import work_queue as wq
 
 from collections import defaultdict, Counter
 from hashlib import sha1
+from multiprocessing.pool import ThreadPool
 
 from lobster import fs, util
 from lobster.cmssw import dash
@@ -24,6 +28,53 @@ from WMCore.Storage.SiteLocalConfig import loadSiteLocalConfig, SiteConfigError
 logger = logging.getLogger('lobster.source')
 
 
+def parameter_template(parameters):
+    """Create the template of the parameters shared by the tasks of a
+    workflow.
+
+    The template is a deep copy of `parameters`, as lists such as the
+    storage element URLs are shared with the configuration and may be
+    shuffled in place, see :meth:`~lobster.se.StorageConfiguration.preprocess`.
+
+    Parameters
+    ----------
+        parameters : dict
+            The parameters of a task.
+
+    Returns
+    -------
+        template : dict
+            The parameters of `parameters` not specific to the task, as
+            written to the template file.
+    """
+    template = dict((k, v) for k, v in parameters.items() if k not in ('mask', 'monitoring', 'output files'))
+    return json.loads(json.dumps(template))
+
+
+def split_parameters(parameters, template):
+    """Split the parameters of a task into a template and a delta.
+
+    The delta holds the parameters that differ from the template, which
+    `task.py` applies on top of the template.
+
+    Parameters
+    ----------
+        parameters : dict
+            The parameters of a task.
+        template : dict
+            The parameters shared by the tasks of a workflow.
+
+    Returns
+    -------
+        delta : dict
+            The parameters to send with the task, or `None` if the
+            template has parameters the task does not have.
+    """
+    if any(key not in parameters for key in template):
+        return None
+    return dict((k, v) for k, v in parameters.items() if k not in template or template[k] != v)
+
+
 class ReleaseSummary(object):
 
     """Summary of returned tasks.
@@ -70,6 +121,16 @@ class ReleaseSummary(object):
     def monitor(self, taskid):
         self.__monitors.append(taskid)
 
+    def update(self, other):
+        """Add the tasks of another summary.
+        """
+        for status, ids in other.__exe.items():
+            self.__exe.setdefault(status, []).extend(ids)
+        for flag, ids in other.__wq.items():
+            self.__wq.setdefault(flag, []).extend(ids)
+        self.__taskdirs.update(other.__taskdirs)
+        self.__monitors.extend(other.__monitors)
+
     def __str__(self):
         s = "received the following task(s):\n"
         for status in sorted(self.__exe.keys()):
@@ -88,10 +149,64 @@ class ReleaseSummary(object):
         return s[:-1]
 
 
+class TaskMaterializer(threading.Thread):
+
+    """Materialize tasks in the background.
+
+    Creates the directories, parameters and handlers of tasks passed to
+    :meth:`submit`, which are handed back by :meth:`collect` once done.
+    The database is never accessed from this thread.
+
+    Parameters
+    ----------
+        materialize : function
+            Called with the task information obtained from the database
+            and the dashboard registration of the task.
+    """
+
+    def __init__(self, materialize):
+        super(TaskMaterializer, self).__init__(name='materializer')
+        self.daemon = True
+        self.__materialize = materialize
+        self.__input = Queue.Queue()
+        self.__output = Queue.Queue()
+
+    def run(self):
+        while True:
+            item = self.__input.get()
+            if item is None:
+                return
+            id = item[0][0]
+            try:
+                self.__output.put((id, self.__materialize(*item), None))
+            except Exception:
+                self.__output.put((id, None, sys.exc_info()))
+
+    def submit(self, info, registration):
+        self.__input.put((info, registration))
+
+    def collect(self, block=False):
+        """Returns a materialized task as a tuple of its id, the result of
+        the materialization, and the exception information if it failed,
+        or `None` if no task is ready.
+        """
+        try:
+            return self.__output.get(block)
+        except Queue.Empty:
+            return None
+
+    def stop(self):
+        """Finish materializing the tasks submitted and stop the thread.
+        """
+        self.__input.put(None)
+        self.join()
+
+
 class TaskProvider(util.Timing):
 
     def __init__(self, config):
-        util.Timing.__init__(self, 'dash', 'handler', 'updates', 'elk', 'transfers', 'cleanup', 'propagate', 'sqlite')
+        util.Timing.__init__(self, 'dash', 'handler', 'updates', 'elk', 'transfers', 'cleanup', 'propagate', 'sqlite', 'rescan',
+                             'process')
 
         self.config = config
         self.basedirs = [config.base_directory, config.startup_directory]
@@ -144,7 +259,31 @@ class TaskProvider(util.Timing):
         util.sendemail("Your Lobster project has started!", self.config)
 
         self.__taskhandlers = {}
+        # Running tasks with a duplicate, mapping to the id of the other
+        # task and whether they are the duplicate; and tasks to cancel.
+        self.__duplicates = {}
+        self.__cancel = []
+        # Time since which categories have no queued tasks, i.e., all
+        # their tasks submitted before are running.
+        self.__drained = {}
+        # Tasks being materialized, mapping to their category and
+        # workflow, and ones to discard once materialized.
+        self.__pipeline = {}
+        self.__discard = set()
+        # Parameter templates by workflow and merge flag, as the
+        # parameters, file name and path.
+        self.__templates = {}
+        self.__materializer = TaskMaterializer(self.__materialize)
+        # Processes returned tasks, see `release`
+        self.__releaser = ThreadPool(self.config.advanced.release_threads)
         self.__store = unit.UnitStore(self.config)
+        self.__store.recover()
+        # Input files to clean up, once the updates of the tasks that
+        # processed them are written to the database
+        self.__input_files = defaultdict(set)
+        # Datasets are registered in full right away, the first rescan of
+        # watched ones can wait
+        self.__last_rescan = time.time()
 
         self.__setup_inputs()
         self.copy_siteconf()
@@ -235,6 +374,8 @@ class TaskProvider(util.Timing):
         p_helper = os.path.join(os.path.dirname(self.parrot_path), 'lib', 'lib64', 'libparrot_helper.so')
         shutil.copy(p_helper, self.parrot_lib)
 
+        self.__materializer.start()
+
     def copy_siteconf(self):
         storage_in = os.path.join(os.path.dirname(__file__), 'data', 'siteconf', 'PhEDEx', 'storage.xml')
         storage_out = os.path.join(self.siteconf, 'PhEDEx', 'storage.xml')
@@ -314,17 +455,37 @@ class TaskProvider(util.Timing):
         Will create tasks for all workflows, if possible.  Merge tasks are
         always created, given enough successful tasks.  The remaining tasks
         are split proportionally between the categories based on remaining
-        resources multiplied by cores used per task.  Within categories,
+        work multiplied by the resources used per task.  Within categories,
         tasks are created based on the same logic.
 
+        Tasks are materialized in the background, and handed out once
+        ready.  Tasks still being materialized count as queued.  When no
+        tasks are waiting in the queue, all tasks are waited for.
+
         Parameters
         ----------
-            total : int
-                Number of cores available.
+            total : dict
+                The cores, memory, and disk available.
             tasks : dict
                 Dictionary with category names as keys and the number of
                 tasks in the queue as values.
         """
+        # Availability of units needs the results of all returned tasks
+        self.flush()
+
+        starved = all(v['queued'] == 0 for v in tasks.values())
+        tasks = dict((c, dict(v)) for c, v in tasks.items())
+        for category, _ in self.__pipeline.values():
+            if category in tasks:
+                tasks[category]['queued'] += 1
+
+        now = int(time.time())
+        for category, counts in tasks.items():
+            if counts['queued'] > 0:
+                self.__drained.pop(category, None)
+            else:
+                self.__drained.setdefault(category, now)
+
         remaining = dict((wflow, self.__store.work_left(wflow.label)) for wflow in self.config.workflows)
 
         taskinfos = []
@@ -334,138 +495,259 @@ class TaskProvider(util.Timing):
             infos = self.__store.pop_units(label, ntasks, taper)
             logger.debug("created {} tasks for workflow {}".format(len(infos), label))
             taskinfos += infos
+        if self.config.advanced.speculation_threshold > 0:
+            for wflow in self.config.workflows:
+                # Work Queue does not report when tasks start, so tasks of
+                # categories with queued tasks may not be running yet
+                started = self.__drained.get(wflow.category.name)
+                if started is None:
+                    continue
+                for original, info in self.__store.pop_speculative(wflow.label,
+                                                                   self.config.advanced.speculation_threshold,
+                                                                   self.config.advanced.speculation_multiplier,
+                                                                   started):
+                    self.__duplicates[original] = (info[0], False)
+                    self.__duplicates[info[0]] = (original, True)
+                    taskinfos.append(info)
+
+        if len(taskinfos) > 0:
+            registration = dict(
+                zip(
+                    [t[0] for t in taskinfos],
+                    self.config.advanced.dashboard.register_tasks(t[0] for t in taskinfos)
+                )
+            )
+            self.config.advanced.dashboard.free()
+
+            for info in taskinfos:
+                (id, label, _, _, _, merge) = info
+                wflow = getattr(self.config.workflows, label)
+                self.__pipeline[id] = ('merge' if merge else wflow.category.name, label)
+                self.__materializer.submit(info, registration[id])
+
+        return self.__collect(starved)
 
-        if not taskinfos or len(taskinfos) == 0:
-            return []
+    def __collect(self, block):
+        """Hand out materialized tasks.
 
+        Parameters
+        ----------
+            block : bool
+                Wait for all tasks being materialized.
+        """
         tasks = []
         ids = []
-        registration = dict(
-            zip(
-                [t[0] for t in taskinfos],
-                self.config.advanced.dashboard.register_tasks(t[0] for t in taskinfos)
-            )
-        )
+        while len(self.__pipeline) > 0:
+            item = self.__materializer.collect(block)
+            if item is None:
+                break
+            id, result, error = item
+            _, label = self.__pipeline.pop(id)
+            if error:
+                for i in ids:
+                    self.__taskhandlers.pop(i)
+                wflow = getattr(self.config.workflows, label)
+                self.__abort([id] + ids,
+                             [os.path.join(wflow.workdir, 'running', util.id2dir(id))] + [t[-1] for t in tasks])
+                raise error[0], error[1], error[2]
+
+            task, handler, missing = result
+            if id in self.__discard:
+                self.__discard.remove(id)
+                wflow = getattr(self.config.workflows, label)
+                shutil.rmtree(os.path.join(wflow.workdir, 'running', util.id2dir(id)), ignore_errors=True)
+                continue
+
+            if len(missing) > 0:
+                template = "the following have been marked as failed because their output could not be found: {0}"
+                logger.warning(template.format(", ".join(map(str, missing))))
+                self.__store.update_missing(missing)
 
-        for (id, label, files, lumis, unique_arg, merge) in taskinfos:
-            wflow = getattr(self.config.workflows, label)
+            self.__taskhandlers[id] = handler
+            tasks.append(task)
             ids.append(id)
 
-            jdir = util.taskdir(wflow.workdir, id)
-            inputs = list(self._inputs)
-            inputs.append((os.path.join(jdir, 'parameters.json'), 'parameters.json', False))
-            outputs = [(os.path.join(jdir, f), f) for f in ['report.json']]
-
-            monitorid, syncid = registration[id]
-
-            config = {
-                'mask': {
-                    'files': None,
-                    'lumis': None,
-                    'events': None
-                },
-                'monitoring': {
-                    'monitorid': monitorid,
-                    'syncid': syncid,
-                    'taskid': self.taskid,
-                },
-                'default host': self.__host,
-                'default ce': self.__ce,
-                'default se': self.__se,
-                'arguments': None,
-                'output files': [],
-                'want summary': True,
-                'executable': None,
-                'pset': None,
-                'prologue': None,
-                'epilogue': None,
-                'gridpack': False
-            }
-
-            cmd = 'sh wrapper.sh python task.py parameters.json'
-            env = {
-                'LOBSTER_CVMFS_PROXY': self.__cvmfs_proxy,
-                'LOBSTER_FRONTIER_PROXY': self.__frontier_proxy,
-                'LOBSTER_OSG_VERSION': self.config.advanced.osg_version
-            }
-
-            if merge:
-                missing = []
-                infiles = []
-                inreports = []
-
-                for task, _, _, _ in lumis:
-                    report = self.get_report(label, task)
-                    _, infile = list(wflow.get_outputs(task))[0]
-
-                    if os.path.isfile(report):
-                        inreports.append(report)
-                        infiles.append((task, infile))
-                    else:
-                        missing.append(task)
-
-                if len(missing) > 0:
-                    template = "the following have been marked as failed because their output could not be found: {0}"
-                    logger.warning(template.format(", ".join(map(str, missing))))
-                    self.__store.update_missing(missing)
-
-                if len(infiles) <= 1:
-                    # FIXME report these back to the database and then skip
-                    # them.  Without failing these task ids, accounting of
-                    # running tasks is going to be messed up.
-                    logger.debug("skipping task {0} with only one input file!".format(id))
-
-                # takes care of the fields set to None in config
-                wflow.adjust(config, env, jdir, inputs, outputs, merge, reports=inreports)
-
-                files = infiles
-            else:
-                # takes care of the fields set to None in config
-                wflow.adjust(config, env, jdir, inputs, outputs, merge, unique=unique_arg)
+        if len(ids) > 0:
+            logger.info("creating task(s) {0}".format(", ".join(map(str, ids))))
 
-            handler = wflow.handler(id, files, lumis, jdir, merge=merge)
+        return tasks
 
-            # set input/output transfer parameters
-            self._storage.preprocess(config, merge or wflow.parent)
-            # adjust file and lumi information in config, add task specific
-            # input/output files
-            handler.adjust(config, inputs, outputs, self._storage)
+    def __abort(self, failed, dirs):
+        """Roll back the tasks of a block that failed to materialize.
 
-            with open(os.path.join(jdir, 'parameters.json'), 'w') as f:
-                json.dump(config, f, indent=2)
-                f.write('\n')
+        Waits for the tasks remaining in the pipeline, and returns the
+        units of these and of the `failed` ones, as none of them will be
+        handed out.
 
-            tasks.append(('merge' if merge else wflow.category.name, cmd, id, inputs, outputs, env, jdir))
+        Parameters
+        ----------
+            failed : list
+                The ids of tasks created, but not handed out.
+            dirs : list
+                The directories of these tasks.
+        """
+        while len(self.__pipeline) > 0:
+            id, _, _ = self.__materializer.collect(True)
+            _, label = self.__pipeline.pop(id)
+            self.__discard.discard(id)
+            wflow = getattr(self.config.workflows, label)
+            failed.append(id)
+            dirs.append(os.path.join(wflow.workdir, 'running', util.id2dir(id)))
+
+        logger.error("rolling back {0} task(s) that could not be created".format(len(failed)))
+        self.__store.rollback_tasks(failed)
+        for d in dirs:
+            shutil.rmtree(d, ignore_errors=True)
+
+    def __materialize(self, info, registration):
+        """Create the directory, parameters and handler of a task.
+
+        Called in the background by the :class:`TaskMaterializer`, and
+        must not access the database.
+
+        Returns
+        -------
+            task : tuple
+                The category, command, id, inputs, outputs, environment,
+                and directory of the task.
+            handler : :class:`~lobster.core.task.TaskHandler`
+                The handler of the task.
+            missing : list
+                Ids of tasks to merge with missing outputs, which should be
+                marked as failed.
+        """
+        (id, label, files, lumis, unique_arg, merge) = info
+        wflow = getattr(self.config.workflows, label)
+
+        jdir = util.taskdir(wflow.workdir, id)
+        inputs = list(self._inputs)
+        inputs.append((os.path.join(jdir, 'parameters.json'), 'parameters.json', False))
+        outputs = [(os.path.join(jdir, f), f) for f in ['report.json']]
+
+        monitorid, syncid = registration
+
+        config = {
+            'mask': {
+                'files': None,
+                'lumis': None,
+                'events': None
+            },
+            'monitoring': {
+                'monitorid': monitorid,
+                'syncid': syncid,
+                'taskid': self.taskid,
+            },
+            'default host': self.__host,
+            'default ce': self.__ce,
+            'default se': self.__se,
+            'arguments': None,
+            'output files': [],
+            'want summary': True,
+            'executable': None,
+            'pset': None,
+            'prologue': None,
+            'epilogue': None,
+            'gridpack': False
+        }
+
+        cmd = 'sh wrapper.sh python task.py parameters.json'
+        env = {
+            'LOBSTER_CVMFS_PROXY': self.__cvmfs_proxy,
+            'LOBSTER_FRONTIER_PROXY': self.__frontier_proxy,
+            'LOBSTER_OSG_VERSION': self.config.advanced.osg_version
+        }
+
+        missing = []
+        if merge:
+            infiles = []
+            inreports = []
+
+            for task, _, _, _ in lumis:
+                report = self.get_report(label, task)
+                _, infile = list(wflow.get_outputs(task))[0]
+
+                if os.path.isfile(report):
+                    inreports.append(report)
+                    infiles.append((task, infile))
+                else:
+                    missing.append(task)
 
-            self.__taskhandlers[id] = handler
+            if len(infiles) <= 1:
+                # FIXME report these back to the database and then skip
+                # them.  Without failing these task ids, accounting of
+                # running tasks is going to be messed up.
+                logger.debug("skipping task {0} with only one input file!".format(id))
 
-        logger.info("creating task(s) {0}".format(", ".join(map(str, ids))))
+            # takes care of the fields set to None in config
+            wflow.adjust(config, env, jdir, inputs, outputs, merge, reports=inreports)
 
-        self.config.advanced.dashboard.free()
+            files = infiles
+        else:
+            # takes care of the fields set to None in config
+            wflow.adjust(config, env, jdir, inputs, outputs, merge, unique=unique_arg)
 
-        return tasks
+        handler = wflow.handler(id, files, lumis, jdir, merge=merge)
+
+        # set input/output transfer parameters
+        self._storage.preprocess(config, merge or wflow.parent)
+        # adjust file and lumi information in config, add task specific
+        # input/output files
+        handler.adjust(config, inputs, outputs, self._storage)
+
+        with open(os.path.join(jdir, 'parameters.json'), 'w') as f:
+            json.dump(self.__parameters(wflow, merge, config, inputs), f, indent=2)
+            f.write('\n')
+
+        task = ('merge' if merge else wflow.category.name, cmd, id, inputs, outputs, env, jdir)
+        return task, handler, missing
 
     def release(self, tasks):
+        """Process returned tasks and update the database.
+
+        Tasks are processed in two stages: the logs, reports and task
+        directories of tasks are handled in parallel, by
+        `AdvancedOptions.release_threads` threads.  Then the results are
+        collected in the order of `tasks`, and the database updates are
+        deferred.  Tasks with a duplicate are processed in the second
+        stage, as their outcome depends on the other task.
+        """
         fail_cleanup = []
         merge_cleanup = []
-        input_cleanup = []
         update = defaultdict(list)
         propagate = defaultdict(dict)
         input_files = defaultdict(set)
         summary = ReleaseSummary()
         transfers = defaultdict(lambda: defaultdict(Counter))
+        duplicates = ([], [])
 
         with self.measure('dash'):
             self.config.advanced.dashboard.update_task_status(
                 (task.tag, dash.DONE) for task in tasks
             )
 
+        with self.measure('process'):
+            parallel = [task for task in tasks if task.tag in self.__taskhandlers and task.tag not in self.__duplicates]
+            results = dict(zip([task.tag for task in parallel], self.__releaser.map(self.__process_parallel, parallel)))
+
         for task in tasks:
-            with self.measure('updates'):
-                handler = self.__taskhandlers[task.tag]
-                failed, task_update, file_update, unit_update = handler.process(task, summary, transfers)
+            if task.tag in results:
+                with self.measure('updates'):
+                    result, task_summary, task_transfers = results[task.tag]
+                    failed, task_update, file_update, unit_update = result
+                    summary.update(task_summary)
+                    for dataset, counts in task_transfers.items():
+                        for protocol, counter in counts.items():
+                            transfers[dataset][protocol] += counter
+            elif task.tag not in self.__taskhandlers:
+                logger.debug("skipping task {0}, which lost against its duplicate".format(task.tag))
+                continue
+            else:
+                with self.measure('updates'):
+                    failed, task_update, file_update, unit_update = self.__process(
+                        task, summary, transfers, duplicates, fail_cleanup)
 
-                wflow = getattr(self.config.workflows, handler.dataset)
+            handler = self.__taskhandlers[task.tag]
+            wflow = getattr(self.config.workflows, handler.dataset)
 
             with self.measure('elk'):
                 if self.config.elk:
@@ -474,12 +756,8 @@ class TaskProvider(util.Timing):
 
             with self.measure('handler'):
                 if failed:
-                    faildir = util.move(wflow.workdir, handler.id, 'failed')
-                    summary.dir(str(handler.id), faildir)
                     fail_cleanup.extend([lf for rf, lf in handler.outputs])
                 else:
-                    util.move(wflow.workdir, handler.id, 'successful')
-
                     merge = isinstance(handler, MergeTaskHandler)
 
                     if (wflow.merge_size <= 0 or merge) and len(handler.outputs) > 0:
@@ -503,16 +781,26 @@ class TaskProvider(util.Timing):
                 (task.tag, dash.RETRIEVED) for task in tasks
             )
 
+        deferred = []
+        if len(duplicates[0]) > 0 or len(duplicates[1]) > 0:
+            deferred.append(('resolve_duplicates', duplicates))
         if len(update) > 0:
-            with self.measure('sqlite'):
-                logger.info(summary)
-                self.__store.update_units(update)
+            logger.info(summary)
+            deferred.append(('update_units', (dict(update),)))
+        for label, infos in propagate.items():
+            unique_args = getattr(self.config.workflows, label).unique_arguments
+            deferred.append(('register_files', (infos, label, unique_args)))
+        if len(transfers) > 0:
+            deferred.append(('update_transfers', (dict((k, dict(v)) for k, v in transfers.items()),)))
 
-        with self.measure('cleanup'):
-            if len(input_files) > 0:
-                input_cleanup.extend(self.__store.finished_files(input_files))
+        with self.measure('sqlite'):
+            self.__store.defer(deferred)
+
+        for label, files in input_files.items():
+            self.__input_files[label].update(files)
 
-            for cleanup in [fail_cleanup, merge_cleanup + input_cleanup]:
+        with self.measure('cleanup'):
+            for cleanup in [fail_cleanup, merge_cleanup]:
                 if len(cleanup) > 0:
                     try:
                         fs.remove(*cleanup)
@@ -521,14 +809,9 @@ class TaskProvider(util.Timing):
                     except ValueError as e:
                         logger.error("error removing {0}:\n{1}".format(task.tag, e))
 
-        with self.measure('propagate'):
-            for label, infos in propagate.items():
-                unique_args = getattr(self.config.workflows, label).unique_arguments
-                self.__store.register_files(infos, label, unique_args)
-
-        if len(transfers) > 0:
-            with self.measure('transfers'):
-                self.__store.update_transfers(transfers)
+        # The summary indexed by ELK has to include the updates above,
+        # which would otherwise only be written once the buffer is full.
+        self.flush(force=bool(self.config.elk))
 
         if self.config.elk:
             with self.measure('elk'):
@@ -537,14 +820,192 @@ class TaskProvider(util.Timing):
                 except Exception as e:
                     logger.error('ELK failed to index summary:\n{}'.format(e))
 
+    def __process(self, task, summary, transfers, duplicates, cleanup):
+        """Process the log and report of a returned task, and move its
+        directory.
+
+        Parameters
+        ----------
+            task : :class:`work_queue.Task`
+                The returned task.
+            summary : :class:`ReleaseSummary`
+                The summary to update.
+            transfers : dict
+                The transfer statistics to update.
+            duplicates : tuple
+                Lists of unit transfers between tasks and tasks to abort,
+                to be updated if the task has a duplicate.
+            cleanup : list
+                List of output files to remove, to be updated if the task
+                has a duplicate.
+
+        Returns
+        -------
+            update : tuple
+                Whether the task failed, and its task, file, and unit
+                updates.
+        """
+        handler = self.__taskhandlers[task.tag]
+        failed, task_update, file_update, unit_update = handler.process(task, summary, transfers)
+        wflow = getattr(self.config.workflows, handler.dataset)
+
+        if task.tag in self.__duplicates:
+            if self.__resolve_duplicate(task.tag, failed, duplicates, cleanup):
+                # The units stay with the other task, which is still
+                # running.
+                file_update = []
+                unit_update = []
+
+        if failed:
+            faildir = util.move(wflow.workdir, handler.id, 'failed')
+            summary.dir(str(handler.id), faildir)
+        else:
+            util.move(wflow.workdir, handler.id, 'successful')
+
+        return failed, task_update, file_update, unit_update
+
+    def __process_parallel(self, task):
+        """Process a returned task without a duplicate, with its own
+        summary and transfer statistics, which are returned, too.
+        """
+        summary = ReleaseSummary()
+        transfers = defaultdict(lambda: defaultdict(Counter))
+        return self.__process(task, summary, transfers, None, None), summary, transfers
+
+    def __parameters(self, wflow, merge, config, inputs):
+        """Returns the parameters to write for a task.
+
+        Parameters shared by the tasks of a workflow are written once to
+        a template, which is sent as a cached input, named after a hash of
+        its contents.  Only the parameters differing from the template are
+        written for the task.
+        """
+        key = (wflow.label, merge)
+        if key not in self.__templates:
+            template = parameter_template(config)
+            name = 'parameters_{0}.json'.format(sha1(json.dumps(template, sort_keys=True)).hexdigest()[-16:])
+            path = os.path.join(wflow.workdir, name)
+            if not os.path.exists(path):
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(template, f, indent=2)
+                    f.write('\n')
+                os.rename(path + '.tmp', path)
+            self.__templates[key] = (template, name, path)
+
+        template, name, path = self.__templates[key]
+        delta = split_parameters(config, template)
+        if delta is None:
+            return config
+
+        delta['template'] = name
+        inputs.append((path, name, True))
+        return delta
+
+    def __resolve_duplicate(self, tag, failed, duplicates, cleanup):
+        """Settle the outcome of a task that has a running duplicate.
+
+        A successful task wins over the other task, which is cancelled.  A
+        failed task hands its units to the other task.
+
+        Parameters
+        ----------
+            tag : str
+                The id of the returned task.
+            failed : bool
+                If the task failed.
+            duplicates : tuple
+                Lists of unit transfers between tasks and tasks to abort,
+                to be updated.
+            cleanup : list
+                List of output files to remove, to be updated.
+
+        Returns
+        -------
+            lost : bool
+                If the other task keeps the units.
+        """
+        transfers, aborted = duplicates
+        other, duplicate = self.__duplicates.pop(tag)
+        del self.__duplicates[other]
+
+        if failed:
+            logger.info("task {0} failed, leaving its units to task {1}".format(tag, other))
+            if not duplicate:
+                transfers.append((tag, other))
+            return True
+
+        logger.info("task {0} succeeded, cancelling task {1}".format(tag, other))
+        if duplicate:
+            transfers.append((other, tag))
+        aborted.append(other)
+
+        if other in self.__pipeline:
+            # Not submitted yet, and dropped once materialized
+            self.__discard.add(other)
+        else:
+            handler = self.__taskhandlers.pop(other)
+            wflow = getattr(self.config.workflows, handler.dataset)
+            cleanup.extend([lf for rf, lf in handler.outputs])
+            shutil.rmtree(os.path.join(wflow.workdir, 'running', util.id2dir(other)), ignore_errors=True)
+            self.__cancel.append(other)
+        self.config.advanced.dashboard.update_task_status([(other, dash.ABORTED)])
+
+        return False
+
+    def flush(self, force=True):
+        """Write buffered task updates to the database.
+
+        Removes input files that are no longer needed afterwards.
+
+        Parameters
+        ----------
+            force : bool
+                Unless set, only write updates when the write-behind
+                buffer of the unit store is full.
+        """
+        with self.measure('sqlite'):
+            flushed = self.__store.flush(force)
+
+        if not flushed or len(self.__input_files) == 0:
+            return
+
+        with self.measure('cleanup'):
+            cleanup = list(self.__store.finished_files(self.__input_files))
+            self.__input_files = defaultdict(set)
+            if len(cleanup) > 0:
+                try:
+                    fs.remove(*cleanup)
+                except (IOError, OSError):
+                    pass
+                except ValueError as e:
+                    logger.error("error removing input files:\n{0}".format(e))
+
     def terminate(self):
+        self.__materializer.stop()
+        self.__releaser.close()
+        self.__releaser.join()
+        self.flush()
         self.config.advanced.dashboard.update_task_status(
             (str(id), dash.CANCELLED) for id in self.__store.running_tasks()
         )
 
+        # Tasks that were never handed out return their units
+        if len(self.__pipeline) > 0:
+            logger.info("rolling back {0} task(s) not submitted".format(len(self.__pipeline)))
+            self.__store.rollback_tasks(self.__pipeline.keys())
+            for id, (_, label) in self.__pipeline.items():
+                wflow = getattr(self.config.workflows, label)
+                shutil.rmtree(os.path.join(wflow.workdir, 'running', util.id2dir(id)), ignore_errors=True)
+            self.__pipeline = {}
+
     def done(self):
+        if len(self.__watched()) > 0:
+            return False
         left = self.__store.unfinished_units()
-        return self.__store.merged() and left == 0
+        if self.__store.merged() and left == 0:
+            self.flush()
+            return True
+        return False
 
     def max_taskid(self):
         return self.__store.max_taskid()
@@ -560,6 +1021,38 @@ class TaskProvider(util.Timing):
             logger.warning("could not update task states to dashboard")
             logger.exception(e)
 
+        # tasks that lost against their duplicate
+        for tag in self.__cancel:
+            queue.cancel_by_tasktag(tag)
+        self.__cancel = []
+
+        with self.measure('sqlite'):
+            self.__store.checkpoint()
+
+        with self.measure('rescan'):
+            self.__rescan()
+
+    def __watched(self):
+        return [wflow for wflow in self.config.workflows if getattr(wflow.dataset, 'watch', False)]
+
+    def __rescan(self):
+        """Register new files of watched datasets.
+        """
+        if time.time() - self.__last_rescan < self.config.advanced.watch_interval:
+            return
+        self.__last_rescan = time.time()
+
+        for wflow in self.__watched():
+            logger.debug("rescanning dataset of {0}".format(wflow.label))
+            try:
+                with fs.alternative():
+                    dataset_info = wflow.dataset.get_info()
+            except Exception as e:
+                logger.warning("could not rescan the dataset of {0}".format(wflow.label))
+                logger.exception(e)
+                continue
+            self.__store.register_new_files(wflow, dataset_info)
+
     def update_stuck(self):
         """Have the unit store updated the statistics for stuck units.
         """
@@ -575,6 +1068,13 @@ class TaskProvider(util.Timing):
                 update.append((category.runtime, wflow.label))
         self.__store.update_workflow_runtime(update)
 
+    def prediction_error(self, category='all'):
+        """Returns the average relative error of the runtime predicted
+        for tasks of the workflows in `category`, or `None`.
+        """
+        labels = [w.label for w in self.config.workflows if category in ('all', w.category.name)]
+        return self.config.advanced.runtime_model.error(labels)
+
     def tasks_left(self):
         return self.__store.estimate_tasks_left()
 
@@ -28,11 +28,14 @@ class TaskHandler(object):
         self._files = [(i, file) for i, file in files]
         self._file_based = any([file_ is None or run < 0 or lumi < 0 for (_, file_, run, lumi) in lumis])
         self._units = lumis
+        self._file_units = collections.defaultdict(list)
+        for unit_ in lumis:
+            self._file_units[unit_[1]].append(unit_)
         self.outputs = outputs
         self._local = local
 
         self.taskdir = taskdir
-        self.unit_source = 'units_' + self._dataset
+        self.unit_source = 'units'
 
         self._output_info = {}
         self._output_size = 0
@@ -66,7 +69,7 @@ class TaskHandler(object):
         units_processed = len(self._units)
 
         for (id, file) in self._files:
-            file_units = [tpl for tpl in self._units if tpl[1] == id]
+            file_units = self._file_units[id]
 
             skipped = file in files_skipped or file not in files_info
             read = 0 if failed or skipped else files_info[file][0]
@@ -78,13 +81,13 @@ class TaskHandler(object):
             else:
                 if skipped:
                     for (lumi_id, lumi_file, r, l) in file_units:
-                        unit_update.append((unit.FAILED, lumi_id))
+                        unit_update.append((unit.FAILED, lumi_id, l))
                         units_processed -= 1
                 elif not self._file_based:
                     file_lumis = set(map(tuple, files_info[file][1]))
                     for (lumi_id, lumi_file, r, l) in file_units:
                         if (r, l) not in file_lumis:
-                            unit_update.append((unit.FAILED, lumi_id))
+                            unit_update.append((unit.FAILED, lumi_id, l))
                             units_processed -= 1
 
             file_update.append((read, 1 if skipped else 0, id))
@@ -317,7 +320,7 @@ class MultiGridpackTaskHandler(TaskHandler):
 
         lumi_update = []
         if failed:
-            lumi_update = [(unit.FAILED, self._units[0][0])]
+            lumi_update = [(unit.FAILED, self._units[0][0], self._units[0][3])]
 
         return [(0, 0, 1)], lumi_update
 
@@ -1,13 +1,19 @@
+import bisect
 from collections import Counter, defaultdict
+from contextlib import contextmanager
+import itertools
 import json
 import logging
 import math
 import os
+import pickle
 from retrying import retry
 import sqlite3
+import time
 import uuid
 
 from lobster import util
+from lobster.core.dataset import LumiRange
 
 logger = logging.getLogger('lobster.unit')
 
@@ -77,14 +83,191 @@ TaskUpdate = util.record('TaskUpdate',
                          default=0)
 
 
+def lumi_ranges(lumis):
+    """Compress a list of luminosity sections into contiguous ranges.
+
+    Parameters
+    ----------
+        lumis : list
+            A list of `(run, lumi)` tuples, or a `LumiRange`.
+
+    Returns
+    -------
+        ranges : list
+            A list of `(run, first lumi, last lumi)` tuples, sorted by run
+            and luminosity section.  Duplicate luminosity sections are not
+            merged, but result in separate ranges.
+    """
+    if isinstance(lumis, LumiRange):
+        return [(lumis.run, lumis.first, lumis.last)] if len(lumis) > 0 else []
+    res = []
+    for run, lumi in sorted(lumis):
+        if len(res) > 0 and res[-1][0] == run and res[-1][2] + 1 == lumi:
+            res[-1][2] = lumi
+        else:
+            res.append([run, lumi, lumi])
+    return [tuple(r) for r in res]
+
+
+def plan_merges(tasks, maxsize):
+    """Group task outputs into merges, using best-fit decreasing.
+
+    Tasks are placed in order of decreasing output size into the merge with
+    the least space left that can still accommodate them.  Merges that
+    cannot fit the smallest output anymore are not considered further.
+
+    Parameters
+    ----------
+        tasks : list
+            A list of tuples containing task id, number of units, and
+            output size.
+        maxsize : int
+            The maximum size of a merged output.
+
+    Returns
+    -------
+        merges : list
+            A list of tuples containing the task ids, total number of
+            units, and total output size of each merge, in order of
+            decreasing size.  Tasks that cannot be merged with any other
+            task are omitted.
+    """
+    tasks = sorted(tasks, key=lambda t: t[2], reverse=True)
+
+    # If the smallest two tasks can't be merged, nothing can.
+    if len(tasks) < 2 or tasks[-2][2] + tasks[-1][2] > maxsize:
+        return []
+    minsize = tasks[-1][2]
+
+    merges = []
+    # Space left and index of merges that can still fit more tasks, sorted
+    space = []
+    for task, units, size in tasks:
+        pos = bisect.bisect_left(space, (size, -1))
+        if pos < len(space):
+            left, index = space.pop(pos)
+            merge = merges[index]
+            merge[0].append(task)
+            merge[1] += units
+            merge[2] += size
+            left -= size
+        elif size + minsize <= maxsize:
+            index = len(merges)
+            merges.append([[task], units, size])
+            left = maxsize - size
+        else:
+            continue
+
+        if left >= minsize:
+            bisect.insort(space, (left, index))
+
+    return [tuple(m) for m in sorted(merges, key=lambda m: m[2], reverse=True)]
+
+
+def _encode_journal_entry(entry):
+    """Replace task updates with plain lists, which can be pickled.
+    """
+    serial, updates = entry
+    res = []
+    for method, args in updates:
+        if method == 'update_units':
+            args = (dict(
+                (key, [(list(task_update), file_update, unit_update)
+                       for (task_update, file_update, unit_update) in infos])
+                for key, infos in args[0].items()
+            ),)
+        res.append((method, args))
+    return serial, res
+
+
+def _decode_journal_entry(entry):
+    """Inverse of :func:`_encode_journal_entry`.
+    """
+    serial, updates = entry
+    res = []
+    for method, args in updates:
+        if method == 'update_units':
+            args = (dict(
+                (key, [(TaskUpdate(*task_update), file_update, unit_update)
+                       for (task_update, file_update, unit_update) in infos])
+                for key, infos in args[0].items()
+            ),)
+        res.append((method, args))
+    return serial, res
+
+
+# Actions changing a database, which read-only connections may only
+# perform on temporary tables.
+_WRITE_ACTIONS = frozenset(getattr(sqlite3, 'SQLITE_' + action) for action in (
+    'ALTER_TABLE', 'ANALYZE', 'ATTACH', 'CREATE_INDEX', 'CREATE_TABLE', 'CREATE_TRIGGER', 'CREATE_VIEW',
+    'DELETE', 'DETACH', 'DROP_INDEX', 'DROP_TABLE', 'DROP_TRIGGER', 'DROP_VIEW', 'INSERT', 'REINDEX', 'UPDATE'
+))
+
+
+def _deny_writes(action, arg1, arg2, database, source):
+    """Authorizer for read-only connections.
+
+    Unlike `pragma query_only`, which older versions of SQLite silently
+    ignore, authorizers are supported by all versions.
+    """
+    if action in _WRITE_ACTIONS and database != 'temp':
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+WorkflowSummary = util.record('WorkflowSummary',
+                              'label',
+                              'events',
+                              'events_read',
+                              'events_written',
+                              'units',
+                              'units_unmasked',
+                              'units_written',
+                              'units_merged',
+                              'units_stuck',
+                              'units_failed',
+                              'units_skipped',
+                              'units_left',
+                              'percent_progress',
+                              'percent_merged')
+
+
 class UnitStore:
 
-    def __init__(self, config):
+    def __init__(self, config, readonly=False):
+        """Open the unit database of a project.
+
+        Parameters
+        ----------
+            config : Configuration
+                The configuration of the project.
+            readonly : bool
+                Open a connection that can only read from the database.
+                To be used by commands that inspect a project, which must
+                not interfere with a running Lobster process.
+        """
         self.uuid = str(uuid.uuid4()).replace('-', '')
         self.db_path = os.path.join(config.workdir, "lobster.db")
         self.db = sqlite3.connect(self.db_path, timeout=90)
 
         self.config = config
+        self.__workflow_ids = {}
+
+        if readonly:
+            self.db.set_authorizer(_deny_writes)
+            return
+
+        # With a write-ahead log, readers and the writer do not block each
+        # other.  The journal mode is stored in the database, so that
+        # read-only connections will pick it up.
+        mode = 'wal' if self.config.advanced.write_ahead_log else 'delete'
+        current, = self.db.execute("pragma journal_mode={0}".format(mode)).fetchone()
+        if current != mode:
+            logger.warning("could not change the database journal mode from {0} to {1}".format(current, mode))
+        if current == 'wal':
+            # Truncate the log after checkpoints, to not hold on to disk
+            # space after bursts of updates.
+            self.db.execute("pragma journal_size_limit={0}".format(64 * 1024 ** 2))
 
         self.db.execute("""create table if not exists workflows(
             cfg text,
@@ -98,7 +281,14 @@ class UnitStore:
             units_done int default 0,
             units_left int default 0,
             units_available int default 0,
+            units_registered int default 0,
             units_stuck int default 0,
+            units_failed int default 0,
+            units_skipped int default 0,
+            units_processed int default 0,
+            units_processed_merged int default 0,
+            events_read int default 0,
+            events_written int default 0,
             units_running int default 0,
             taskruntime int default null,
             tasksize int,
@@ -111,6 +301,7 @@ class UnitStore:
             release text,
             uuid text,
             transfers text default '{}',
+            split_by text default null,
             stop_on_file_boundary)""")
         self.db.execute("""create table if not exists tasks(
             bytes_bare_output int default 0 not null,
@@ -141,6 +332,7 @@ class UnitStore:
             allocated_memory int default 0 not null,
             allocated_disk int default 0 not null,
             published_file_block text,
+            speculates int,
             status int default 0 not null,
             time_submit int default 0 not null,
             time_transfer_in_start int default 0 not null,
@@ -166,15 +358,308 @@ class UnitStore:
             workdir_num_files int default 0 not null,
             foreign key(workflow) references workflows(id))""")
 
+        # Files and units of all workflows share one table each.  Indices
+        # used to select files and units start with the workflow id.
+        self.db.execute("""create table if not exists files(
+            id integer primary key autoincrement,
+            workflow integer not null,
+            filename text,
+            skipped int default 0,
+            units int,
+            units_done int default 0,
+            units_running int default 0,
+            events int,
+            events_read int default 0,
+            bytes int default 0,
+            foreign key(workflow) references workflows(id))""")
+        self.db.execute("""create table if not exists units(
+            id integer primary key autoincrement,
+            workflow integer not null,
+            task integer,
+            run integer,
+            lumi integer,
+            lumi_last integer,
+            file integer,
+            status integer default 0,
+            failed integer default 0,
+            arg text,
+            isolation integer,
+            foreign key(workflow) references workflows(id),
+            foreign key(task) references tasks(id),
+            foreign key(file) references files(id))""")
+
+        # Groups of units of failed tasks that are processed on their own
+        # to isolate failing units.  Groups of a task that failed while
+        # processing a group refer to the latter as their parent.
+        self.db.execute("""create table if not exists isolations(
+            id integer primary key autoincrement,
+            workflow integer not null,
+            task integer,
+            parent integer,
+            units int,
+            foreign key(workflow) references workflows(id),
+            foreign key(task) references tasks(id),
+            foreign key(parent) references isolations(id))""")
+
+        # Queue of units available for processing, to avoid scanning all
+        # units of a workflow when creating tasks.
+        self.db.execute("""create table if not exists available(
+            id integer primary key,
+            workflow integer not null,
+            file integer,
+            skipped int default 0,
+            foreign key(id) references units(id))""")
+
         self.db.execute("create index if not exists index_w_label on workflows(label)")
         self.db.execute("create index if not exists index_t_workflow on tasks(workflow, status)")
         self.db.execute("create index if not exists index_t_workflowplus on tasks(workflow, status, type)")
+        self.db.execute("create index if not exists index_f_filename on files(workflow, filename)")
+        self.db.execute("drop index if exists index_a_file")
+        self.db.execute("create index if not exists index_a_skipped on available(workflow, skipped, file, id)")
+        self.db.execute("create index if not exists index_u_events on units(workflow, run, lumi)")
+        self.db.execute("create index if not exists index_u_files on units(workflow, file, status)")
+        self.db.execute("create index if not exists index_u_task on units(task)")
+        self.db.execute("create index if not exists index_u_isolation on units(isolation)")
+
+        # Keep the task totals of the workflow summary up to date with
+        # every change of task status.
+        for sign, row in (('-', 'old'), ('+', 'new')):
+            self.db.execute("""
+                create trigger if not exists summary_{1} after update of status, events_read, events_written, units_processed on tasks
+                begin
+                    update workflows set
+                        events_read=(events_read {0} ({1}.status in (2, 6, 7, 8) and {1}.type == 0) * {1}.events_read),
+                        events_written=(events_written {0} ({1}.status in (2, 6, 7, 8) and {1}.type == 0) * {1}.events_written),
+                        units_processed=(units_processed {0} ({1}.status == 2 and {1}.type == 0) * {1}.units_processed),
+                        units_processed_merged=(units_processed_merged {0} ({1}.status == 8 and {1}.type == 0) * {1}.units_processed)
+                    where id={1}.workflow;
+                end""".format(sign, row))
+
+        # Serial number of the last journal entry written to the database
+        self.db.execute("create table if not exists journal(serial int)")
+        if self.db.execute("select count(*) from journal").fetchone()[0] == 0:
+            self.db.execute("insert into journal(serial) values (0)")
+
+        # Temporary tables to pass many keys to a query, which can be used
+        # with nesting up to their number.
+        self.db.execute("pragma temp_store=memory")
+        self.__keys = []
+        for n in range(2):
+            self.db.execute("create temp table if not exists keys_{0}(id integer primary key)".format(n))
+            self.__keys.append("keys_{0}".format(n))
+        self.db.execute("""create temp table if not exists scanned(
+            filename text primary key,
+            bytes int,
+            events int)""")
 
         self.db.commit()
 
+        self.__journal_path = os.path.join(config.workdir, "lobster.journal")
+
+        self.__journal = None
+        self.__serial = self.db.execute("select serial from journal").fetchone()[0]
+        self.__buffer = []
+        self.__buffer_tasks = 0
+        self.__buffer_start = None
+        # Runtimes of tasks, fed to the runtime model once their updates
+        # are committed
+        self.__observations = []
+
     def disconnect(self):
         self.db.close()
 
+    def __workflow_id(self, label):
+        """Look up the id of a workflow.
+        """
+        try:
+            return self.__workflow_ids[label]
+        except KeyError:
+            id, = self.db.execute("select id from workflows where label=?", (label,)).fetchone()
+            self.__workflow_ids[label] = id
+            return id
+
+    def defer(self, updates):
+        """Add updates to the write-behind buffer.
+
+        The updates are written to a journal, and only applied to the
+        database when calling :meth:`flush`.  If Lobster is terminated
+        before that, :meth:`recover` will apply them upon restart.
+
+        Parameters
+        ----------
+            updates : list
+                A list of tuples with the name of the method to call and
+                its arguments.  Supported methods are `register_files`,
+                `resolve_duplicates`, `update_transfers`, and
+                `update_units`.
+        """
+        if len(updates) == 0:
+            return
+
+        self.__serial += 1
+        entry = (self.__serial, updates)
+
+        if self.__journal is None:
+            self.__journal = open(self.__journal_path, 'ab')
+        pickle.dump(_encode_journal_entry(entry), self.__journal, pickle.HIGHEST_PROTOCOL)
+        self.__journal.flush()
+        os.fsync(self.__journal.fileno())
+
+        if self.__buffer_start is None:
+            self.__buffer_start = time.time()
+        self.__buffer.append(entry)
+        for method, args in updates:
+            if method == 'update_units':
+                self.__buffer_tasks += sum(len(us) for us in args[0].values())
+
+    @retry(stop_max_attempt_number=10)
+    def flush(self, force=True):
+        """Apply the updates of the write-behind buffer to the database.
+
+        Parameters
+        ----------
+            force : bool
+                Unless set, only apply updates if the buffer is exceeding
+                either the size or the time threshold.
+
+        Returns
+        -------
+            flushed : bool
+                If updates were applied to the database.
+        """
+        if len(self.__buffer) == 0:
+            return False
+        if not force \
+                and self.__buffer_tasks < self.config.advanced.write_behind_size \
+                and time.time() - self.__buffer_start < self.config.advanced.write_behind_time:
+            return False
+
+        self.__observations = []
+        methods = {
+            'register_files': self.__register_files,
+            'resolve_duplicates': self.__resolve_duplicates,
+            'update_transfers': self.__update_transfers,
+            'update_units': self.__update_units
+        }
+
+        with self.db:
+            applied = self.db.execute("select serial from journal").fetchone()[0]
+            for serial, updates in self.__buffer:
+                if serial <= applied:
+                    continue
+                for method, args in updates:
+                    methods[method](*args)
+            self.db.execute("update journal set serial=?", (self.__buffer[-1][0],))
+        self.__apply_observations()
+
+        logger.debug("wrote {0} buffered update(s) for {1} task(s) to the database".format(
+            len(self.__buffer), self.__buffer_tasks))
+
+        self.__buffer = []
+        self.__buffer_tasks = 0
+        self.__buffer_start = None
+
+        if self.__journal is not None:
+            self.__journal.close()
+            self.__journal = None
+        if os.path.exists(self.__journal_path):
+            os.remove(self.__journal_path)
+
+        return True
+
+    def recover(self):
+        """Apply updates left in the journal by a terminated Lobster process.
+
+        Must only be called by the process owning the working directory.
+        """
+        if not os.path.exists(self.__journal_path):
+            return
+
+        entries = []
+        with open(self.__journal_path, 'rb') as f:
+            while True:
+                try:
+                    entries.append(_decode_journal_entry(pickle.load(f)))
+                except EOFError:
+                    break
+                except Exception:
+                    logger.warning("ignoring incomplete entry at the end of the journal")
+                    break
+
+        logger.info("recovering {0} update(s) from the journal".format(len(entries)))
+
+        if len(entries) > 0:
+            self.__serial = max(self.__serial, entries[-1][0])
+        self.__buffer = entries
+        self.__buffer_start = time.time()
+        if not self.flush() and os.path.exists(self.__journal_path):
+            os.remove(self.__journal_path)
+
+    @contextmanager
+    def __bulk_keys(self, keys):
+        """Provide a collection of keys as a temporary table.
+
+        Allows to select many rows by their keys with a single join, instead
+        of constructing lists of parameters.  Has to be used within a
+        transaction.
+
+        Parameters
+        ----------
+            keys : iterable
+                The integer keys to store.
+
+        Returns
+        -------
+            table : str
+                The name of the temporary table holding the keys in the
+                column `id`.
+        """
+        table = self.__keys.pop()
+        try:
+            self.db.execute("delete from {0}".format(table))
+            self.db.executemany("insert or ignore into {0}(id) values (?)".format(table), ((k,) for k in keys))
+            yield table
+        finally:
+            self.__keys.append(table)
+
+    @contextmanager
+    def __bulk_files(self, infos):
+        """Provide files of a dataset as a temporary table.
+
+        Like :meth:`__bulk_keys`, for files of a scanned dataset, to be
+        compared with the registered files within the database.  Has to
+        be used within a transaction.
+
+        Parameters
+        ----------
+            infos : dict
+                A mapping of filenames to `FileInfo`.
+
+        Returns
+        -------
+            table : str
+                The name of the temporary table holding the files in the
+                columns `filename`, `bytes`, and `events`.
+        """
+        self.db.execute("delete from scanned")
+        self.db.executemany("insert or replace into scanned(filename, bytes, events) values (?, ?, ?)",
+                            ((fn, info.size, info.events) for fn, info in infos.iteritems()))
+        try:
+            yield "scanned"
+        finally:
+            self.db.execute("delete from scanned")
+
+    def checkpoint(self):
+        """Transfer changes from the write-ahead log into the database.
+
+        The checkpoint is passive and will neither wait for nor block
+        readers.  It may thus not be complete, and will be continued the
+        next time this method is called.
+        """
+        busy, logged, transferred = self.db.execute("pragma wal_checkpoint(passive)").fetchone()
+        if logged > 0:
+            logger.debug("checkpointed {0} out of {1} pages of the write-ahead log".format(transferred, logged))
+
     def max_taskid(self):
         maxid = self.db.execute(
             'select ifnull(max(id), 0) from tasks').fetchone()[0]
@@ -201,9 +686,10 @@ class UnitStore:
                        units_masked,
                        units_left,
                        events,
+                       split_by,
                        stop_on_file_boundary
                        )
-                       values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
+                       values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
             wflow.label,
             label,
             wflow.label,
@@ -219,35 +705,10 @@ class UnitStore:
             dataset_info.masked_units,
             dataset_info.total_units * len(unique_args),
             dataset_info.total_events,
+            getattr(dataset_info, 'split_by', None),
             getattr(dataset_info, 'stop_on_file_boundary', False)))
+        self.__workflow_ids[label] = cur.lastrowid
 
-        self.db.execute("""create table if not exists files_{0}(
-            id integer primary key autoincrement,
-            filename text,
-            skipped int default 0,
-            units int,
-            units_done int default 0,
-            units_running int default 0,
-            events int,
-            events_read int default 0,
-            bytes int default 0)""".format(label))
-
-        cur.execute("""create table if not exists units_{0}(
-            id integer primary key autoincrement,
-            task integer,
-            run integer,
-            lumi integer,
-            file integer,
-            status integer default 0,
-            failed integer default 0,
-            arg text,
-            foreign key(task) references tasks(id),
-            foreign key(file) references files_{0}(id))""".format(label))
-
-        self.db.execute("create index if not exists index_f_filename_{0} on files_{0}(filename)".format(label))
-        self.db.execute("create index if not exists index_u_events_{0} on units_{0}(run, lumi)".format(label))
-        self.db.execute("create index if not exists index_u_files_{0} on units_{0}(file, status)".format(label))
-        self.db.execute("create index if not exists index_u_task_{0} on units_{0}(task)".format(label))
         self.db.commit()
 
         self.register_files(dataset_info.files, label, unique_args)
@@ -262,32 +723,169 @@ class UnitStore:
                         where label=?""", (parent, total_units, label)
                        )
 
+    def register_new_files(self, wflow, dataset_info):
+        """Register the files of a rescanned dataset that are new or
+        changed.
+
+        Files are compared within the database, using the filename index.
+        New files are registered, and the unit totals of the workflow and
+        its dependents are increased to match.  Files with a different
+        size or number of events are registered again: their units are
+        processed anew, unless they are running or merged.  Outputs of
+        tasks that processed the previous version of a file are kept.  The
+        workflow and its dependents are no longer considered merged.
+
+        Parameters
+        ----------
+            wflow : Workflow
+                The workflow processing the dataset.
+            dataset_info : DatasetInfo
+                The current information of the dataset.
+
+        Returns
+        -------
+            files : int
+                The number of new or changed files registered.
+        """
+        label = wflow.label
+        unique_args = wflow.unique_arguments
+
+        with self.db:
+            workflow = self.__workflow_id(label)
+            with self.__bulk_files(dataset_info.files) as scanned:
+                new = [fn for (fn,) in self.db.execute("""
+                    select filename
+                    from {0} as scanned
+                    where not exists (
+                        select 1 from files where files.workflow=? and files.filename=scanned.filename
+                    )""".format(scanned), (workflow,))]
+                changed = self.db.execute("""
+                    select files.id, scanned.bytes, scanned.events, scanned.events - files.events
+                    from {0} as scanned, files
+                    where files.workflow=? and files.filename=scanned.filename and (
+                        files.bytes != scanned.bytes or files.events != scanned.events
+                    )""".format(scanned), (workflow,)).fetchall()
+            if len(new) == 0 and len(changed) == 0:
+                return 0
+
+            new = dict((fn, dataset_info.files[fn]) for fn in new)
+            (masked,) = self.db.execute("select units_masked from workflows where id=?", (workflow,)).fetchone()
+            masked = max(dataset_info.masked_units - masked, 0) if len(new) > 0 else 0
+            units = sum(len(info.lumis) for info in new.itervalues())
+            self.db.execute("""
+                update workflows set
+                    units=(units + ?),
+                    units_masked=(units_masked + ?),
+                    events=(events + ?),
+                    merged=0
+                where id=?""", (
+                (units + masked) * len(unique_args),
+                masked,
+                sum(info.events for info in new.itervalues()) + sum(delta for (_, _, _, delta) in changed),
+                workflow))
+            if len(new) > 0:
+                self.__register_files(new, label, unique_args)
+            if len(changed) > 0:
+                self.db.executemany("update files set bytes=?, events=? where id=?",
+                                    [(size, events, id) for (id, size, events, _) in changed])
+                self.__reset_files(label, [id for (id, _, _, _) in changed])
+
+            # dependents process all of the dataset, once per argument,
+            # see `register_dependency`
+            for dependent in list(wflow.family())[1:]:
+                self.db.execute("update workflows set units=(units + ?), merged=0 where label=?",
+                                ((units + masked) * len(dependent.unique_arguments), dependent.label))
+                self.__update_derived_stats(dependent.label)
+
+        logger.info("registered {0} new and {1} changed files of {2}".format(len(new), len(changed), label))
+        return len(new) + len(changed)
+
+    def __reset_files(self, label, ids):
+        """Make the units of files that are not running or merged
+        available for processing again.
+        """
+        with self.__bulk_keys(ids) as keys:
+            tasks = [task for (task,) in self.db.execute("""
+                select distinct task
+                from units
+                where file in (select id from {0}) and task is not null""".format(keys))]
+            units = [id for (id,) in self.db.execute("""
+                select id
+                from units
+                where file in (select id from {0}) and status in (2, 3, 4)""".format(keys))]
+
+        before = self.__count_task_units(tasks)
+        with self.__bulk_keys(units) as keys:
+            self.db.execute("update units set status=0, failed=0 where id in (select id from {0})".format(keys))
+        with self.__bulk_keys(ids) as keys:
+            self.db.execute("""
+                update files set
+                units_done=ifnull((
+                    select sum(lumi_last - lumi + 1)
+                    from units
+                    where workflow=files.workflow and file=files.id and status==2
+                ), 0)
+                where id in (select id from {0})""".format(keys))
+        after = self.__count_task_units(tasks)
+        running, done, stuck, failed, skipped = [a - b for a, b in zip(after, before)]
+        self.__apply_unit_deltas(label, running=running, done=done, stuck=stuck, failed=failed, skipped=skipped)
+        self.__make_available(units)
+        self.update_workflow_stats(label)
+
     def register_files(self, infos, label, unique_args=None):
-        with self.db as db:
-            cur = db.cursor()
+        with self.db:
+            self.__register_files(infos, label, unique_args)
 
-            if unique_args is None:
-                unique_args = [None]
+    def __register_files(self, infos, label, unique_args=None):
+        cur = self.db.cursor()
 
-            update = []
+        if unique_args is None:
+            unique_args = [None]
+
+        workflow = self.__workflow_id(label)
+        chunk = max(self.config.advanced.registration_chunk_size, 1)
+        total = sum(len(info.lumis) for info in infos.itervalues()) * len(unique_args)
+        registered = 0
+        last_id = self.db.execute("select ifnull(max(id), 0) from units").fetchone()[0]
+
+        def units():
             # Sort for reproducable unit tests.
             if len(infos) < 25:
-                items = [(fn, infos[fn]) for fn in sorted(infos.keys())]
+                items = ((fn, infos[fn]) for fn in sorted(infos.keys()))
             else:
-                items = infos.items()
+                items = infos.iteritems()
             for fn, info in items:
                 cur.execute(
-                    """insert into files_{0}(units, events, filename, bytes) values (?, ?, ?, ?)""".format(
-                        label),
-                    (len(info.lumis) * len(unique_args), info.events, fn, info.size))
+                    """insert into files(workflow, units, events, filename, bytes) values (?, ?, ?, ?, ?)""",
+                    (workflow, len(info.lumis) * len(unique_args), info.events, fn, info.size))
                 fid = cur.lastrowid
 
+                if self.config.advanced.unit_ranges:
+                    lumis = lumi_ranges(info.lumis)
+                else:
+                    lumis = info.lumis
                 for arg in unique_args:
-                    update += [(fid, run, lumi, arg)
-                               for (run, lumi) in info.lumis]
+                    if self.config.advanced.unit_ranges:
+                        for (run, first, last) in lumis:
+                            yield (workflow, fid, run, first, last, arg)
+                    else:
+                        for (run, lumi) in lumis:
+                            yield (workflow, fid, run, lumi, lumi, arg)
+
+        rows = units()
+        while True:
+            batch = list(itertools.islice(rows, chunk))
+            if len(batch) == 0:
+                break
             self.db.executemany(
-                "insert into units_{0}(file, run, lumi, arg) values (?, ?, ?, ?)".format(label), update)
-            self.update_workflow_stats(label)
+                "insert into units(workflow, file, run, lumi, lumi_last, arg) values (?, ?, ?, ?, ?, ?)", batch)
+            registered += len(batch)
+            if total > chunk:
+                logger.info("registered {0} of {1} units for {2}".format(registered, total, label))
+        self.db.execute(
+            "insert into available(id, workflow, file) select id, workflow, file from units where id > ?", (last_id,))
+        self.__apply_unit_deltas(label, registered=total)
+        self.update_workflow_stats(label)
 
     def work_left(self, label):
         """
@@ -309,11 +907,28 @@ class UnitStore:
                 How many tasks need to be created to process all units
                 currently available.
         """
-        complete, units_left, tasks_left = self.db.execute(
-            "select (units_left = units_available), units_left, units_available * 1. / tasksize from workflows where label=?",
-            (label,)).fetchone()
+        id, complete, units_left, tasks_left, split_by, tasksize = self.db.execute("""
+            select id, (units_left = units_available), units_left, units_available * 1. / tasksize, split_by, tasksize
+            from workflows
+            where label=?""", (label,)).fetchone()
+        if split_by:
+            tasks_left = self.__weight_available(id, split_by) * 1. / tasksize
         return complete, units_left, tasks_left
 
+    def __weight_available(self, workflow, split_by):
+        """Returns the events or bytes of the units available for
+        processing, for workflows split by either.
+
+        Files are weighed as when creating tasks, see :meth:`pop_units`.
+        """
+        column = {'events': 'files.events', 'bytes': 'files.bytes'}[split_by]
+        (weight,) = self.db.execute("""
+            select ifnull(sum(max(ifnull({0}, 0), 1)), 0)
+            from available, files
+            where available.workflow=? and available.skipped < ? and files.id == available.file
+            """.format(column), (workflow, self.config.advanced.threshold_for_skipping)).fetchone()
+        return weight
+
     @retry(stop_max_attempt_number=10)
     def pop_units(self, workflow, num, taper=1.):
         """Create tasks from a workflow.
@@ -325,11 +940,12 @@ class UnitStore:
             num : int
                 The number of tasks to create.
             taper : int
-                Factor to apply to the tasksize.
+                Factor to apply to the tasksize.  Not applied to workflows
+                split by events or bytes.
         """
         with self.db:
-            workflow_id, tasksize, stop_on_file_boundary = self.db.execute(
-                "select id, tasksize, stop_on_file_boundary from workflows where label=?",
+            workflow_id, tasksize, split_by, stop_on_file_boundary = self.db.execute(
+                "select id, tasksize, split_by, stop_on_file_boundary from workflows where label=?",
                 (workflow,)).fetchone()
 
             logger.debug(("creating {0} task(s) for workflow {1}:" +
@@ -346,30 +962,27 @@ class UnitStore:
             )
             )
 
-            fileinfo = list(self.db.execute("""select id, filename
-                        from files_{0}
-                        where
-                            (units_done + units_running < units) and
-                            (skipped < ?)
-                        order by skipped asc""".format(workflow), (self.config.advanced.threshold_for_skipping,)))
-            files = [x for (x, y) in fileinfo]
-            fileinfo = dict(fileinfo)
-
-            tasksize = int(math.ceil(tasksize * taper))
+            # Tasks split by events or bytes are already filled with whole
+            # files, and tapering would reduce them to one file each.
+            if not split_by:
+                tasksize = int(math.ceil(tasksize * taper))
 
             logger.debug("creating tasks with adjusted size {}".format(tasksize))
 
-            rows = []
-            for i in range(0, len(files), 40):
-                chunk = files[i:i + 40]
-                rows.extend(self.db.execute("""
-                    select id, file, run, lumi, arg, failed
-                    from units_{0}
-                    where file in ({1}) and status not in (1, 2, 6, 7, 8)
-                    order by file
-                    """.format(workflow, ', '.join('?' for _ in chunk)), chunk))
+            # Tasks of workflows split by events or bytes are filled with
+            # whole files up to `tasksize` events or bytes.
+            if split_by:
+                rows = self.__available_units(workflow_id, max(100, num * 10))
+            else:
+                rows = self.__available_units(workflow_id, max(100, num * tasksize))
+            fileinfo = {}
+            weights = {}
 
-            logger.debug("creating tasks from {} files, {} units".format(len(files), len(rows)))
+            # unit ranges that are split off and remain available, and
+            # units that have to be taken out of the queue
+            pending = []
+            remainders = []
+            unavailable = []
 
             # files and lumis for individual tasks
             files = set()
@@ -378,10 +991,12 @@ class UnitStore:
             # task container and current task size
             tasks = []
             current_size = 0
+            current_weight = 0
 
             def insert_task(files, units, arg):
                 cur = self.db.cursor()
-                cur.execute("insert into tasks(workflow, status, type) values (?, 1, 0)", (workflow_id,))
+                cur.execute("insert into tasks(workflow, status, type, time_submit) values (?, 1, 0, ?)",
+                            (workflow_id, int(time.time())))
                 task_id = cur.lastrowid
 
                 tasks.append((
@@ -392,28 +1007,47 @@ class UnitStore:
                     arg,
                     False))
 
-            for id, file, run, lumi, arg, failed in rows:
+            # Isolation groups of failed units are processed by themselves
+            # before any other units.
+            for group in self.__isolated_units(workflow_id)[:num]:
+                for (id, file, filename, run, first, last, arg) in group:
+                    fileinfo[file] = filename
+                logger.debug("creating isolation task for {} unit(s)".format(
+                    sum(last - first + 1 for (_, _, _, _, first, last, _) in group)))
+                insert_task(set(file for (_, file, _, _, _, _, _) in group),
+                            [(id, file, run, first, last) for (id, file, _, run, first, last, _) in group],
+                            group[0][-1])
+                num -= 1
+
+            while True:
+                if len(pending) > 0:
+                    id, file, run, first, last, arg, failed = pending.pop()
+                else:
+                    try:
+                        id, file, filename, run, first, last, arg, failed, events, bytes = next(rows)
+                    except StopIteration:
+                        break
+                    fileinfo[file] = filename
+                    weights[file] = max({'events': events, 'bytes': bytes}.get(split_by, 0), 1)
+
                 if failed > self.config.advanced.threshold_for_failure:
                     logger.debug("skipping run {}, "
-                                 "lumi {} "
+                                 "lumis {}-{} "
                                  "with failure count {} "
                                  "exceeding `config.advanced.threshold_for_failure={}`".format(
-                                     run, lumi, failed, self.config.advanced.threshold_for_failure))
+                                     run, first, last, failed, self.config.advanced.threshold_for_failure))
+                    unavailable.append((id,))
                     continue
 
-                if failed == self.config.advanced.threshold_for_failure:
-                    logger.debug("creating isolation task for run {}, lumi {} with failure count {}".format(
-                        run, lumi, failed))
-                    insert_task([file], [(id, file, run, lumi)], arg)
-                    continue
-
-                if stop_on_file_boundary and (len(files) == 1) and (file not in files):
+                if (stop_on_file_boundary and (len(files) == 1) and (file not in files)) or \
+                        (split_by and current_size > 0 and current_weight + weights[file] > tasksize):
                     insert_task(files, units, arg)
 
                     files = set()
                     units = []
 
                     current_size = 0
+                    current_weight = 0
                     num -= 1
 
                 # We are done creating tasks here, *if* we are about to
@@ -422,48 +1056,354 @@ class UnitStore:
                 if current_size == 0 and num <= 0:
                     break
 
-                units.append((id, file, run, lumi))
+                # Only use as much of a range of units as fits into the
+                # current task, and process the remainder later.
+                if not split_by and last - first + 1 > tasksize - current_size:
+                    split = first + tasksize - current_size
+                    split_id = self.__split_unit_range(id, split)
+                    pending.append((split_id, file, run, split, last, arg, failed))
+                    remainders.append(split_id)
+                    last = split - 1
+
+                units.append((id, file, run, first, last))
                 files.add(file)
 
-                current_size += 1
+                current_size += last - first + 1
+                if split_by:
+                    current_weight += weights[file]
 
-                if current_size == tasksize:
+                if (current_weight if split_by else current_size) >= tasksize:
                     insert_task(files, units, arg)
 
                     files = set()
                     units = []
 
                     current_size = 0
+                    current_weight = 0
                     num -= 1
 
             if current_size > 0:
                 insert_task(files, units, arg)
 
-            workflow_update = []
+            workflow_update = 0
             file_update = defaultdict(int)
             task_update = defaultdict(int)
             unit_update = []
 
             for (task, label, files, units, arg, merge) in tasks:
-                workflow_update += units
-                task_update[task] = len(units)
-                unit_update += [(task, id) for (id, file, run, lumi) in units]
-                for (id, filename) in files:
-                    file_update[
-                        id] += len(filter(lambda tpl: tpl[1] == id, units))
-
-            self.db.execute(
-                "update workflows set units_running=(units_running + ?) where id=?",
-                (len(workflow_update), workflow_id))
-
-            self.db.executemany("update files_{0} set units_running=(units_running + ?) where id=?".format(workflow),
+                size = sum(last - first + 1 for (id, file, run, first, last) in units)
+                workflow_update += size
+                task_update[task] = size
+                for (id, file, run, first, last) in units:
+                    unit_update.append((task, id))
+                    file_update[file] += last - first + 1
+
+            self.__apply_unit_deltas(workflow, running=workflow_update)
+
+            self.db.executemany("update files set units_running=(units_running + ?) where id=?",
                                 [(v, k) for (k, v) in file_update.items()])
             self.db.executemany("update tasks set units=? where id=?",
                                 [(v, k) for (k, v) in task_update.items()])
-            self.db.executemany("update units_{0} set status=1, task=? where id=?".format(workflow),
+            self.db.executemany("update units set status=1, task=? where id=?",
                                 unit_update)
 
-            return tasks if len(unit_update) > 0 else []
+            self.__make_available(remainders)
+            self.db.executemany("delete from available where id=?",
+                                unavailable + [(id,) for (_, id) in unit_update])
+
+            if len(unit_update) == 0:
+                return []
+
+            # Hand out units as individual luminosity sections
+            return [
+                (task, label, files, [(id, file, run, lumi)
+                                      for (id, file, run, first, last) in units
+                                      for lumi in range(first, last + 1)], arg, merge)
+                for (task, label, files, units, arg, merge) in tasks
+            ]
+
+    def pop_speculative(self, workflow, threshold, multiplier, started=None):
+        """Create duplicates of straggling tasks at the end of a workflow.
+
+        Once the units left or running of the workflow drop below
+        `threshold` times its total units, running tasks that take longer
+        than `multiplier` times their predicted runtime are duplicated.
+        Tasks are aged from their submission, or from `started` if later,
+        as tasks may wait in the queue before they start.
+        Duplicates process the same units as the original task, and the
+        first one to succeed keeps them, see :meth:`resolve_duplicates`.
+
+        Parameters
+        ----------
+            workflow : str
+                The label of the workflow.
+            threshold : float
+                The fraction of units left or running to start duplicating
+                tasks.
+            multiplier : float
+                How many times the predicted runtime tasks may run before
+                being duplicated.
+            started : int
+                The time since which all tasks submitted before are known
+                to be running.
+
+        Returns
+        -------
+            tasks : list
+                A list of tuples of the id of the original task and the
+                duplicate, in the format returned by :meth:`pop_units`.
+        """
+        with self.db:
+            workflow_id, units, left, split_by, taskruntime = self.db.execute(
+                "select id, units, units_left + units_running, split_by, taskruntime from workflows where label=?",
+                (workflow,)).fetchone()
+
+            if units == 0 or left > threshold * units:
+                return []
+
+            now = int(time.time())
+            candidates = self.db.execute("""
+                select id, units, time_submit
+                from tasks
+                where workflow=? and status=1 and type=0 and speculates is null and time_submit > 0
+                and not exists (select 1 from tasks as d where d.speculates=tasks.id and d.status=1)""",
+                                         (workflow_id,)).fetchall()
+
+            res = []
+            for original, size, submitted in candidates:
+                # Tasks split by events record their size in units only.
+                runtime = None if split_by else self.config.advanced.runtime_model.predict(workflow, size)
+                if runtime is None:
+                    runtime = taskruntime
+                age = now - max(submitted, started or 0)
+                if runtime is None or age < multiplier * runtime:
+                    continue
+
+                rows = self.db.execute("""
+                    select units.id, units.file, files.filename, units.run, units.lumi, units.lumi_last, units.arg
+                    from units, files
+                    where units.task=? and files.id=units.file
+                    order by units.id""", (original,)).fetchall()
+                if len(rows) == 0:
+                    continue
+
+                cur = self.db.cursor()
+                cur.execute("""
+                    insert into tasks(workflow, status, type, time_submit, speculates, units)
+                    values (?, 1, 0, ?, ?, ?)""", (workflow_id, now, original, size))
+                task = str(cur.lastrowid)
+
+                files = dict((file, filename) for (_, file, filename, _, _, _, _) in rows)
+                lumis = [(id, file, run, lumi)
+                         for (id, file, _, run, first, last, _) in rows
+                         for lumi in range(first, last + 1)]
+                res.append((str(original), (task, workflow, files.items(), lumis, rows[0][-1], False)))
+
+                logger.info("duplicating task {0} of {1} as task {2}, running for {3}s".format(
+                    original, workflow, task, age))
+
+            return res
+
+    def resolve_duplicates(self, transfers, aborted):
+        with self.db:
+            self.__resolve_duplicates(transfers, aborted)
+
+    def __resolve_duplicates(self, transfers, aborted):
+        """Settle which of a task and its duplicate keeps the units.
+
+        Parameters
+        ----------
+            transfers : list
+                A list of tuples of task ids, with the units of the first
+                task to be handed to the second task.
+            aborted : list
+                A list of running task ids to mark as aborted.
+        """
+        self.db.executemany("update units set task=? where task=?",
+                            [(new, old) for (old, new) in transfers])
+        self.db.executemany("update tasks set speculates=null where id=?",
+                            [(new,) for (_, new) in transfers])
+        self.db.executemany("update tasks set status=4 where id=? and status=1",
+                            [(id,) for id in aborted])
+
+    def __available_units(self, workflow, page):
+        """Iterate over the units available for processing.
+
+        Units are returned ordered by how often their file was skipped, file
+        and id, so that units of rarely skipped files are processed first.
+        They are read in pages of size `page` from the queue of available
+        units.  Units of isolation groups are left out, see
+        :meth:`__isolated_units`.
+        """
+        threshold = self.config.advanced.threshold_for_skipping
+        skipped, file, id = -1, -1, -1
+        while True:
+            rows = self.db.execute("""
+                select units.id, units.file, files.filename,
+                    run, lumi, lumi_last, arg, failed, files.events, files.bytes, available.skipped
+                from available, units, files
+                where
+                    available.workflow == ? and
+                    (available.skipped > ? or (available.skipped == ? and (
+                        available.file > ? or (available.file == ? and available.id > ?)
+                    ))) and
+                    available.skipped < ? and
+                    units.id == available.id and
+                    units.isolation is null and
+                    files.id == units.file
+                order by available.skipped, available.file, available.id
+                limit ?""", (workflow, skipped, skipped, file, file, id, threshold, page)).fetchall()
+            for row in rows:
+                yield row[:-1]
+            if len(rows) < page:
+                return
+            id, file = rows[-1][:2]
+            skipped = rows[-1][-1]
+
+    def __isolated_units(self, workflow):
+        """Returns the units of isolation groups available for processing.
+
+        Returns
+        -------
+            groups : list
+                A list of lists of units, one for each isolation group, as
+                tuples of `(id, file, filename, run, first, last, arg)`.
+        """
+        groups = defaultdict(list)
+        rows = self.db.execute("""
+                select units.isolation, units.id, units.file, files.filename, run, lumi, lumi_last, arg
+                from available, units, files
+                where
+                    available.workflow == ? and
+                    available.skipped < ? and
+                    units.id == available.id and
+                    units.isolation is not null and
+                    files.id == units.file
+                order by units.isolation, units.file, units.lumi""", (workflow, self.config.advanced.threshold_for_skipping))
+        for row in rows:
+            groups[row[0]].append(row[1:])
+        return [groups[isolation] for isolation in sorted(groups)]
+
+    def __isolate_failures(self, workflow, tasks):
+        """Count the failures of the units of failed `tasks`.
+
+        Units reaching `threshold_for_failure` are isolated: they are split
+        into groups, which are processed in tasks of their own.  With the
+        `bisect` isolation strategy, the units of each task are split in
+        halves, and units of a group that fails again are split further,
+        without counting the failure.  Only units failing by themselves
+        exceed the threshold and are not processed any longer.  The `unit`
+        strategy splits the units of a task into single units right away.
+        """
+        threshold = self.config.advanced.threshold_for_failure
+        for task in tasks:
+            rows = self.db.execute("""
+                select id, lumi, lumi_last, failed, isolation
+                from units
+                where task=?
+                order by file, lumi""", (task,)).fetchall()
+            single = sum(last - first + 1 for (_, first, last, _, _) in rows) == 1
+
+            if single:
+                self.db.execute("update units set failed=failed + 1 where task=?", (task,))
+            else:
+                self.db.execute("update units set failed=failed + 1 where task=? and failed < ?", (task, threshold))
+
+            rows = [(id, first, last, isolation) for (id, first, last, failed, isolation) in rows
+                    if failed + 1 == threshold or (failed == threshold and not single)]
+            if len(rows) == 0:
+                continue
+
+            total = sum(last - first + 1 for (_, first, last, _) in rows)
+            if self.config.advanced.isolation == 'bisect':
+                size = (total + 1) // 2
+            else:
+                size = 1
+            parent = rows[0][3]
+
+            # Fill groups of `size` units, splitting unit ranges where
+            # they cross the boundary of a group.
+            groups = []
+            sizes = []
+            for (id, first, last, _) in rows:
+                while True:
+                    if len(groups) == 0 or sizes[-1] == size:
+                        groups.append([])
+                        sizes.append(0)
+                    groups[-1].append(id)
+                    if last - first + 1 <= size - sizes[-1]:
+                        sizes[-1] += last - first + 1
+                        break
+                    first += size - sizes[-1]
+                    id = self.__split_unit_range(id, first)
+                    sizes[-1] = size
+
+            logger.debug("isolating {} unit(s) of failed task {} in {} group(s)".format(total, task, len(groups)))
+            for ids, units in zip(groups, sizes):
+                isolation = self.db.execute("""
+                    insert into isolations(workflow, task, parent, units)
+                    values (?, ?, ?, ?)""", (workflow, task, parent, units)).lastrowid
+                with self.__bulk_keys(ids) as keys:
+                    self.db.execute("""
+                        update units
+                        set isolation=?
+                        where id in (select id from {0})""".format(keys), (isolation,))
+
+    def __make_available(self, ids):
+        """Add units to the queue of available units.
+        """
+        with self.__bulk_keys(ids) as keys:
+            self.db.execute("""
+                insert or replace into available(id, workflow, file, skipped)
+                select units.id, units.workflow, units.file, files.skipped
+                from units, files
+                where units.id in (select id from {0}) and files.id == units.file
+                """.format(keys))
+
+    def __update_available(self, tasks):
+        """Synchronize the queue of available units for units of `tasks`.
+
+        Units that failed, but did not exceed the failure threshold, are
+        made available for processing again.
+        """
+        with self.__bulk_keys(tasks) as keys:
+            self.db.execute("""
+                delete from available
+                where id in (select id from units where task in (select id from {0}))
+                """.format(keys))
+            self.db.execute("""
+                insert into available(id, workflow, file, skipped)
+                select units.id, units.workflow, units.file, files.skipped
+                from units, files
+                where
+                    units.task in (select id from {0}) and
+                    units.status in (0, 3, 4) and
+                    units.failed <= ? and
+                    files.id == units.file
+                """.format(keys), (self.config.advanced.threshold_for_failure,))
+
+    def __split_unit_range(self, id, lumi):
+        """Split a range of units at a luminosity section.
+
+        Parameters
+        ----------
+            id : int
+                The id of the unit range to split.
+            lumi : int
+                The first luminosity section of the new unit range.
+
+        Returns
+        -------
+            id : int
+                The id of the new unit range.
+        """
+        new_id = self.db.execute("""
+            insert into units(workflow, task, run, lumi, lumi_last, file, status, failed, arg, isolation)
+            select workflow, task, run, ?, lumi_last, file, status, failed, arg, isolation
+            from units
+            where id=?""", (lumi, id)).lastrowid
+        self.db.execute("update units set lumi_last=? where id=?", (lumi - 1, id))
+        return new_id
 
     def reset_units(self):
         with self.db as db:
@@ -472,79 +1412,305 @@ class UnitStore:
             db.execute("update workflows set units_running=0, merged=0")
             db.execute("update tasks set status=4 where status=1")
             db.execute("update tasks set status=2 where status=7")
-            for (label, dset_id) in db.execute("select label, id from workflows"):
-                db.execute(
-                    "update files_{0} set units_running=0".format(label))
-                db.execute(
-                    "update units_{0} set status=4 where status=1".format(label))
-                db.execute(
-                    "update units_{0} set status=2 where status=7".format(label))
-                self.update_workflow_stats(label)
+            db.execute("update files set units_running=0")
+            db.execute("update units set status=4 where status=1")
+            db.execute("update units set status=2 where status=7")
+            self.check_workflow_stats()
         return ids
 
     @retry(stop_max_attempt_number=10)
     def update_units(self, taskinfos):
-        task_updates = []
+        self.__observations = []
+        with self.db:
+            self.__update_units(taskinfos)
+        self.__apply_observations()
+
+    def __apply_observations(self):
+        """Feed the runtimes collected by :meth:`__observe_runtimes` to the
+        runtime model, and adjust the task size of the workflows.
+
+        Called after committing the task updates, so that retrying a failed
+        transaction does not feed the same runtimes twice.
+        """
+        if len(self.__observations) == 0:
+            return
+        model = self.config.advanced.runtime_model
+        labels = set()
+        for observation in self.__observations:
+            model.observe(*observation)
+            labels.add(observation[0])
+        self.__observations = []
 
         with self.db:
-            for ((dset, unit_source), updates) in taskinfos.items():
-                file_updates = []
-                unit_updates = []
-                unit_fail_updates = []
-                unit_generic_updates = []
-
-                for (task_update, file_update, unit_update) in updates:
-                    task_updates.append(task_update)
-                    file_updates += file_update
-
-                    # units either fail or are successful
-                    # FIXME this should really go into the task handler
-                    if unit_source == 'tasks':
-                        unit_status = SUCCESSFUL if task_update.status == FAILED else MERGED
-                    else:
-                        unit_status = FAILED if task_update.status == FAILED else SUCCESSFUL
+            for label in labels:
+                self.__update_tasksize(label)
+
+    def __update_units(self, taskinfos):
+        task_updates = []
+
+        for ((dset, unit_source), updates) in taskinfos.items():
+            workflow = self.__workflow_id(dset)
 
-                    if task_update.status == FAILED:
-                        unit_fail_updates.append((task_update.id,))
+            file_updates = []
+            unit_updates = []
+            unit_fail_updates = []
+            unit_generic_updates = []
 
-                    unit_updates += unit_update
-                    unit_generic_updates.append((unit_status, task_update.id))
+            for (task_update, file_update, unit_update) in updates:
+                task_updates.append(task_update)
+                file_updates += file_update
 
-                # update all units of the tasks
+                # units either fail or are successful
+                # FIXME this should really go into the task handler
+                if unit_source == 'tasks':
+                    unit_status = SUCCESSFUL if task_update.status == FAILED else MERGED
+                else:
+                    unit_status = FAILED if task_update.status == FAILED else SUCCESSFUL
+
+                if task_update.status == FAILED:
+                    unit_fail_updates.append((task_update.id,))
+
+                unit_updates += unit_update
+                unit_generic_updates.append((unit_status, task_update.id))
+
+            # merge tasks do not alter the status of units
+            if unit_source != 'tasks':
+                task_ids = [task for (_, task) in unit_generic_updates]
+                before = self.__count_task_units(task_ids)
+
+            # update all units of the tasks
+            self.db.executemany("""update {0} set
+                status=?
+                where task=?""".format(unit_source),
+                                unit_generic_updates)
+
+            # update selected, missed units
+            self.__update_unit_status(unit_source, unit_updates)
+
+            # increment failed counter
+            if unit_source != 'tasks':
+                self.__isolate_failures(workflow, [task for (task,) in unit_fail_updates])
+            elif len(unit_fail_updates) > 0:
                 self.db.executemany("""update {0} set
-                    status=?
+                    failed=failed + 1
                     where task=?""".format(unit_source),
-                                    unit_generic_updates)
+                                    unit_fail_updates)
+
+            if unit_source != 'tasks':
+                after = self.__count_task_units(task_ids)
+                running, done, stuck, failed, skipped = [a - b for a, b in zip(after, before)]
+                newly_stuck, newly_skipped = self.__count_newly_skipped_units(workflow, file_updates)
+                self.__apply_unit_deltas(dset, running=running, done=done, stuck=stuck + newly_stuck,
+                                         failed=failed, skipped=skipped + newly_skipped)
+
+            # update files in the workflow
+            if len(file_updates) > 0:
+                self.db.executemany("""update files set
+                    units_running=ifnull((
+                        select sum(lumi_last - lumi + 1)
+                        from units
+                        where workflow=files.workflow and file=files.id and status==1
+                    ), 0),
+                    units_done=ifnull((
+                        select sum(lumi_last - lumi + 1)
+                        from units
+                        where workflow=files.workflow and file=files.id and status==2
+                    ), 0),
+                    events_read=(events_read + ?),
+                    skipped=(skipped + ?)
+                    where id=?""",
+                                    file_updates)
+
+            if unit_source != 'tasks':
+                self.__observe_runtimes(dset, workflow, [u for (u, _, _) in updates])
+                self.__update_available(task_ids)
+                self.db.executemany("""update available set
+                    skipped=(select skipped from files where id=?)
+                    where workflow=? and file=?""",
+                                    [(id, workflow, id) for (_, skipped, id) in file_updates if skipped > 0])
+
+        query = "update tasks set {0} where id=?".format(
+            TaskUpdate.sql_fragment(stop=-1))
+        self.db.executemany(query, task_updates)
+
+        for label, _ in taskinfos.keys():
+            self.update_workflow_stats(label)
 
-                # update selected, missed units
-                self.db.executemany("""update {0} set
-                    status=?
-                    where id=?""".format(unit_source),
-                                    unit_updates)
-
-                # increment failed counter
-                if len(unit_fail_updates) > 0:
-                    self.db.executemany("""update {0} set
-                        failed=failed + 1
-                        where task=?""".format(unit_source),
-                                        unit_fail_updates)
-
-                # update files in the workflow
-                if len(file_updates) > 0:
-                    self.db.executemany("""update files_{0} set
-                        units_running=(select count(*) from units_{0} where file=files_{0}.id and status==1),
-                        units_done=(select count(*) from units_{0} where file=files_{0}.id and status==2),
-                        events_read=(events_read + ?),
-                        skipped=(skipped + ?)
-                        where id=?""".format(dset),
-                                        file_updates)
-
-            query = "update tasks set {0} where id=?".format(
-                TaskUpdate.sql_fragment(stop=-1))
-            self.db.executemany(query, task_updates)
-
-            for label, _ in taskinfos.keys():
-                self.update_workflow_stats(label)
+    def __observe_runtimes(self, label, workflow, task_updates):
+        """Collect the runtime of successful tasks for the runtime model,
+        see :meth:`__apply_observations`.
+
+        The model is primed with the latest tasks stored in the database
+        when it has not seen the workflow yet, i.e., after a restart.
+        """
+        model = self.config.advanced.runtime_model
+        split_by, = self.db.execute("select split_by from workflows where id=?", (workflow,)).fetchone()
+
+        # Tasks do not record the bytes they read, so their runtime can't
+        # be related to their size in bytes.
+        if split_by == 'bytes':
+            return
+
+        column = 'events_read' if split_by == 'events' else 'units_processed'
+
+        if not model.known(label) and label not in set(o[0] for o in self.__observations):
+            rows = self.db.execute("""
+                select {0}, time_epilogue_end - time_stage_in_end, cache, host
+                from tasks
+                where workflow=? and status in (2, 6, 7, 8) and type=0
+                order by id desc limit 1000""".format(column), (workflow,)).fetchall()
+            for size, runtime, cache, host in reversed(rows):
+                self.__observations.append((label, size, runtime, cache, host))
+
+        for update in task_updates:
+            if update.status != SUCCESSFUL:
+                continue
+            self.__observations.append((label, getattr(update, column),
+                                        update.time_epilogue_end - update.time_stage_in_end,
+                                        update.cache, update.host))
+
+    def __update_unit_status(self, source, updates):
+        """Update the status of individual units.
+
+        Parameters
+        ----------
+            source : str
+                The table containing the units to update.
+            updates : list
+                A list of `(status, id, lumi)` tuples.  Where only part of
+                the luminosity sections of a unit range is updated, the
+                range gets split.
+        """
+        if source == 'tasks':
+            self.db.executemany("update tasks set status=? where id=?", [(s, id) for (s, id, _) in updates])
+            return
+
+        statuses = defaultdict(dict)
+        for (status, id, lumi) in updates:
+            statuses[id][lumi] = status
+
+        with self.__bulk_keys(statuses.keys()) as keys:
+            rows = self.db.execute(
+                "select id, lumi, lumi_last from {0} where id in (select id from {1})".format(source, keys)).fetchall()
+
+        simple = []
+        for (id, first, last) in rows:
+            lumis = statuses[id]
+            if len(set(lumis.values())) == 1 and (first == last or len(lumis) == last - first + 1):
+                simple.append((lumis.values()[0], id))
+                continue
+
+            # Split the range into segments of constant status, where
+            # `None` denotes to keep the current status.
+            segments = []
+            for lumi in range(first, last + 1):
+                status = lumis.get(lumi)
+                if len(segments) > 0 and segments[-1][0] == status:
+                    segments[-1][2] = lumi
+                else:
+                    segments.append([status, lumi, lumi])
+            for status, start, end in reversed(segments[1:]):
+                new_id = self.__split_unit_range(id, start)
+                if status is not None:
+                    simple.append((status, new_id))
+            status = segments[0][0]
+            if status is not None:
+                simple.append((status, id))
+
+        self.db.executemany("update {0} set status=? where id=?".format(source), simple)
+
+    def __count_task_units(self, tasks):
+        """Count the running, done, stuck, failed and skipped units
+        belonging to `tasks`.
+
+        Used to determine the change in the workflow unit counters by
+        counting before and after altering the units of a set of tasks.
+        """
+        thresholds = (self.config.advanced.threshold_for_failure, self.config.advanced.threshold_for_skipping)
+        with self.__bulk_keys(tasks) as keys:
+            return self.db.execute("""
+                select
+                    ifnull(sum((units.status == 1) * (lumi_last - lumi + 1)), 0),
+                    ifnull(sum((units.status in (2, 6, 7, 8)) * (lumi_last - lumi + 1)), 0),
+                    ifnull(sum((units.status in (0, 3, 4) and (
+                        failed > ? or files.skipped >= ?
+                    )) * (lumi_last - lumi + 1)), 0),
+                    ifnull(sum((units.status in (0, 3, 4) and failed > ?) * (lumi_last - lumi + 1)), 0),
+                    ifnull(sum((units.status in (0, 3, 4) and files.skipped >= ?) * (lumi_last - lumi + 1)), 0)
+                from units, files
+                where units.task in (select id from {0}) and files.id == units.file
+                """.format(keys), thresholds + thresholds).fetchone()
+
+    def __count_newly_skipped_units(self, workflow, file_updates):
+        """Count the units that become stuck and skipped by skipping files.
+
+        Has to be called before the skip counters of the files are
+        increased by `file_updates`.  Units that are already stuck due to
+        exceeding the failure threshold are not counted as newly stuck.
+        """
+        increments = defaultdict(int)
+        for (_, skipped, id) in file_updates:
+            increments[id] += skipped
+
+        stuck = 0
+        skipped = 0
+        threshold = self.config.advanced.threshold_for_skipping
+        for id, increment in increments.items():
+            if increment == 0:
+                continue
+            counts = self.db.execute("""
+                select
+                    ifnull(sum((failed <= ?) * (lumi_last - lumi + 1)), 0),
+                    ifnull(sum(lumi_last - lumi + 1), 0)
+                from units
+                where
+                    workflow=? and
+                    file=? and
+                    status in (0, 3, 4) and
+                    (select skipped from files where id=?) between ? and ?
+                """, (self.config.advanced.threshold_for_failure,
+                      workflow,
+                      id,
+                      id,
+                      threshold - increment,
+                      threshold - 1)).fetchone()
+            stuck += counts[0]
+            skipped += counts[1]
+        return stuck, skipped
+
+    def __apply_unit_deltas(self, label, registered=0, running=0, done=0, stuck=0, failed=0, skipped=0):
+        """Apply changes to the unit counters of a workflow.
+
+        Changes in the number of stuck units are propagated to all
+        dependent workflows, which consider units stuck upstream as
+        stuck, too.
+        """
+        self.db.execute("""
+            update workflows set
+                units_registered=(units_registered + ?),
+                units_running=(units_running + ?),
+                units_done=(units_done + ?),
+                units_stuck=(units_stuck + ?),
+                units_failed=(units_failed + ?),
+                units_skipped=(units_skipped + ?)
+            where label=?""", (registered, running, done, stuck, failed, skipped, label))
+        self.__update_derived_stats(label)
+
+        if stuck != 0:
+            for (child,) in self.db.execute("""
+                    select label
+                    from workflows
+                    where parent=(select id from workflows where label=?)""", (label,)).fetchall():
+                self.__apply_unit_deltas(child, stuck=stuck)
+
+    def __update_derived_stats(self, label):
+        self.db.execute("""
+            update workflows set
+                units_available=units_registered - (units_running + units_done + units_stuck - ifnull((
+                    select units_stuck from workflows as p where p.id == workflows.parent
+                ), 0)),
+                units_left=units - (units_masked + units_running + units_done + units_stuck)
+            where label=?""", (label,))
 
     def update_workflow_stats_stuck(self, roots=None):
         """Update workflow statistics after increasing thresholds.
@@ -553,12 +1719,15 @@ class UnitStore:
         trees between workflows, issuing blanket updates if a parent
         workflow is changed.
         """
-        if roots is None:
-            roots = [w for w in self.config.workflows if not w.parent]
         with self.db:
-            for m in sum([list(r.family()) for r in roots], []):
-                self.db.execute("update workflows set merged=0 where label=?", (m.label,))
-                self.update_workflow_stats(m.label)
+            if roots is None:
+                self.db.execute("update workflows set merged=0")
+                self.check_workflow_stats()
+                return
+            self.db.executemany("update workflows set merged=0 where label=?",
+                                [(m.label,) for r in roots for m in r.family()])
+            for r in roots:
+                self.check_workflow_stats(r.label)
 
     def update_workflow_runtime(self, updates):
         """Update workflow runtimes in the database.
@@ -570,24 +1739,16 @@ class UnitStore:
             self.db.executemany(
                 "update workflows set taskruntime=? where label=?", updates)
 
-    def update_workflow_stats(self, label):
-        id, size, targettime = self.db.execute(
-            "select id, tasksize, taskruntime from workflows where label=?", (label,)).fetchone()
+    def __update_tasksize(self, label):
+        id, size, split_by, targettime = self.db.execute(
+            "select id, tasksize, split_by, taskruntime from workflows where label=?", (label,)).fetchone()
 
-        if targettime is not None:
-            # Adjust tasksize based on time spend in prologue, processing, and
-            # epilogue.  Only do so when difference is > 10%
-            tasks, unittime = self.db.execute("""
-                select
-                    count(*),
-                    max(
-                        avg((time_epilogue_end - time_stage_in_end) * 1. / units),
-                        1
-                    )
-                from tasks where workflow=? and status in (2, 6, 7, 8) and type=0""", (id,)).fetchone()
-
-            if tasks > 10:
-                bettersize = max(1, int(math.ceil(targettime / unittime)))
+        # Tasks do not record the bytes they read, so their size in bytes
+        # stays fixed.  Otherwise, size tasks as predicted by the runtime
+        # model, and only update the database if the difference is > 5%.
+        if targettime is not None and split_by != 'bytes':
+            bettersize = self.config.advanced.runtime_model.tasksize(label, targettime)
+            if bettersize is not None:
                 logger.debug("newly calculated task size for {}: {} (old: {})".format(
                     label, bettersize, size))
                 if abs(float(bettersize - size) / size) > .05:
@@ -596,43 +1757,12 @@ class UnitStore:
                     self.db.execute(
                         "update workflows set tasksize=? where id=?", (bettersize, id))
 
-        parent_stuck = self.db.execute("""
-            select
-                ifnull((
-                    case when parent is not null
-                    then
-                        (select units_stuck from workflows where workflows.id == wf.parent)
-                    else 0
-                    end
-                ), 0)
-            from workflows as wf where id == ?
-            """, (id,)).fetchone()[0]
-
-        self.db.execute("""
-            update workflows set
-                units_stuck=ifnull((
-                        select count(*)
-                        from units_{0}
-                        where
-                            (failed > ? and status in (0, 3, 4)) or
-                            (file in (select id from files_{0} where skipped >= ?) and status in (0, 3, 4))
-                    ), 0) + ?,
-                units_running=ifnull((select count(*) from units_{0} where status == 1), 0),
-                units_done=ifnull((select count(*) from units_{0} where status in (2, 6, 7, 8)), 0)
-            where label=?""".format(label), (self.config.advanced.threshold_for_failure,
-                                             self.config.advanced.threshold_for_skipping,
-                                             parent_stuck,
-                                             label))
-
-        self.db.execute("""
-            update workflows set
-                units_available=ifnull((select count(*) from units_{0}), 0) - (units_running + units_done + (units_stuck - ?)),
-                units_left=units - (units_masked + units_running + units_done + units_stuck)
-            where label=?""".format(label), (parent_stuck, label))
+    def update_workflow_stats(self, label):
+        self.__update_tasksize(label)
 
-        if self.db.execute("select units_stuck from workflows where label=?", (label,)).fetchone()[0] > 0:
-            for (child,) in self.db.execute("select label from workflows where parent=?", (id,)):
-                self.update_workflow_stats(child)
+        # The unit counters are kept up to date incrementally, only the
+        # derived quantities need to be refreshed.
+        self.__update_derived_stats(label)
 
         if logger.getEffectiveLevel() <= logging.DEBUG:
             size, total, running, done, stuck, available, left, = self.db.execute("""
@@ -644,17 +1774,127 @@ class UnitStore:
                     units_stuck,
                     units_available,
                     units_left
-                from workflows where label=?""".format(label), (label,)).fetchone()
+                from workflows where label=?""", (label,)).fetchone()
 
             logger.debug(("updated stats for {0}:\n\t" +
                           "tasksize:                  {1}\n\t" +
                           "units total:               {2}\n\t" +
                           "units running:             {3}\n\t" +
                           "units done:                {4}\n\t" +
-                          "units stuck upstream:      {5}\n\t" +
+                          "units stuck:               {5}\n\t" +
                           "units available:           {6}\n\t" +
                           "units left:                {7}").format(
-                              label, size, total, running, done, parent_stuck, available, left))
+                              label, size, total, running, done, stuck, available, left))
+
+    def check_workflow_stats(self, label=None):
+        """Recount the unit counters of workflows.
+
+        The counters are usually updated incrementally, together with the
+        status of the units.  This performs a full count of all units of a
+        workflow and corrects the counters where needed, which is required
+        after changing the thresholds for failure or skipping, or after
+        resetting units upon a restart.
+
+        Parameters
+        ----------
+            label : str
+                The workflow to recount, including all dependent
+                workflows.  Recounts all workflows if `None`.
+        """
+        labels = {}
+        parents = {}
+        children = defaultdict(list)
+        stuck = {}
+        for (id, l, parent, units_stuck) in self.db.execute(
+                "select id, label, parent, units_stuck from workflows"):
+            labels[id] = l
+            parents[id] = parent
+            children[parent].append(id)
+            stuck[id] = units_stuck
+
+        # Order workflows to recount such that parents come before their
+        # children.
+        queue = children[None] if label is None else [self.__workflow_id(label)]
+        ids = []
+        while len(queue) > 0:
+            id = queue.pop(0)
+            ids.append(id)
+            queue.extend(children[id])
+
+        thresholds = (self.config.advanced.threshold_for_failure, self.config.advanced.threshold_for_skipping)
+        with self.__bulk_keys(ids) as keys:
+            unit_counts = dict((row[0], row[1:]) for row in self.db.execute("""
+                select
+                    units.workflow,
+                    sum(lumi_last - lumi + 1),
+                    sum((units.status == 1) * (lumi_last - lumi + 1)),
+                    sum((units.status in (2, 6, 7, 8)) * (lumi_last - lumi + 1)),
+                    sum((units.status in (0, 3, 4) and (
+                        units.failed > ? or files.skipped >= ?
+                    )) * (lumi_last - lumi + 1)),
+                    sum((units.status in (0, 3, 4) and units.failed > ?) * (lumi_last - lumi + 1)),
+                    sum((units.status in (0, 3, 4) and files.skipped >= ?) * (lumi_last - lumi + 1))
+                from units, files
+                where
+                    units.workflow in (select id from {0}) and
+                    files.id == units.file
+                group by units.workflow""".format(keys), thresholds + thresholds))
+            task_counts = dict((row[0], row[1:]) for row in self.db.execute("""
+                select
+                    workflow,
+                    sum((status == 2) * units_processed),
+                    sum((status == 8) * units_processed),
+                    sum((status in (2, 6, 7, 8)) * events_read),
+                    sum((status in (2, 6, 7, 8)) * events_written)
+                from tasks
+                where workflow in (select id from {0}) and type == 0
+                group by workflow""".format(keys)))
+            stored = dict((row[0], row[1:]) for row in self.db.execute("""
+                select
+                    id, units_registered, units_running, units_done, units_stuck,
+                    units_failed, units_skipped, units_processed, units_processed_merged,
+                    events_read, events_written
+                from workflows where id in (select id from {0})""".format(keys)))
+
+            # Rebuild the queue of available units, which depends on the
+            # failure threshold.
+            self.db.execute("delete from available where workflow in (select id from {0})".format(keys))
+            self.db.execute("""
+                insert into available(id, workflow, file, skipped)
+                select units.id, units.workflow, units.file, files.skipped
+                from units, files
+                where
+                    units.workflow in (select id from {0}) and
+                    units.status in (0, 3, 4) and
+                    units.failed <= ? and
+                    files.id == units.file""".format(keys), (self.config.advanced.threshold_for_failure,))
+
+        corrections = []
+        for id in ids:
+            registered, running, done, own_stuck, failed, skipped = unit_counts.get(id, (0,) * 6)
+            # Units stuck upstream are considered stuck, too.
+            stuck[id] = own_stuck + stuck.get(parents[id], 0)
+            counts = (registered, running, done, stuck[id], failed, skipped) + task_counts.get(id, (0,) * 4)
+            if counts != stored[id]:
+                logger.debug("correcting unit counters for {0} from {1} to {2}".format(labels[id], stored[id], counts))
+                corrections.append(counts + (id,))
+
+        self.db.executemany("""
+            update workflows set
+                units_registered=?,
+                units_running=?,
+                units_done=?,
+                units_stuck=?,
+                units_failed=?,
+                units_skipped=?,
+                units_processed=?,
+                units_processed_merged=?,
+                events_read=?,
+                events_written=?
+            where id=?""", corrections)
+
+        for id in ids:
+            self.update_workflow_stats(labels[id])
 
     def merged(self):
         unmerged = self.db.execute(
@@ -662,10 +1902,14 @@ class UnitStore:
         return unmerged == 0
 
     def estimate_tasks_left(self):
-        rows = [ts for (ts,) in self.db.execute("""
-            select (units_available - units_running) * 1. / tasksize
-            from workflows
-            where units_left > 0""")]
+        rows = []
+        for id, split_by, tasksize, ntasks in self.db.execute("""
+                select id, split_by, tasksize, (units_available - units_running) * 1. / tasksize
+                from workflows
+                where units_left > 0""").fetchall():
+            if split_by:
+                ntasks = self.__weight_available(id, split_by) * 1. / tasksize
+            rows.append(ntasks)
         if len(rows) == 0:
             return 0
 
@@ -700,80 +1944,73 @@ class UnitStore:
 
         return cur.fetchone()
 
-    def workflow_status(self):
-        cursor = self.db.execute("""
+    def workflow_status(self, structured=False):
+        """Summarize the processing status of all workflows.
+
+        Parameters
+        ----------
+            structured : bool
+                Return :class:`WorkflowSummary` records, with percentages as
+                numbers, instead of rows to display.
+
+        Returns
+        -------
+            summary : list
+                One entry per workflow and a total.  Unless `structured`
+                is set, the first row contains the column headers.
+        """
+        rows = self.db.execute("""
             select
                 label,
                 events,
-                ifnull((select sum(events_read) from tasks where workflow=workflows.id and status in (2, 6, 7, 8) and type=0), 0),
-                ifnull((select sum(events_written) from tasks where workflow=workflows.id and status in (2, 6, 7, 8) and type=0), 0),
+                events_read,
+                events_written,
                 units,
                 units - units_masked,
                 units_done,
-                ifnull((
-                    select sum(units_processed)
-                    from tasks
-                    where workflow=workflows.id and ((status=8 and type=0) or (status=2 and type=0 and workflows.merged=1))
-                ), 0),
+                units_processed_merged + (merged == 1) * units_processed,
                 units_stuck,
-                units_left,
-                '' || round(
-                        units_done * 100.0 / (units - units_masked),
-                    1) || ' %',
-                '' || ifnull(round(
-                        ifnull((
-                            select sum(units_processed)
-                            from tasks
-                            where workflow=workflows.id and ((status=8 and type=0) or (status=2 and type=0 and workflows.merged=1))
-                        ), 0) * 100.0 / (units - units_masked),
-                    1), 0.0) || ' %'
-            from workflows""")
-
-        yield "Label Events read written Units unmasked written merged stuck failed skipped left Progress Merged".split()
+                units_failed,
+                units_skipped,
+                units_left
+            from workflows""").fetchall()
 
+        def percent(part, whole):
+            return round(part * 100. / whole, 1) if whole > 0 else None
+
+        summaries = []
         total = None
         total_mergeable = 0
-        for label, events, read, written, units, unmasked, units_done, merged, stuck, \
-                left, progress_percent, merged_percent in cursor:
+        for row in rows:
+            label, row = row[0], list(row[1:])
             workflow = getattr(self.config.workflows, label)
             mergeable = workflow.merge_size > 1
             if not mergeable:
-                merged = 0
-                merged_percent = '0.0 %'
-
-            failed, skipped = self.db.execute("""
-                select
-                    ifnull((
-                            select count(*)
-                            from units_{0}
-                            where failed > ? and status in (0, 3, 4)
-                        ), 0),
-                    ifnull((
-                            select count(*)
-                            from units_{0}
-                            where file in (select id from files_{0} where skipped >= ?) and status in (0, 3, 4)
-                        ), 0)
-                from workflows
-                where label=?
-                """.format(label), (self.config.advanced.threshold_for_failure,
-                                    self.config.advanced.threshold_for_skipping,
-                                    label)
-            ).fetchone()
+                row[6] = 0
+            else:
+                total_mergeable += row[4]
 
-            row = [events, read, written, units, unmasked, units_done, merged, stuck, failed, skipped, left]
             if total is None:
                 total = row
             else:
                 total = map(sum, zip(total, row))
-            if mergeable:
-                total_mergeable += unmasked
 
-            yield [label] + row + [progress_percent, merged_percent]
+            summaries.append(WorkflowSummary(label, *(row + [percent(row[5], row[4]), percent(row[6], row[4]) or 0.])))
 
         total_unmasked, total_units_done, total_merged = total[4:7]
-        yield ['Total'] + total + [
-            '{} %'.format(round(total_units_done * 100. / total_unmasked, 1)),
-            '{} %'.format(round(total_merged * 100. / total_mergeable, 1) if total_mergeable > 0 else 0.)
+        summaries.append(WorkflowSummary('Total', *(total + [
+            percent(total_units_done, total_unmasked),
+            percent(total_merged, total_mergeable) or 0.
+        ])))
+
+        if structured:
+            return summaries
+
+        return [
+            "Label Events read written Units unmasked written merged stuck failed skipped left Progress Merged".split()
+        ] + [
+            list(summary)[:-2] + ['{} %'.format(p) if p is not None else None for p in list(summary)[-2:]]
+            for summary in summaries
         ]
 
     @retry(stop_max_attempt_number=10)
@@ -821,67 +2058,23 @@ class UnitStore:
 
         logger.debug("trying to merge tasks from {0}".format(workflow))
 
-        class Merge(object):
-
-            def __init__(self, task, units, size, maxsize):
-                self.tasks = [task]
-                self.units = units
-                self.size = size
-                self.maxsize = maxsize
-
-            def __cmp__(self, other):
-                return cmp(self.size, other.size)
-
-            def add(self, task, units, size):
-                if self.size + size > self.maxsize:
-                    return False
-                self.size += size
-                self.units += units
-                self.tasks.append(task)
-                return True
-
-            def left(self):
-                return self.maxsize - self.size
-
         with self.db:
             # Select the finished processing tasks from the task
             rows = self.db.execute("""
                 select id, units, bytes_bare_output
                 from tasks
-                where workflow=? and status=? and type=0
-                order by bytes_bare_output desc""", (dset_id, SUCCESSFUL)).fetchall()
-
-            # If we don't have enough rows, or the smallest two tasks can't be
-            # merge, set this up so that the loop below is not evaluted and we
-            # skip to the check if the merge for this workflow is complete for
-            # the given maximum size.
-            if len(rows) < 2 or rows[-2][1] + rows[-1][1] > bytes:
-                rows = []
-            else:
-                minsize = rows[-1][1]
-
-            candidates = []
-            for task, units, size in rows:
-                # Try to add the current task to a merge, in increasing order of
-                # size left
-                for merge in reversed(sorted(candidates)):
-                    if merge.add(task, units, size):
-                        break
-                else:
-                    # If we're too large to merge, we're skipped
-                    if size + minsize <= bytes:
-                        candidates.append(Merge(task, units, size, bytes))
+                where workflow=? and status=? and type=0""", (dset_id, SUCCESSFUL)).fetchall()
 
             merges = []
-            for merge in reversed(sorted(candidates)):
-                if len(merge.tasks) == 1:
+            for tasks, units, size in plan_merges(rows, bytes):
+                if len(tasks) == 1:
                     continue
                 # For one iteration only: merge if we are either close enough
                 # to the target size (TODO maybe this threshold should be
                 # configurable? FIXME it's a magic number, anyways) or we are
                 # done processing the task, when we merge everything we can.
-                if units_complete or merge.size >= bytes * 0.9:
-                    merges.append(merge)
+                if units_complete or size >= bytes * 0.9:
+                    merges.append((tasks, units))
 
             logger.debug("created {0} merge tasks".format(len(merges)))
 
@@ -896,16 +2089,16 @@ class UnitStore:
 
             res = []
             merge_update = []
-            for merge in merges:
+            for tasks, units in merges:
                 merge_id = self.db.execute("""
                     insert into
                     tasks(workflow, units, status, type)
-                    values (?, ?, ?, ?)""", (dset_id, merge.units, ASSIGNED, MERGE)).lastrowid
+                    values (?, ?, ?, ?)""", (dset_id, units, ASSIGNED, MERGE)).lastrowid
                 logger.debug("inserted merge task {0} with tasks {1}".format(
-                    merge_id, ", ".join(map(str, merge.tasks))))
+                    merge_id, ", ".join(map(str, tasks))))
                 res += [(str(merge_id), workflow, [], [(id, None, -1, -1)
-                                                       for id in merge.tasks], "", True)]
-                merge_update += [(merge_id, id) for id in merge.tasks]
+                                                       for id in tasks], "", True)]
+                merge_update += [(merge_id, id) for id in tasks]
 
             if len(res) > 0:
                 self.db.executemany(
@@ -922,9 +2115,9 @@ class UnitStore:
                 set status=6, published_file_block=?
                 where id=?""", update)
             self.db.executemany("""
-                update units_{}
+                update units
                 set status=6
-                where task=?""".format(label), [(t,) for t in tasks])
+                where task=?""", [(t,) for t in tasks])
 
     def successful_tasks(self, label):
         dset_id = self.db.execute(
@@ -960,8 +2153,8 @@ class UnitStore:
         return cur
 
     def failed_units(self, label):
-        tasks = self.db.execute("select task from units_{0} where failed > ?".format(
-            label), (self.config.advanced.threshold_for_failure,))
+        tasks = self.db.execute("select task from units where workflow=? and failed > ?",
+                                (self.__workflow_id(label), self.config.advanced.threshold_for_failure))
         return [xs[0] for xs in tasks]
 
     def running_tasks(self):
@@ -970,8 +2163,8 @@ class UnitStore:
             yield v
 
     def skipped_files(self, label):
-        files = self.db.execute("select filename from files_{0} where skipped > ?".format(
-            label), (self.config.advanced.threshold_for_skipping,))
+        files = self.db.execute("select filename from files where workflow=? and skipped > ?",
+                                (self.__workflow_id(label), self.config.advanced.threshold_for_skipping))
         return [xs[0] for xs in files]
 
     def update_pset_hash(self, pset_hash, workflow):
@@ -982,12 +2175,23 @@ class UnitStore:
     @retry(stop_max_attempt_number=10)
     def update_missing(self, tasks):
         with self.db:
-            for task, workflow in self.db.execute("""
-                    select tasks.id, workflows.label
-                    from tasks, workflows
-                    where tasks.id in ({0}) and tasks.workflow=workflows.id""".format(", ".join(map(str, tasks)))):
-                self.db.execute(
-                    "update units_{0} set status=3 where task=?".format(workflow), (task,))
+            workflows = defaultdict(list)
+            with self.__bulk_keys(tasks) as keys:
+                for task, workflow in self.db.execute("""
+                        select tasks.id, workflows.label
+                        from tasks, workflows
+                        where tasks.id in (select id from {0}) and tasks.workflow=workflows.id""".format(keys)).fetchall():
+                    workflows[workflow].append(task)
+
+            for workflow, ids in workflows.items():
+                before = self.__count_task_units(ids)
+                self.db.executemany(
+                    "update units set status=3 where task=?", [(task,) for task in ids])
+                self.__update_available(ids)
+                after = self.__count_task_units(ids)
+                running, done, stuck, failed, skipped = [a - b for a, b in zip(after, before)]
+                self.__apply_unit_deltas(workflow, running=running, done=done, stuck=stuck,
+                                         failed=failed, skipped=skipped)
 
             # update tasks to be failed
             self.db.executemany("update tasks set status=3 where id=?", [
@@ -996,29 +2200,70 @@ class UnitStore:
             self.db.executemany("update tasks set status=2 where task=?", [
                                 (task,) for task in tasks])
 
+    @retry(stop_max_attempt_number=10)
+    def rollback_tasks(self, tasks):
+        """Abort tasks that were created, but never submitted.
+
+        The units of processing tasks become available again, and the
+        tasks to be merged by merge tasks are marked as successful.
+        """
+        with self.db:
+            workflows = defaultdict(list)
+            with self.__bulk_keys(tasks) as keys:
+                for task, workflow in self.db.execute("""
+                        select tasks.id, workflows.label
+                        from tasks, workflows
+                        where tasks.id in (select id from {0}) and tasks.workflow=workflows.id""".format(keys)).fetchall():
+                    workflows[workflow].append(task)
+
+            for workflow, ids in workflows.items():
+                before = self.__count_task_units(ids)
+                with self.__bulk_keys(ids) as keys:
+                    self.db.execute("""
+                        update units set status=4
+                        where task in (select id from {0}) and status=1""".format(keys))
+                    self.db.execute("""
+                        update files set
+                        units_running=ifnull((
+                            select sum(lumi_last - lumi + 1)
+                            from units
+                            where workflow=files.workflow and file=files.id and status==1
+                        ), 0)
+                        where id in (select file from units where task in (select id from {0}))""".format(keys))
+                self.__update_available(ids)
+                after = self.__count_task_units(ids)
+                running, done, stuck, failed, skipped = [a - b for a, b in zip(after, before)]
+                self.__apply_unit_deltas(workflow, running=running, done=done, stuck=stuck,
+                                         failed=failed, skipped=skipped)
+
+            self.db.executemany("update tasks set status=4 where id=? and status=1", [(task,) for task in tasks])
+            self.db.executemany("update tasks set status=2 where task=? and status=7", [(task,) for task in tasks])
+
     def finished_files(self, infos):
-        res = []
-        for label, files in infos.items():
-            for i in range(0, len(files), 999):
-                chunk = list(files)[i:i + 999]
-                res.extend(
-                    self.db.execute(
-                        """select filename
-                        from files_{0}
-                        where id in ({1}) and (units_done == units)""".format(label, ', '.join('?' for _ in chunk)), tuple(chunk)
-                    )
-                )
+        ids = [id for files in infos.values() for id in files]
+        with self.db:
+            with self.__bulk_keys(ids) as keys:
+                res = self.db.execute("""
+                    select filename
+                    from files
+                    where id in (select id from {0}) and (units_done == units)""".format(keys)).fetchall()
 
         return (x[0] for x in res)
 
     def update_transfers(self, transfers):
+        with self.db:
+            self.__update_transfers(transfers)
+
+    def __update_transfers(self, transfers):
         for dataset in transfers:
             data = json.loads(self.db.execute(
                 "select transfers from workflows where dataset=?", (dataset,)).fetchone()[0])
 
+            # Do not modify the argument, so that updates can be repeated
+            # after a failed commit.
+            update = {}
             for protocol in transfers[dataset]:
-                if protocol in data:
-                    transfers[dataset][protocol] += Counter(data[protocol])
+                update[protocol] = transfers[dataset][protocol] + Counter(data.get(protocol, {}))
 
             self.db.execute("update workflows set transfers=? where dataset=?", (json.dumps(
-                transfers[dataset]), dataset))
+                update), dataset))
@@ -5,7 +5,9 @@ import re
 if 'LOBSTER_SKIP_HADOOP' not in os.environ:
     import snakebite.client
     import snakebite.errors
+import stat
 import subprocess
+import threading
 import xml.dom.minidom
 
 from contextlib import contextmanager
@@ -131,6 +133,9 @@ class StorageElement(object):
 
     def fixresult(self, res):
         def pfn2lfn(p):
+            if isinstance(p, tuple):
+                # entries of long listings
+                return (pfn2lfn(p[0]),) + p[1:]
             return p.replace(self._pfnprefix, '', 1)
 
         if isinstance(res, basestring):
@@ -181,6 +186,15 @@ class Local(StorageElement):
         for fn in os.listdir(path):
             yield os.path.join(path, fn)
 
+    def lsl(self, path):
+        for fn in os.listdir(path):
+            try:
+                info = os.stat(os.path.join(path, fn))
+            except OSError:
+                # dangling links
+                continue
+            yield os.path.join(path, fn), stat.S_ISDIR(info.st_mode), info.st_size
+
     def mkdir(self, path, mode=None):
         os.mkdir(path)
         if mode:
@@ -202,6 +216,7 @@ class Hadoop(StorageElement):
     def __init__(self, host, port, pfnprefix='/hadoop'):
         super(Hadoop, self).__init__(pfnprefix)
         self.__c = snakebite.client.Client(host, int(port))
+        self.__lock = threading.Lock()
 
     @property
     def errors(self):
@@ -227,6 +242,11 @@ class Hadoop(StorageElement):
         for data in self.__c.ls([path]):
             yield data['path']
 
+    def lsl(self, path):
+        # the client is not thread-safe
+        with self.__lock:
+            return [(data['path'], data['file_type'] == 'd', data['length']) for data in self.__c.ls([path])]
+
     def mkdir(self, path, mode):
         for data in self.__c.mkdir([path], mode=mode):
             pass
@@ -261,6 +281,7 @@ class Chirp(StorageElement):
         super(Chirp, self).__init__(pfnprefix)
 
         self.__c = chirp.Client(server, timeout=10)
+        self.__lock = threading.Lock()
 
     def exists(self, path):
         try:
@@ -283,6 +304,12 @@ class Chirp(StorageElement):
             if f.path not in ('.', '..'):
                 yield os.path.join(path, f.path)
 
+    def lsl(self, path):
+        # the client is not thread-safe
+        with self.__lock:
+            return [(os.path.join(path, f.path), stat.S_ISDIR(f.mode), f.size)
+                    for f in self.__c.ls(str(path)) if f.path not in ('.', '..')]
+
     def mkdir(self, path, mode=None):
         self.__c.mkdir(str(path))
         if mode:
@@ -343,6 +370,13 @@ class SRM(StorageElement):
         for p in self.execute('ls', path).splitlines():
             yield os.path.join(path, p)
 
+    def lsl(self, path):
+        for line in self.execute('ls -l', path).splitlines():
+            # mode, links, user, group, size, month, day, time, name
+            fields = line.split(None, 8)
+            if len(fields) == 9:
+                yield os.path.join(path, fields[8]), fields[0].startswith('d'), int(fields[4])
+
     def mkdir(self, path, mode=None):
         self.execute('mkdir -p', path)
 
@@ -438,6 +472,14 @@ class XrootD(StorageElement):
             # can recognize and remove just the pfnprefix.
             yield "{0}://{1}{2}".format(protocol, server, p)
 
+    def lsl(self, path):
+        protocol, server, _ = url_re.match(path).groups()
+        for line in self.execute('ls -l', path).splitlines():
+            # flags, date, time, size, path
+            fields = line.split(None, 4)
+            if len(fields) == 5:
+                yield "{0}://{1}{2}".format(protocol, server, fields[4]), fields[0].startswith('d'), int(fields[3])
+
     def mkdir(self, path, mode=None):
         self.execute('mkdir -p', path)
 
@@ -655,13 +697,17 @@ class StorageConfiguration(Configurable):
         merge : bool
             Specify if this is a merging parameter set.
         """
+        # Shuffle copies: tasks are prepared concurrently, and the server
+        # lists are shared by all of them.
+        inputs = list(self.input)
+        outputs = list(self.output)
         if self.shuffle_inputs:
-            random.shuffle(self.input)
+            random.shuffle(inputs)
         if self.shuffle_outputs or (self.shuffle_inputs and merge):
-            random.shuffle(self.output)
+            random.shuffle(outputs)
 
-        parameters['input'] = self.input if not merge else self.output
-        parameters['output'] = self.output
+        parameters['input'] = inputs if not merge else list(outputs)
+        parameters['output'] = outputs
         parameters['disable streaming'] = self.disable_input_streaming
         if not self.disable_stage_in_acceleration:
             parameters['accelerate stage-in'] = 3
@@ -17,13 +17,14 @@ import shlex
 import shutil
 import smtplib
 import subprocess
+import threading
 import time
 
 from contextlib import contextmanager
 from email.mime.text import MIMEText
 from pkg_resources import get_distribution
 
-VERSION = "1.9"
+VERSION = "1.10"
 
 logger = logging.getLogger('lobster.util')
 
@@ -480,10 +481,16 @@ def get_lock(workdir, force=False):
     return pidfile
 
 
+# Task directories are created in the background while others are moved,
+# which may remove their parent directories.
+_taskdir_lock = threading.Lock()
+
+
 def taskdir(workdir, taskid, status='running'):
     tdir = os.path.normpath(os.path.join(workdir, status, id2dir(taskid)))
-    if not os.path.isdir(tdir):
-        os.makedirs(tdir)
+    with _taskdir_lock:
+        if not os.path.isdir(tdir):
+            os.makedirs(tdir)
     return tdir
 
 
@@ -498,9 +505,13 @@ def move(workdir, taskid, status, oldstatus='running'):
     old = os.path.normpath(os.path.join(workdir, oldstatus, id2dir(taskid)))
     new = os.path.normpath(os.path.join(workdir, status, id2dir(taskid)))
     parent = os.path.dirname(new)
-    if not os.path.isdir(parent):
-        os.makedirs(parent)
+    with _taskdir_lock:
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
     shutil.move(old, parent)
-    if len(os.listdir(os.path.dirname(old))) == 0:
-        os.removedirs(os.path.dirname(old))
+    # Other tasks may have been moved out of the same directory in the
+    # meantime, and already removed it.
+    with _taskdir_lock:
+        if os.path.isdir(os.path.dirname(old)) and len(os.listdir(os.path.dirname(old))) == 0:
+            os.removedirs(os.path.dirname(old))
     return new
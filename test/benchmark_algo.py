@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+
+from lobster import se, util
+from lobster.core.config import AdvancedOptions, Config
+from lobster.core.create import Algo
+from lobster.core.workflow import Category, Workflow
+
+parser = argparse.ArgumentParser(
+    description='replay the resources recorded in lobster_stats_*.log files through the task '
+                'creation, and compare how well tasks fill the resources when sizing by cores only or '
+                'by all resources')
+parser.add_argument('logs', nargs='+',
+                    help='statistics logs of a Lobster project, i.e., lobster_stats_all.log')
+parser.add_argument('--category', action='append', default=[],
+                    help='category as name:cores:memory:disk:runtime, with memory and disk in MB, '
+                    'and the runtime in seconds; empty fields are not specified (default: '
+                    'one category with 1 core, 2000 MB, and one with 4 cores, 8000 MB)')
+parser.add_argument('--tasks', type=int, default=100000,
+                    help='number of tasks each category can create')
+parser.add_argument('--payload', type=int, default=10,
+                    help='minimum number of tasks to keep in the queue')
+args = parser.parse_args()
+
+os.environ.setdefault('LOCALRT', '')
+
+
+def read(filename):
+    """Yield timestamps in seconds and resource vectors of a statistics log.
+    """
+    headers = None
+    with open(filename) as f:
+        for line in f:
+            if line.startswith('#'):
+                headers = dict((k, n) for n, k in enumerate(line[1:].split()))
+                continue
+            values = line.split()
+            yield float(values[headers['timestamp']]) / 1e6, dict(
+                (r, float(values[headers['total_' + r]])) for r in Algo.resources if 'total_' + r in headers)
+
+
+def parse(spec):
+    name, cores, memory, disk, runtime = (spec.split(':') + [''] * 5)[:5]
+    return Category(name, cores=int(cores) if cores else None, memory=int(memory) if memory else None,
+                    disk=int(disk) if disk else None, runtime=int(runtime) if runtime else 3600)
+
+
+def simulate(samples, categories, by_resources):
+    with util.PartiallyMutable.unlock():
+        workflows = [Workflow(c.name, None, category=c, command='foo') for c in categories]
+        algo = Algo(
+            Config(
+                label='benchmark',
+                workdir='/tmp/lobster_benchmark_algo',
+                storage=se.StorageConfiguration(output=['file:///tmp/lobster_benchmark_algo']),
+                workflows=workflows,
+                advanced=AdvancedOptions(proxy=False, dashboard=False, osg_version="3.3", payload=args.payload)
+            )
+        )
+
+    def need(category, resource):
+        return (category.cores or 1) if resource == 'cores' else (getattr(category, resource) or 0)
+
+    left = dict((w, args.tasks) for w in workflows)
+    waiting = dict((c.name, 0) for c in categories)
+    running = dict((c.name, []) for c in categories)
+
+    fill = dict((r, 0.) for r in Algo.resources)
+    idle = dict((c.name, 0.) for c in categories)
+    done = dict((c.name, 0) for c in categories)
+    duration = 0.
+    last = None
+
+    for now, total in samples:
+        for c in categories:
+            done[c.name] += len([end for end in running[c.name] if end <= now])
+            running[c.name] = [end for end in running[c.name] if end > now]
+
+        # workers leaving evict tasks back into the queue
+        for r in total:
+            while sum(need(c, r) * len(running[c.name]) for c in categories) > total[r]:
+                c = max(categories, key=lambda c: need(c, r) * len(running[c.name]))
+                running[c.name].pop()
+                waiting[c.name] += 1
+
+        queued = dict((c.name, {'running': len(running[c.name]), 'queued': waiting[c.name]}) for c in categories)
+        remaining = dict((w, (True, left[w], left[w])) for w in workflows if left[w] > 0)
+        for label, ntasks, _ in algo.run(total if by_resources else total.get('cores', 0), queued, remaining):
+            wflow = [w for w in workflows if w.label == label][0]
+            ntasks = min(ntasks, left[wflow])
+            left[wflow] -= ntasks
+            waiting[wflow.category.name] += ntasks
+
+        # start waiting tasks while they fit into the free resources
+        started = True
+        while started:
+            started = False
+            for c in categories:
+                used = dict((r, sum(need(d, r) * len(running[d.name]) for d in categories)) for r in total)
+                if waiting[c.name] > 0 and all(used[r] + need(c, r) <= total[r] for r in total):
+                    waiting[c.name] -= 1
+                    running[c.name].append(now + c.runtime)
+                    started = True
+
+        if last is not None:
+            interval = now - last
+            duration += interval
+            for r in total:
+                if total[r] > 0:
+                    fill[r] += interval * sum(need(c, r) * len(running[c.name]) for c in categories) / total[r]
+            for c in categories:
+                idle[c.name] += interval * waiting[c.name]
+        last = now
+
+    return dict((r, fill[r] / duration) for r in fill), dict((c, idle[c] / duration) for c in idle), done
+
+
+samples = sorted(s for log in args.logs for s in read(log))
+categories = [parse(spec) for spec in args.category] or [Category('small', cores=1, memory=2000, runtime=3600),
+                                                         Category('large', cores=4, memory=8000, runtime=3600)]
+
+for mode, by_resources in (('cores', False), ('resources', True)):
+    fill, waiting, done = simulate(samples, categories, by_resources)
+    print 'sizing by {:10}: cores {:6.1%}, memory {:6.1%}, disk {:6.1%} filled'.format(
+        mode, fill['cores'], fill['memory'], fill['disk'])
+    for c in categories:
+        print '    {:10}: {:8} tasks done, {:8.1f} tasks waiting on average'.format(c.name, done[c.name], waiting[c.name])
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+import argparse
+import random
+import time
+
+from lobster.cmssw.dataset import BlockQuery
+
+parser = argparse.ArgumentParser(
+    description='measure the rate of block queries against a DBS stand-in with a given latency')
+parser.add_argument('--blocks', type=int, default=500,
+                    help='number of blocks to query')
+parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8, 16],
+                    help='thread counts to time')
+parser.add_argument('--latency', type=float, default=0.05,
+                    help='mean latency of a DBS call in seconds')
+parser.add_argument('--lumis', type=int, default=1000,
+                    help='luminosity sections returned per block')
+args = parser.parse_args()
+
+
+class LatentDbs(object):
+
+    def listFileLumis(self, block_name):
+        time.sleep(random.expovariate(1. / args.latency))
+        return [{'logical_file_name': block_name + '.root', 'run_num': 1, 'lumi_section_num': range(args.lumis)}]
+
+
+blocks = ['/benchmark#{0}'.format(i) for i in range(args.blocks)]
+for threads in args.threads:
+    query = BlockQuery(LatentDbs, threads=threads)
+    start = time.time()
+    list(query(blocks))
+    duration = time.time() - start
+    print 'threads {:3}: {:6} blocks in {:8.3f}s, {:8.1f} blocks/s'.format(
+        threads, args.blocks, duration, args.blocks / duration)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from lobster import fs, se
+from lobster.core.dataset import discover
+
+parser = argparse.ArgumentParser(
+    description='time file discovery in a directory tree on storage with a given latency per call')
+parser.add_argument('--dirs', type=int, default=50,
+                    help='number of subdirectories')
+parser.add_argument('--files', type=int, default=100,
+                    help='number of files per subdirectory')
+parser.add_argument('--latency', type=float, default=0.02,
+                    help='latency of each file system call in seconds')
+parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32],
+                    help='thread counts to time')
+args = parser.parse_args()
+
+
+class SlowLocal(se.Local):
+
+    """Local storage with the latency of remote file system calls.
+    """
+
+    def __init__(self, pfnprefix):
+        super(SlowLocal, self).__init__(pfnprefix)
+        for method in ('isdir', 'isfile', 'getsize'):
+            setattr(self, method, self.__delay(getattr(self, method)))
+
+    def __delay(self, method):
+        def delayed(*paths):
+            time.sleep(args.latency)
+            return method(*paths)
+        return delayed
+
+    def ls(self, path):
+        time.sleep(args.latency)
+        return list(super(SlowLocal, self).ls(path))
+
+    def lsl(self, path):
+        time.sleep(args.latency)
+        return list(super(SlowLocal, self).lsl(path))
+
+
+workdir = tempfile.mkdtemp()
+try:
+    for d in range(args.dirs):
+        os.makedirs(os.path.join(workdir, 'data', str(d)))
+        for f in range(args.files):
+            with open(os.path.join(workdir, 'data', str(d), '{0}.root'.format(f)), 'w') as fd:
+                fd.write('x' * f)
+
+    fs.configure([SlowLocal(workdir)], [])
+
+    # listing and checking every entry, as before
+    start = time.time()
+    found = 0
+    dirs = ['data']
+    while dirs:
+        path = dirs.pop()
+        for entry in fs.ls(path):
+            if fs.isdir(entry):
+                dirs.append(entry)
+            elif fs.isfile(entry):
+                fs.getsize(entry)
+                found += 1
+    print 'files {:7}: serial walk with stat calls {:8.3f}s'.format(found, time.time() - start)
+
+    for threads in args.threads:
+        start = time.time()
+        found = sum(1 for _ in discover('data', recursive=True, threads=threads))
+        print 'files {:7}: discover with {:3} threads   {:8.3f}s'.format(found, threads, time.time() - start)
+finally:
+    shutil.rmtree(workdir)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from lobster import se
+from lobster.core.config import Config, AdvancedOptions
+from lobster.core.dataset import DatasetInfo
+from lobster.core.task import TaskHandler
+from lobster.core.unit import TaskUpdate, UnitStore
+from lobster.core.workflow import Workflow
+
+parser = argparse.ArgumentParser(
+    description='time the file bookkeeping of large file based tasks')
+parser.add_argument('--files', type=int, default=20000,
+                    help='number of files in the workflow')
+parser.add_argument('--files-per-task', type=int, default=500,
+                    help='number of files per task')
+parser.add_argument('--tasks', type=int, default=10,
+                    help='tasks to create per call')
+args = parser.parse_args()
+
+os.environ.setdefault('LOCALRT', '')
+
+workdir = tempfile.mkdtemp()
+try:
+    store = UnitStore(
+        Config(
+            label='benchmark',
+            workdir=workdir,
+            storage=se.StorageConfiguration(output=['file://' + workdir]),
+            workflows=[],
+            advanced=AdvancedOptions(proxy=False, dashboard=False, osg_version="3.3")
+        )
+    )
+
+    info = DatasetInfo()
+    info.file_based = True
+    info.tasksize = args.files_per_task
+    info.path = ''
+    for f in range(args.files):
+        info.files['/benchmark/{0}.root'.format(f)].lumis = [(-1, -1)]
+    info.total_units = args.files
+    info.unmasked_units = args.files
+
+    store.register_dataset(Workflow('benchmark', None, command='foo'), info)
+
+    seen = set()
+    tasks = 0
+    popping = 0.
+    handling = 0.
+    updating = 0.
+    while True:
+        start = time.time()
+        new = store.pop_units('benchmark', args.tasks)
+        popping += time.time() - start
+
+        if len(new) == 0:
+            break
+
+        updates = []
+        start = time.time()
+        for (id, label, files, units, arg, _) in new:
+            task_update = TaskUpdate(host='hostname', id=id, submissions=1)
+            handler = TaskHandler(id, label, files, units, None, True)
+            # skip every tenth file the first time around
+            files_info = dict((fn, (100, [(-1, -1)])) for (i, (fid, fn)) in enumerate(files) if fid in seen or i % 10 != 0)
+            seen.update(fid for (fid, _) in files)
+            file_update, unit_update = handler.get_unit_info(False, task_update, files_info, [], 100)
+            updates.append((task_update, file_update, unit_update))
+        handling += time.time() - start
+        tasks += len(new)
+
+        start = time.time()
+        store.update_units({(label, 'units'): updates})
+        updating += time.time() - start
+
+    print 'files {:7} in {:5} tasks of {:4} files: pop_units {:8.3f}s, get_unit_info {:8.3f}s, update_units {:8.3f}s'.format(
+        args.files, tasks, args.files_per_task, popping, handling, updating)
+finally:
+    shutil.rmtree(workdir)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from lobster.cmssw.dataset import LumiMask
+from lobster.core.dataset import LumiArray
+
+from WMCore.DataStructs.LumiList import LumiList
+
+parser = argparse.ArgumentParser(
+    description='time the application of a lumi mask to a dataset')
+parser.add_argument('--runs', type=int, default=500,
+                    help='number of runs in the dataset')
+parser.add_argument('--lumis', type=int, default=2000,
+                    help='luminosity sections per run')
+parser.add_argument('--files', type=int, default=100,
+                    help='files per block')
+args = parser.parse_args()
+
+mask = {}
+for run in range(1, args.runs + 1):
+    ranges = []
+    first = 1
+    while first < args.lumis:
+        last = first + random.randint(0, 200)
+        ranges.append([first, last])
+        first = last + random.randint(2, 50)
+    mask[str(run)] = ranges
+
+fd, filename = tempfile.mkstemp(suffix='.json')
+try:
+    with os.fdopen(fd, 'w') as f:
+        json.dump(mask, f)
+
+    blocks = []
+    for run in range(1, args.runs + 1):
+        lumis = range(1, args.lumis + 1)
+        step = len(lumis) / args.files + 1
+        blocks.append([('{0}_{1}.root'.format(run, n), LumiArray((run, l) for l in lumis[i:i + step]))
+                       for n, i in enumerate(range(0, len(lumis), step))])
+
+    start = time.time()
+    reference = LumiList(filename=filename)
+    kept = 0
+    for files in blocks:
+        for fn, lumis in files:
+            kept += len([lumi for lumi in lumis if lumi in reference])
+    serial = time.time() - start
+
+    start = time.time()
+    engine = LumiMask(filename)
+    vectorized_kept = 0
+    for files in blocks:
+        res, masked = engine.apply(files)
+        vectorized_kept += sum(len(lumis) for _, lumis in res)
+    vectorized = time.time() - start
+
+    assert kept == vectorized_kept
+    print 'lumis {:9}, {:9} kept: LumiList {:8.3f}s, LumiMask {:8.3f}s'.format(
+        args.runs * args.lumis, kept, serial, vectorized)
+finally:
+    os.unlink(filename)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import argparse
+import random
+import time
+
+from lobster.core.unit import plan_merges
+
+parser = argparse.ArgumentParser(
+    description='compare merge planning algorithms for task outputs')
+parser.add_argument('--tasks', type=int, nargs='+', default=[1000, 5000, 20000],
+                    help='number of task outputs to merge')
+parser.add_argument('--merge-size', type=float, default=3.5,
+                    help='merge size in GB')
+parser.add_argument('--output-size', type=float, default=200,
+                    help='median task output size in MB')
+parser.add_argument('--skip-old', action='store_true',
+                    help='do not time the previous algorithm')
+args = parser.parse_args()
+
+
+def plan_merges_old(tasks, maxsize):
+    """The planner previously used by `UnitStore.pop_unmerged_tasks`.
+    """
+    class Merge(object):
+
+        def __init__(self, task, units, size, maxsize):
+            self.tasks = [task]
+            self.units = units
+            self.size = size
+            self.maxsize = maxsize
+
+        def __cmp__(self, other):
+            return cmp(self.size, other.size)
+
+        def add(self, task, units, size):
+            if self.size + size > self.maxsize:
+                return False
+            self.size += size
+            self.units += units
+            self.tasks.append(task)
+            return True
+
+    rows = sorted(tasks, key=lambda t: t[2], reverse=True)
+    if len(rows) < 2 or rows[-2][2] + rows[-1][2] > maxsize:
+        return []
+    minsize = rows[-1][2]
+
+    candidates = []
+    for task, units, size in rows:
+        for merge in reversed(sorted(candidates)):
+            if merge.add(task, units, size):
+                break
+        else:
+            if size + minsize <= maxsize:
+                candidates.append(Merge(task, units, size, maxsize))
+
+    return [(m.tasks, m.units, m.size) for m in reversed(sorted(candidates))]
+
+
+def quality(merges, maxsize):
+    merges = [m for m in merges if len(m[0]) > 1]
+    tasks = sum(len(m[0]) for m in merges)
+    fill = sum(m[2] for m in merges) / float(maxsize * max(len(merges), 1))
+    return len(merges), tasks, fill
+
+
+maxsize = int(args.merge_size * 1024 ** 3)
+for n in args.tasks:
+    tasks = [(i, 1, int(random.lognormvariate(0, .5) * args.output_size * 1024 ** 2)) for i in range(n)]
+
+    planners = [('best-fit decreasing', plan_merges)]
+    if not args.skip_old:
+        planners.append(('previous', plan_merges_old))
+
+    for name, planner in planners:
+        start = time.time()
+        merges = planner(tasks, maxsize)
+        runtime = time.time() - start
+
+        count, merged, fill = quality(merges, maxsize)
+        print '{:7} tasks, {:20}: {:6} merges of {:7} tasks, fill ratio {:6.4f}, {:9.3f}s'.format(
+            n, name, count, merged, fill, runtime)
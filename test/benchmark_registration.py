@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from lobster import se
+from lobster.core.config import Config, AdvancedOptions
+from lobster.core.dataset import DatasetInfo, LumiRange
+from lobster.core.unit import UnitStore
+from lobster.core.workflow import Workflow
+
+parser = argparse.ArgumentParser(
+    description='time the registration of a dataset and report the peak memory used')
+parser.add_argument('--files', type=int, default=10000,
+                    help='number of files in the dataset')
+parser.add_argument('--lumis', type=int, default=100,
+                    help='luminosity sections per file')
+parser.add_argument('--arguments', type=int, default=3,
+                    help='number of unique arguments of the workflow')
+parser.add_argument('--chunk-size', type=int, default=100000,
+                    help='units to insert into the database at once')
+parser.add_argument('--production', action='store_true',
+                    help='describe the luminosity sections of each file as a range instead of a list')
+args = parser.parse_args()
+
+os.environ.setdefault('LOCALRT', '')
+
+info = DatasetInfo()
+info.tasksize = 25
+info.path = ''
+for f in range(args.files):
+    fileinfo = info.files['/benchmark/{0}.root'.format(f)]
+    if args.production:
+        fileinfo.lumis = LumiRange(f, 1, args.lumis)
+    else:
+        fileinfo.lumis = [(f, l) for l in range(1, args.lumis + 1)]
+    fileinfo.events = args.lumis * 100
+info.total_units = args.files * args.lumis
+info.unmasked_units = info.total_units
+info.total_events = info.total_units * 100
+
+workflow = Workflow('benchmark', None, command='foo', unique_arguments=[str(n) for n in range(args.arguments)])
+
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+workdir = tempfile.mkdtemp()
+try:
+    store = UnitStore(
+        Config(
+            label='benchmark',
+            workdir=workdir,
+            storage=se.StorageConfiguration(output=['file://' + workdir]),
+            workflows=[],
+            advanced=AdvancedOptions(proxy=False, dashboard=False, osg_version="3.3",
+                                     registration_chunk_size=args.chunk_size)
+        )
+    )
+
+    start = time.time()
+    store.register_dataset(workflow, info)
+    registration = time.time() - start
+
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print 'units {:10} chunk size {:8}: registration {:8.3f}s, peak memory {:8.1f} MB (dataset {:8.1f} MB)'.format(
+        info.total_units * args.arguments, args.chunk_size, registration, after / 1024., before / 1024.)
+finally:
+    shutil.rmtree(workdir)
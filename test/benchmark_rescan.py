@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from lobster import fs, se, util
+from lobster.core.config import Config, AdvancedOptions
+from lobster.core.dataset import Dataset
+from lobster.core.unit import UnitStore
+from lobster.core.workflow import Workflow
+
+parser = argparse.ArgumentParser(
+    description='time the rescan of a watched directory for new files')
+parser.add_argument('--files', type=int, default=100000,
+                    help='number of files in the directory')
+parser.add_argument('--new', type=int, default=100,
+                    help='number of files added before the rescan')
+args = parser.parse_args()
+
+os.environ.setdefault('LOCALRT', '')
+
+workdir = tempfile.mkdtemp()
+try:
+    datadir = os.path.join(workdir, 'data')
+    os.makedirs(datadir)
+    for n in range(args.files):
+        open(os.path.join(datadir, '{0}.root'.format(n)), 'w').close()
+
+    with util.PartiallyMutable.unlock():
+        storage = se.StorageConfiguration(output=['file://' + workdir], input=['file://' + workdir])
+        storage.activate()
+        store = UnitStore(
+            Config(
+                label='benchmark',
+                workdir=workdir,
+                storage=storage,
+                workflows=[],
+                advanced=AdvancedOptions(proxy=False, dashboard=False, osg_version="3.3")
+            )
+        )
+
+        dataset = Dataset(files='data', watch=True)
+        with fs.alternative():
+            wflow = Workflow('benchmark', dataset, command='foo')
+            store.register_dataset(wflow, dataset.get_info())
+
+        for n in range(args.files, args.files + args.new):
+            open(os.path.join(datadir, '{0}.root'.format(n)), 'w').close()
+
+        start = time.time()
+        with fs.alternative():
+            info = dataset.get_info()
+        scan = time.time() - start
+
+        start = time.time()
+        new = store.register_new_files(wflow, info)
+        register = time.time() - start
+
+    print 'files {:7}, {:5} new: scan {:8.3f}s, register_new_files {:8.3f}s'.format(args.files, new, scan, register)
+finally:
+    shutil.rmtree(workdir)
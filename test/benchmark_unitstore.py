@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from lobster import se
+from lobster.core.config import Config, AdvancedOptions
+from lobster.core.dataset import DatasetInfo
+from lobster.core.task import TaskHandler
+from lobster.core.unit import TaskUpdate, UnitStore
+from lobster.core.workflow import Workflow
+
+parser = argparse.ArgumentParser(
+    description='time task creation and updates of the unit store for workflows of different sizes')
+parser.add_argument('--files', type=int, nargs='+', default=[100, 1000, 10000],
+                    help='number of files in the workflows to time')
+parser.add_argument('--lumis', type=int, default=10,
+                    help='luminosity sections per file')
+parser.add_argument('--tasksize', type=int, default=25,
+                    help='luminosity sections per task')
+parser.add_argument('--tasks', type=int, default=50,
+                    help='tasks to create per call')
+parser.add_argument('--failures', type=float, default=0.05,
+                    help='fraction of tasks to fail and return to the queue')
+args = parser.parse_args()
+
+os.environ.setdefault('LOCALRT', '')
+
+
+def create_store(workdir):
+    return UnitStore(
+        Config(
+            label='benchmark',
+            workdir=workdir,
+            storage=se.StorageConfiguration(output=['file://' + workdir]),
+            workflows=[],
+            advanced=AdvancedOptions(proxy=False, dashboard=False, osg_version="3.3")
+        )
+    )
+
+
+def create_dataset(files, lumis, tasksize):
+    info = DatasetInfo()
+    info.tasksize = tasksize
+    info.path = ''
+
+    for f in range(files):
+        fileinfo = info.files['/benchmark/{0}.root'.format(f)]
+        fileinfo.lumis = [(1, f * lumis + l) for l in range(lumis)]
+        fileinfo.events = lumis * 100
+
+    info.total_units = files * lumis
+    info.unmasked_units = info.total_units
+    info.total_events = info.total_units * 100
+
+    return Workflow('benchmark', None, command='foo'), info
+
+
+for files in args.files:
+    workdir = tempfile.mkdtemp()
+    try:
+        store = create_store(workdir)
+
+        start = time.time()
+        store.register_dataset(*create_dataset(files, args.lumis, args.tasksize))
+        registration = time.time() - start
+
+        timings = dict((k, 0.) for k in ('pop', 'update', 'missing', 'finished'))
+        calls = 0
+        tasks = 0
+        while True:
+            start = time.time()
+            new = store.pop_units('benchmark', args.tasks)
+            timings['pop'] += time.time() - start
+
+            if len(new) == 0:
+                break
+
+            calls += 1
+            tasks += len(new)
+
+            updates = []
+            failed = []
+            input_files = set()
+            for (id, label, task_files, units, arg, _) in new:
+                if random.random() < args.failures:
+                    failed.append(id)
+                    continue
+                task_update = TaskUpdate(host='hostname', id=id, submissions=1)
+                handler = TaskHandler(id, label, task_files, units, None, True)
+                filenames = dict(task_files)
+                files_info = dict((fn, (100, [])) for fn in filenames.values())
+                for (_, fid, run, lumi) in units:
+                    files_info[filenames[fid]][1].append((run, lumi))
+                file_update, unit_update = handler.get_unit_info(False, task_update, files_info, [], 100)
+                updates.append((task_update, file_update, unit_update))
+                input_files.update(filenames.keys())
+
+            start = time.time()
+            store.update_units({('benchmark', 'units'): updates})
+            timings['update'] += time.time() - start
+
+            if len(failed) > 0:
+                start = time.time()
+                store.update_missing(failed)
+                timings['missing'] += time.time() - start
+
+            start = time.time()
+            list(store.finished_files({'benchmark': input_files}))
+            timings['finished'] += time.time() - start
+
+        print ('files {:7} units {:9}: registration {:8.3f}s, {:6} tasks in {:5} calls: '
+               'pop_units {:8.3f}s, update_units {:8.3f}s, update_missing {:8.3f}s, finished_files {:8.3f}s').format(
+            files, files * args.lumis, registration, tasks, calls,
+            timings['pop'], timings['update'], timings['missing'], timings['finished'])
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from lobster import se
+from lobster.core.config import Config, AdvancedOptions
+from lobster.core.dataset import DatasetInfo
+from lobster.core.unit import UnitStore
+from lobster.core.workflow import Workflow
+
+parser = argparse.ArgumentParser(
+    description='time operations of the unit store spanning many workflows')
+parser.add_argument('--workflows', type=int, nargs='+', default=[10, 100, 500],
+                    help='number of workflows to time')
+parser.add_argument('--files', type=int, default=20,
+                    help='number of files per workflow')
+parser.add_argument('--lumis', type=int, default=10,
+                    help='luminosity sections per file')
+parser.add_argument('--repeat', type=int, default=5,
+                    help='how often to repeat each operation')
+args = parser.parse_args()
+
+os.environ.setdefault('LOCALRT', '')
+
+
+def create_dataset(label, files, lumis):
+    info = DatasetInfo()
+    info.tasksize = lumis
+    info.path = ''
+
+    for f in range(files):
+        fileinfo = info.files['/{0}/{1}.root'.format(label, f)]
+        fileinfo.lumis = [(1, f * lumis + l) for l in range(lumis)]
+        fileinfo.events = lumis * 100
+
+    info.total_units = files * lumis
+    info.unmasked_units = info.total_units
+    info.total_events = info.total_units * 100
+
+    return Workflow(label, None, command='foo'), info
+
+
+for workflows in args.workflows:
+    workdir = tempfile.mkdtemp()
+    try:
+        store = UnitStore(
+            Config(
+                label='benchmark',
+                workdir=workdir,
+                storage=se.StorageConfiguration(output=['file://' + workdir]),
+                workflows=[],
+                advanced=AdvancedOptions(proxy=False, dashboard=False, osg_version="3.3")
+            )
+        )
+
+        for n in range(workflows):
+            label = 'benchmark_{0}'.format(n)
+            store.register_dataset(*create_dataset(label, args.files, args.lumis))
+            store.pop_units(label, args.files / 2)
+
+        timings = []
+        for method in (store.reset_units, store.check_workflow_stats):
+            start = time.time()
+            for _ in range(args.repeat):
+                method()
+            timings.append((time.time() - start) / args.repeat)
+
+        print 'workflows {:5} units {:9}: reset_units {:8.3f}s, check_workflow_stats {:8.3f}s'.format(
+            workflows, workflows * args.files * args.lumis, *timings)
+    finally:
+        shutil.rmtree(workdir)
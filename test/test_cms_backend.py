@@ -1,14 +1,20 @@
 # vim: foldmethod=marker
 import os
 import shutil
+import sqlite3
 import tempfile
+import time
 
-from lobster import cmssw, se
+from nose.tools import assert_raises
+
+from lobster import cmssw, se, util
 from lobster.cmssw.dataset import DatasetInfo
+from lobster.core.dataset import LumiRange
 from lobster.core.task import TaskHandler
-from lobster.core.unit import TaskUpdate, UnitStore
+from lobster.core.unit import TaskUpdate, UnitStore, plan_merges
 from lobster.core.config import Config, AdvancedOptions
-from lobster.core.workflow import Workflow
+from lobster.core.create import Algo
+from lobster.core.workflow import Category, Workflow
 
 
 class DummyInterface(object):
@@ -30,7 +36,10 @@ class TestSQLBackend(object):
 
     def setup(self):
         with self.interface.db as db:
-            db.execute("delete from workflows")
+            for table in ('workflows', 'files', 'units', 'available'):
+                db.execute("delete from {0}".format(table))
+            # number files and units of each test from one
+            db.execute("delete from sqlite_sequence where name in ('files', 'units')")
 
     @classmethod
     def setup_class(cls):
@@ -177,7 +186,8 @@ class TestSQLBackend(object):
         assert ew in (0, None)
 
         (jr, jd) = self.interface.db.execute(
-            "select units_running, units_done from files_test_obtain where filename='/test/0.root'").fetchone()
+            """select units_running, units_done from files
+            where workflow=(select id from workflows where label='test_obtain') and filename='/test/0.root'""").fetchone()
 
         assert jr == 3
         assert jd == 0
@@ -216,7 +226,7 @@ class TestSQLBackend(object):
             100
         )
 
-        self.interface.update_units({(label, "units_" + label): [(task_update, file_update, unit_update)]})
+        self.interface.update_units({(label, "units"): [(task_update, file_update, unit_update)]})
 
         (jr, jd, er, ew) = self.interface.db.execute("""
             select
@@ -233,14 +243,16 @@ class TestSQLBackend(object):
         assert ew == 100
 
         (id, jr, jd, er) = self.interface.db.execute(
-            "select id, units_running, units_done, events_read from files_test_good where filename='/test/0.root'").fetchone()
+            """select id, units_running, units_done, events_read from files
+            where workflow=(select id from workflows where label='test_good') and filename='/test/0.root'""").fetchone()
 
         assert jr == 0
         assert jd == 3
         assert er == 300
 
         (id, jr, jd, er) = self.interface.db.execute(
-            "select id, units_running, units_done, events_read from files_test_good where filename='/test/1.root'").fetchone()
+            """select id, units_running, units_done, events_read from files
+            where workflow=(select id from workflows where label='test_good') and filename='/test/1.root'""").fetchone()
 
         assert jr == 0
         assert jd == 3
@@ -268,7 +280,7 @@ class TestSQLBackend(object):
             100
         )
 
-        self.interface.update_units({(label, "units_" + label): [(task_update, file_update, unit_update)]})
+        self.interface.update_units({(label, "units"): [(task_update, file_update, unit_update)]})
 
         (jr, jd, er, ew) = self.interface.db.execute("""
             select
@@ -284,7 +296,8 @@ class TestSQLBackend(object):
         assert ew == 100
 
         (id, jr, jd, er) = self.interface.db.execute(
-            "select id, units_running, units_done, events_read from files_test_good_split where filename='/test/0.root'").fetchone()
+            """select id, units_running, units_done, events_read from files
+            where workflow=(select id from workflows where label='test_good_split') and filename='/test/0.root'""").fetchone()
 
         assert jr == 0
         assert jd == 3
@@ -312,7 +325,7 @@ class TestSQLBackend(object):
         )
 
         self.interface.update_units(
-            {(label, "units_" + label): [(task_update, file_update, unit_update)]})
+            {(label, "units"): [(task_update, file_update, unit_update)]})
 
         (jr, jd, er, ew) = self.interface.db.execute("""
             select
@@ -329,7 +342,8 @@ class TestSQLBackend(object):
         assert ew in (0, None)
 
         (id, jr, jd, er) = self.interface.db.execute(
-            "select id, units_running, units_done, events_read from files_test_bad where filename='/test/0.root'").fetchone()
+            """select id, units_running, units_done, events_read from files
+            where workflow=(select id from workflows where label='test_bad') and filename='/test/0.root'""").fetchone()
 
         assert jr == 0
         assert jd == 0
@@ -362,7 +376,7 @@ class TestSQLBackend(object):
         )
 
         self.interface.update_units(
-            {(label, "units_" + label): [(task_update, file_update, unit_update)]})
+            {(label, "units"): [(task_update, file_update, unit_update)]})
 
         (jr, jd, er, ew) = self.interface.db.execute("""
             select
@@ -379,7 +393,8 @@ class TestSQLBackend(object):
         assert ew in (0, None)
 
         (id, jr, jd, er) = self.interface.db.execute(
-            "select id, units_running, units_done, events_read from files_test_bad_again where filename='/test/0.root'").fetchone()
+            """select id, units_running, units_done, events_read from files
+            where workflow=(select id from workflows where label='test_bad_again') and filename='/test/0.root'""").fetchone()
 
         assert jr == 0
         assert jd == 0
@@ -406,17 +421,19 @@ class TestSQLBackend(object):
         )
 
         self.interface.update_units(
-            {(label, "units_" + label): [(task_update, file_update, unit_update)]})
+            {(label, "units"): [(task_update, file_update, unit_update)]})
 
         skipped = list(
             self.interface.db.execute(
-                "select skipped from files_{0}".format(label)))
+                "select skipped from files where workflow=(select id from workflows where label=?)", (label,)))
 
         assert skipped == [(0,), (1,), (0,), (0,)]
 
         status = list(
             self.interface.db.execute(
-                "select status from units_{0} where file=2 group by status".format(label)))
+                """select status from units
+                where workflow=(select id from workflows where label=?) and file=2
+                group by status""", (label,)))
 
         assert status == [(3,)]
 
@@ -437,13 +454,15 @@ class TestSQLBackend(object):
         assert ew == 50
 
         (id, jr, jd) = self.interface.db.execute(
-            "select id, units_running, units_done from files_test_ugly where filename='/test/0.root'").fetchone()
+            """select id, units_running, units_done from files
+            where workflow=(select id from workflows where label='test_ugly') and filename='/test/0.root'""").fetchone()
 
         assert jr == 0
         assert jd == 2
 
         (id, jr, jd) = self.interface.db.execute(
-            "select id, units_running, units_done from files_test_ugly where filename='/test/1.root'").fetchone()
+            """select id, units_running, units_done from files
+            where workflow=(select id from workflows where label='test_ugly') and filename='/test/1.root'""").fetchone()
 
         assert jr == 0
         assert jd == 0
@@ -469,10 +488,11 @@ class TestSQLBackend(object):
             100
         )
 
-        self.interface.update_units({(label, "units_" + label): [(task_update, file_update, unit_update)]})
+        self.interface.update_units({(label, "units"): [(task_update, file_update, unit_update)]})
 
-        # grab another task
+        # grab another task, which takes units of the skipped file last
         (id, label, files, lumis, arg, _) = self.interface.pop_units('test_uglier', 1)[0]
+        assert [l for (_, _, _, l) in lumis] == [10, 11, 12, 13, 14, 15, 7, 8]
 
         task_update.id = id
         handler = TaskHandler(id, label, files, lumis, None, True)
@@ -488,7 +508,7 @@ class TestSQLBackend(object):
             100
         )
 
-        self.interface.update_units({(label, "units_" + label): [(task_update, file_update, unit_update)]})
+        self.interface.update_units({(label, "units"): [(task_update, file_update, unit_update)]})
 
         (jr, jd, jl, er, ew) = self.interface.db.execute("""
             select
@@ -501,8 +521,8 @@ class TestSQLBackend(object):
                                                          (label,)).fetchone()
 
         assert jr == 0
-        assert jd == 13
-        assert jl == 2
+        assert jd == 12
+        assert jl == 3
         assert er == 1300
         assert ew == 200
         # }}}
@@ -536,6 +556,55 @@ class TestSQLBackend(object):
         assert ew in (0, None)
         # }}}
 
+    def test_file_obtain_by_events(self):
+        # {{{
+        wflow, info = self.create_file_dataset('test_file_events', 8, 250)
+        for n, events in enumerate([100, 100, 100, 600, 50, 200, 10, 10]):
+            info.files['/test/{0}.root'.format(n)].events = events
+        info.split_by = 'events'
+        self.interface.register_dataset(wflow, info)
+
+        tasks = self.interface.pop_units('test_file_events', 3)
+        assert [[fn for (_, fn) in sorted(files)] for (_, _, files, _, _, _) in tasks] == [
+            ['/test/0.root', '/test/1.root'],
+            ['/test/2.root'],
+            ['/test/3.root']
+        ]
+
+        tasks = self.interface.pop_units('test_file_events', 3)
+        assert [[fn for (_, fn) in sorted(files)] for (_, _, files, _, _, _) in tasks] == [
+            ['/test/4.root', '/test/5.root'],
+            ['/test/6.root', '/test/7.root']
+        ]
+
+        (running,) = self.interface.db.execute(
+            "select units_running from workflows where label='test_file_events'").fetchone()
+        assert running == 8
+        # }}}
+
+    def test_file_obtain_by_events_algo(self):
+        # {{{
+        _, info = self.create_file_dataset('test_file_events_algo', 100, 1000)
+        for fn in info.files:
+            info.files[fn].events = 250
+        info.total_events = 100 * 250
+        info.split_by = 'events'
+        wflow = Workflow('test_file_events_algo', None, category=Category('events'), command='foo')
+        self.interface.register_dataset(wflow, info)
+
+        assert self.interface.work_left(wflow.label) == (1, 100, 25.)
+        assert self.interface.estimate_tasks_left() == 25
+
+        algo = Algo(self.interface.config)
+        data = algo.run(100, {'events': {'running': 0, 'queued': 0}}, {wflow: self.interface.work_left(wflow.label)})
+        assert len(data) == 1
+        label, ntasks, taper = data[0]
+        assert ntasks > 25 and taper < 1.
+
+        tasks = self.interface.pop_units(label, ntasks, taper)
+        assert [len(files) for (_, _, files, _, _, _) in tasks] == [4] * 25
+        # }}}
+
     def test_file_return_good(self):
         # {{{
         self.interface.register_dataset(
@@ -559,7 +628,7 @@ class TestSQLBackend(object):
         )
 
         self.interface.update_units(
-            {(label, "units_" + label): [(task_update, file_update, unit_update)]})
+            {(label, "units"): [(task_update, file_update, unit_update)]})
 
         (jr, jd, er, ew) = self.interface.db.execute("""
             select
@@ -576,6 +645,216 @@ class TestSQLBackend(object):
         assert ew == 100
         # }}}
 
+    def test_runtime_model(self):
+        # {{{
+        wflow, info = self.create_file_dataset('test_runtime_model', 40, 2)
+        self.interface.register_dataset(wflow, info, 100)
+
+        # tasks of two files each take 40s with a cold, and 20s with a hot
+        # cache, i.e., 15s per file with an even mix
+        updates = []
+        for n, (id, label, files, lumis, arg, _) in enumerate(self.interface.pop_units('test_runtime_model', 12)):
+            task_update = TaskUpdate(host='hostname', id=id, cache=n % 2,
+                                     time_stage_in_end=0, time_epilogue_end=40 - 20 * (n % 2))
+            handler = TaskHandler(id, label, files, lumis, None, True)
+            file_update, unit_update = handler.get_unit_info(
+                False,
+                task_update,
+                dict((fn, (100, [])) for (_, fn) in files),
+                [],
+                100
+            )
+            updates.append((task_update, file_update, unit_update))
+
+        self.interface.update_units({(label, "units"): updates})
+
+        (size,) = self.interface.db.execute(
+            "select tasksize from workflows where label='test_runtime_model'").fetchone()
+        assert size == 7
+
+        model = self.interface.config.advanced.runtime_model
+        assert abs(model.predict('test_runtime_model', 2, 0, 'hostname') - 40) < 1e-6
+        assert model.error(['test_runtime_model']) < 1e-6
+        # }}}
+
+    def test_runtime_model_retry(self):
+        # {{{
+        wflow, info = self.create_file_dataset('test_model_retry', 10, 2)
+        self.interface.register_dataset(wflow, info, 100)
+
+        updates = []
+        for (id, label, files, lumis, arg, _) in self.interface.pop_units('test_model_retry', 5):
+            task_update = TaskUpdate(host='hostname', id=id, time_stage_in_end=0, time_epilogue_end=40)
+            handler = TaskHandler(id, label, files, lumis, None, True)
+            file_update, unit_update = handler.get_unit_info(
+                False, task_update, dict((fn, (100, [])) for (_, fn) in files), [], 100)
+            updates.append((task_update, file_update, unit_update))
+
+        def fail(label):
+            raise sqlite3.OperationalError("database is locked")
+
+        # failed attempts to write the updates do not reach the model
+        model = self.interface.config.advanced.runtime_model
+        self.interface.update_workflow_stats = fail
+        try:
+            assert_raises(sqlite3.OperationalError, self.interface.update_units, {('test_model_retry', 'units'): updates})
+        finally:
+            del self.interface.update_workflow_stats
+        assert not model.known('test_model_retry')
+
+        self.interface.update_units({('test_model_retry', 'units'): updates})
+        assert model._workflows['test_model_retry']['count'] == 5
+        # }}}
+
+    def test_speculative(self):
+        # {{{
+        wflow, info = self.create_file_dataset('test_speculative', 4, 1)
+        self.interface.register_dataset(wflow, info, 100)
+
+        def release(task, failed=False):
+            (id, label, files, lumis, arg, _) = task
+            task_update = TaskUpdate(host='hostname', id=id)
+            handler = TaskHandler(id, label, files, lumis, None, True)
+            file_update, unit_update = handler.get_unit_info(
+                failed, task_update, dict((fn, (100, [])) for (_, fn) in files), [], 100)
+            return task_update, file_update, unit_update
+
+        def status(ids):
+            return [self.interface.db.execute("select status from tasks where id=?", (id,)).fetchone()[0]
+                    for id in ids]
+
+        tasks = self.interface.pop_units('test_speculative', 4)
+        self.interface.update_units({('test_speculative', 'units'): [release(t) for t in tasks[:2]]})
+        assert self.interface.pop_speculative('test_speculative', 0.5, 2.) == []
+
+        # a straggler and a task running just a bit longer than expected
+        for task, delay in ((tasks[3], 1000), (tasks[2], 150)):
+            self.interface.db.execute("update tasks set time_submit=? where id=?", (int(time.time()) - delay, task[0]))
+
+        # the straggler may have waited in the queue until recently
+        assert self.interface.pop_speculative('test_speculative', 0.5, 2., int(time.time()) - 100) == []
+
+        duplicates = self.interface.pop_speculative('test_speculative', 0.5, 2., int(time.time()) - 1000)
+        assert [original for original, _ in duplicates] == [tasks[3][0]]
+        duplicate = duplicates[0][1]
+        assert duplicate[1:] == tasks[3][1:]
+        assert self.interface.pop_speculative('test_speculative', 0.5, 2.) == []
+
+        # the failing duplicate leaves the units with the original task
+        self.interface.update_units({('test_speculative', 'units'): [(release(duplicate, True)[0], [], [])]})
+        (failed,) = self.interface.db.execute(
+            "select max(failed) from units where task=?", (tasks[3][0],)).fetchone()
+        assert failed == 0
+
+        # the successful duplicate takes over the units
+        duplicate = self.interface.pop_speculative('test_speculative', 0.5, 2.)[0][1]
+        self.interface.resolve_duplicates([(tasks[3][0], duplicate[0])], [tasks[3][0]])
+        self.interface.update_units({('test_speculative', 'units'): [release(duplicate)]})
+
+        assert status([tasks[3][0], duplicate[0]]) == [4, 2]
+        (running, done, left) = self.interface.db.execute(
+            "select units_running, units_done, units_left from workflows where label='test_speculative'").fetchone()
+        assert running == 1
+        assert done == 3
+        assert left == 0
+        # }}}
+
+    def test_isolation(self):
+        # {{{
+        with util.PartiallyMutable.unlock():
+            self.interface.config.advanced.unit_ranges = True
+            self.interface.config.advanced.threshold_for_failure = 0
+        try:
+            self.interface.register_dataset(
+                *self.create_dbs_dataset('test_isolation', lumis=8, filesize=10, tasksize=8))
+
+            # only the sixth luminosity section makes tasks fail
+            sizes = []
+            while True:
+                tasks = self.interface.pop_units('test_isolation', 10)
+                if len(tasks) == 0:
+                    break
+                updates = []
+                for (id, label, files, lumis, arg, _) in tasks:
+                    failed = 6 in [lumi for (_, _, _, lumi) in lumis]
+                    task_update = TaskUpdate(host='hostname', id=id)
+                    handler = TaskHandler(id, label, files, lumis, None, True)
+                    file_update, unit_update = handler.get_unit_info(
+                        failed,
+                        task_update,
+                        {} if failed else {'/test/0.root': (100, [(r, l) for (_, _, r, l) in lumis])},
+                        [],
+                        100
+                    )
+                    updates.append((task_update, file_update, unit_update))
+                    sizes.append(len(lumis))
+                self.interface.update_units({('test_isolation', 'units'): updates})
+        finally:
+            with util.PartiallyMutable.unlock():
+                self.interface.config.advanced.unit_ranges = False
+                self.interface.config.advanced.threshold_for_failure = 30
+
+        assert sizes == [8, 4, 4, 2, 2, 1, 1]
+
+        (done, failed) = self.interface.db.execute(
+            "select units_done, units_failed from workflows where label='test_isolation'").fetchone()
+        assert done == 7
+        assert failed == 1
+
+        groups = self.interface.db.execute("""
+            select units, parent is null from isolations
+            where workflow=(select id from workflows where label='test_isolation')
+            order by id""").fetchall()
+        assert groups == [(4, 1), (4, 1), (2, 0), (2, 0), (1, 0), (1, 0)]
+        # }}}
+
+    def test_skipped_last(self):
+        # {{{
+        self.interface.register_dataset(
+            *self.create_dbs_dataset('test_skipped_last', lumis=20, filesize=3.0, tasksize=3))
+        with self.interface.db as db:
+            db.execute("""
+                update files set skipped=1
+                where workflow=(select id from workflows where label='test_skipped_last') and filename='/test/0.root'""")
+            db.execute("""
+                update available set skipped=1
+                where file=(select id from files where filename='/test/0.root' and
+                    workflow=(select id from workflows where label='test_skipped_last'))""")
+
+        # units of files that were skipped come last
+        tasks = self.interface.pop_units('test_skipped_last', 10)
+        filenames = [[fn for (_, fn) in files] for (_, _, files, _, _, _) in tasks]
+        assert filenames[0] == ['/test/1.root']
+        assert filenames[-1] == ['/test/0.root']
+        # }}}
+
+    def test_rollback(self):
+        # {{{
+        self.interface.register_dataset(
+            *self.create_dbs_dataset('test_rollback', lumis=20, filesize=3.0, tasksize=6))
+
+        def counts():
+            return self.interface.db.execute("""
+                select units_running, units_left, (select count(*) from available where workflow=workflows.id)
+                from workflows where label='test_rollback'""").fetchone()
+
+        before = counts()
+        tasks = self.interface.pop_units('test_rollback', 2)
+        assert counts() == (12, 8, 8)
+
+        self.interface.rollback_tasks([id for (id, _, _, _, _, _) in tasks])
+        assert counts() == before
+        (running,) = self.interface.db.execute("""
+            select sum(units_running) from files
+            where workflow=(select id from workflows where label='test_rollback')""").fetchone()
+        assert running == 0
+        assert [self.interface.db.execute("select status from tasks where id=?", (id,)).fetchone()[0]
+                for (id, _, _, _, _, _) in tasks] == [4, 4]
+
+        (_, _, _, lumis, _, _) = self.interface.pop_units('test_rollback', 1)[0]
+        assert lumis == tasks[0][3]
+        # }}}
+
     def test_file_return_bad(self):
         # {{{
         self.interface.register_dataset(
@@ -595,7 +874,7 @@ class TestSQLBackend(object):
         )
 
         self.interface.update_units(
-            {(label, "units_" + label): [(task_update, file_update, unit_update)]})
+            {(label, "units"): [(task_update, file_update, unit_update)]})
 
         (jr, jd, er, ew) = self.interface.db.execute("""
             select
@@ -634,7 +913,7 @@ class TestSQLBackend(object):
         )
 
         self.interface.update_units(
-            {(label, "units_" + label): [(task_update, file_update, unit_update)]})
+            {(label, "units"): [(task_update, file_update, unit_update)]})
 
         (jr, jd, jl, er, ew) = self.interface.db.execute("""
             select
@@ -653,6 +932,338 @@ class TestSQLBackend(object):
         assert ew == 100
         # }}}
 
+    def test_incremental_counters(self):
+        # {{{
+        self.interface.register_dataset(
+            *self.create_dbs_dataset(
+                'test_counters', lumis=15, filesize=3, tasksize=4))
+
+        def counters():
+            return self.interface.db.execute("""
+                select units_registered, units_running, units_done, units_stuck, units_available, units_left
+                from workflows where label=?""", ('test_counters',)).fetchone()
+
+        (id, label, files, lumis, arg, _) = self.interface.pop_units('test_counters', 1)[0]
+        task_update = TaskUpdate(host='hostname', id=id)
+        handler = TaskHandler(id, label, files, lumis, None, True)
+        file_update, unit_update = handler.get_unit_info(
+            False, task_update, {'/test/0.root': (300, [(1, 1), (1, 2), (1, 3)])}, ['/test/1.root'], 100)
+        self.interface.update_units({(label, "units"): [(task_update, file_update, unit_update)]})
+
+        (id, label, files, lumis, arg, _) = self.interface.pop_units('test_counters', 1)[0]
+        task_update = TaskUpdate(exit_code=123, host='hostname', id=id)
+        handler = TaskHandler(id, label, files, lumis, None, True)
+        file_update, unit_update = handler.get_unit_info(True, task_update, {}, [], 0)
+        self.interface.update_units({(label, "units"): [(task_update, file_update, unit_update)]})
+
+        self.interface.pop_units('test_counters', 1)
+
+        incremental = counters()
+        assert incremental == (15, 4, 3, 0, 8, 8)
+
+        with self.interface.db:
+            self.interface.check_workflow_stats('test_counters')
+        assert counters() == incremental
+        # }}}
+
+    def test_readonly(self):
+        # {{{
+        self.interface.register_dataset(
+            *self.create_dbs_dataset(
+                'test_readonly', lumis=11, filesize=2.2, tasksize=3))
+
+        reader = UnitStore(self.interface.config, readonly=True)
+        reader.db.execute("pragma busy_timeout=0")
+
+        self.interface.pop_units('test_readonly', 1)
+
+        # readers are neither blocked by, nor see uncommitted writes
+        self.interface.db.execute("update workflows set units_running=0 where label='test_readonly'")
+        (running,) = reader.db.execute(
+            "select units_running from workflows where label='test_readonly'").fetchone()
+        self.interface.db.rollback()
+        assert running == 3
+
+        (units,) = self.interface.db.execute("select count(*) from units").fetchone()
+        for statement in ("update workflows set units_running=0",
+                          "delete from units",
+                          "insert into files(workflow, filename) values (1, 'foo')",
+                          "create table foo(bar int)",
+                          "drop table tasks"):
+            assert_raises(sqlite3.DatabaseError, reader.db.execute, statement)
+        assert self.interface.db.execute("select count(*) from units").fetchone() == (units,)
+
+        # temporary tables are private to the connection
+        reader.db.execute("create temp table foo(bar int)")
+        reader.db.execute("insert into foo values (1)")
+        reader.disconnect()
+        # }}}
+
+    def test_journal(self):
+        # {{{
+        self.interface.register_dataset(
+            *self.create_dbs_dataset(
+                'test_journal', lumis=6, filesize=3, tasksize=3))
+        (id, label, files, lumis, arg, _) = self.interface.pop_units('test_journal', 1)[0]
+
+        task_update = TaskUpdate(host='hostname', id=id, submissions=1)
+        handler = TaskHandler(id, label, files, lumis, None, True)
+        file_update, unit_update = handler.get_unit_info(
+            False,
+            task_update,
+            {'/test/0.root': (300, [(1, 1), (1, 2), (1, 3)])},
+            [],
+            100
+        )
+
+        def done():
+            return self.interface.db.execute(
+                "select units_done from workflows where label='test_journal'").fetchone()[0]
+
+        self.interface.defer([('update_units', ({(label, "units"): [(task_update, file_update, unit_update)]},))])
+        assert done() == 0
+
+        # updates survive the loss of the buffer
+        store = UnitStore(self.interface.config)
+        store.recover()
+        assert done() == 3
+
+        # and are not applied twice
+        self.interface.flush()
+        assert done() == 3
+        assert not os.path.exists(os.path.join(self.workdir, 'lobster.journal'))
+        # }}}
+
+    def test_plan_merges(self):
+        # {{{
+        tasks = [(1, 1, 60), (2, 1, 50), (3, 1, 40), (4, 1, 30), (5, 1, 20), (6, 1, 110)]
+        assert plan_merges(tasks, 100) == [([1, 3], 2, 100), ([2, 4, 5], 3, 100)]
+        assert plan_merges(tasks, 40) == []
+        assert plan_merges(tasks[:1], 100) == []
+        # }}}
+
+    def test_workflow_summary(self):
+        # {{{
+        self.interface.register_dataset(
+            *self.create_dbs_dataset(
+                'test_summary', lumis=15, filesize=3, tasksize=8))
+        (id, label, files, lumis, arg, _) = self.interface.pop_units('test_summary', 1)[0]
+
+        task_update = TaskUpdate(host='hostname', id=id, submissions=1)
+        handler = TaskHandler(id, label, files, lumis, None, True)
+        file_update, unit_update = handler.get_unit_info(
+            False,
+            task_update,
+            {
+                '/test/0.root': (300, [(1, 1), (1, 2), (1, 3)]),
+                '/test/1.root': (300, [(1, 4), (1, 5), (1, 6)]),
+            },
+            ['/test/2.root'],
+            100
+        )
+
+        with util.PartiallyMutable.unlock():
+            self.interface.config.advanced.threshold_for_skipping = 1
+        try:
+            self.interface.update_units({(label, "units"): [(task_update, file_update, unit_update)]})
+
+            def summary():
+                return self.interface.db.execute("""
+                    select events_read, events_written, units_processed, units_failed, units_skipped
+                    from workflows where label='test_summary'""").fetchone()
+
+            assert summary() == (600, 100, 6, 0, 3)
+
+            self.interface.check_workflow_stats('test_summary')
+            assert summary() == (600, 100, 6, 0, 3)
+        finally:
+            with util.PartiallyMutable.unlock():
+                self.interface.config.advanced.threshold_for_skipping = 30
+        # }}}
+
+    def test_unit_ranges(self):
+        # {{{
+        with util.PartiallyMutable.unlock():
+            self.interface.config.advanced.unit_ranges = True
+        try:
+            self.interface.register_dataset(
+                *self.create_dbs_dataset(
+                    'test_ranges', lumis=15, filesize=3, tasksize=4))
+        finally:
+            with util.PartiallyMutable.unlock():
+                self.interface.config.advanced.unit_ranges = False
+
+        (rows,) = self.interface.db.execute(
+            "select count(*) from units where workflow=(select id from workflows where label='test_ranges')").fetchone()
+        assert rows == 5
+
+        (id, label, files, lumis, arg, _) = self.interface.pop_units('test_ranges', 1)[0]
+        assert [(r, l) for (_, _, r, l) in lumis] == [(1, 1), (1, 2), (1, 3), (1, 4)]
+
+        (rows,) = self.interface.db.execute(
+            "select count(*) from units where workflow=(select id from workflows where label='test_ranges')").fetchone()
+        assert rows == 6
+
+        task_update = TaskUpdate(host='hostname', id=id)
+        handler = TaskHandler(id, label, files, lumis, None, True)
+        file_update, unit_update = handler.get_unit_info(
+            False,
+            task_update,
+            {
+                '/test/0.root': (200, [(1, 1), (1, 3)]),
+                '/test/1.root': (100, [(1, 4)])
+            },
+            [],
+            100
+        )
+        self.interface.update_units({(label, "units"): [(task_update, file_update, unit_update)]})
+
+        status = list(self.interface.db.execute("""
+            select lumi, lumi_last, status
+            from units
+            where workflow=(select id from workflows where label=?) and file=1
+            order by lumi""", (label,)))
+        assert status == [(1, 1, 2), (2, 2, 3), (3, 3, 2)]
+
+        (jr, jd, jl) = self.interface.db.execute(
+            "select units_running, units_done, units_left from workflows where label=?", (label,)).fetchone()
+        assert jr == 0
+        assert jd == 3
+        assert jl == 12
+
+        (id, label, files, lumis, arg, _) = self.interface.pop_units('test_ranges', 1)[0]
+        assert [(r, l) for (_, _, r, l) in lumis] == [(1, 2), (1, 5), (1, 6), (1, 7)]
+        # }}}
+
+    def test_register_new_files(self):
+        # {{{
+        wflow, info = self.create_dbs_dataset('test_new_files', lumis=10, filesize=3, tasksize=3)
+        self.interface.register_dataset(wflow, info)
+        self.interface.pop_units('test_new_files', 1)
+
+        (units, left, events) = self.interface.db.execute(
+            "select units, units_left, events from workflows where label='test_new_files'").fetchone()
+        assert (units, left, events) == (10, 7, 1000)
+
+        assert self.interface.register_new_files(wflow, info) == 0
+
+        info.files['/test/new.root'].lumis = [(2, 1), (2, 2)]
+        info.files['/test/new.root'].events = 200
+        info.masked_units = 1
+        assert self.interface.register_new_files(wflow, info) == 1
+
+        (files, registered) = self.interface.db.execute("""
+            select count(*), sum(units)
+            from files
+            where workflow=(select id from workflows where label='test_new_files')""").fetchone()
+        assert (files, registered) == (5, 12)
+
+        (units, masked, left, available, events) = self.interface.db.execute("""
+            select units, units_masked, units_left, units_available, events
+            from workflows
+            where label='test_new_files'""").fetchone()
+        assert (units, masked, left, available, events) == (13, 1, 9, 9, 1200)
+
+        lumis = sum([lumis for (_, _, _, lumis, _, _) in self.interface.pop_units('test_new_files', 5)], [])
+        assert sorted((r, l) for (_, _, r, l) in lumis)[-2:] == [(2, 1), (2, 2)]
+        # }}}
+
+    def test_register_new_files_merged(self):
+        # {{{
+        _, info = self.create_dbs_dataset('test_new_merged', lumis=10, filesize=3, tasksize=3)
+        wflow = Workflow('test_new_merged', None, command='foo', outputs=['out.root'])
+        child = Workflow('test_new_merged_child', None, command='foo', unique_arguments=['a', 'b'])
+        wflow.register(child)
+
+        self.interface.register_dataset(wflow, info)
+        self.interface.register_dataset(child, DatasetInfo())
+        self.interface.register_dependency(child.label, wflow.label, 10 * 2)
+        self.interface.db.execute("update workflows set merged=1")
+        assert self.interface.merged()
+
+        info.files['/test/new.root'].lumis = [(2, 1), (2, 2)]
+        assert self.interface.register_new_files(wflow, info) == 1
+        assert not self.interface.merged()
+
+        totals = list(self.interface.db.execute("""
+            select label, units, units_left, merged
+            from workflows
+            where label like 'test_new_merged%'
+            order by label"""))
+        assert totals == [('test_new_merged', 12, 12, 0), ('test_new_merged_child', 24, 24, 0)]
+        # }}}
+
+    def test_register_changed_files(self):
+        # {{{
+        wflow, info = self.create_file_dataset('test_changed_files', 4, 2)
+        for fn in info.files:
+            info.files[fn].events = 100
+            info.files[fn].size = 1000
+        info.total_events = 400
+        self.interface.register_dataset(wflow, info)
+
+        def release(task):
+            (id, label, files, lumis, arg, _) = task
+            task_update = TaskUpdate(host='hostname', id=id)
+            handler = TaskHandler(id, label, files, lumis, None, True)
+            file_update, unit_update = handler.get_unit_info(
+                False, task_update, dict((fn, (100, [])) for (_, fn) in files), [], 100)
+            return task_update, file_update, unit_update
+
+        tasks = self.interface.pop_units('test_changed_files', 1)
+        self.interface.update_units({('test_changed_files', 'units'): [release(t) for t in tasks]})
+
+        def stats():
+            return self.interface.db.execute("""
+                select units_done, units_left, units_available, events
+                from workflows
+                where label='test_changed_files'""").fetchone()
+
+        assert stats() == (2, 2, 2, 400)
+        assert self.interface.register_new_files(wflow, info) == 0
+
+        # a processed and an unprocessed file change
+        info.files['/test/0.root'].events = 150
+        info.files['/test/3.root'].size = 2000
+        assert self.interface.register_new_files(wflow, info) == 2
+        assert self.interface.register_new_files(wflow, info) == 0
+
+        assert stats() == (1, 3, 3, 450)
+        files = [fn for task in self.interface.pop_units('test_changed_files', 2) for (_, fn) in task[2]]
+        assert sorted(files) == ['/test/0.root', '/test/2.root', '/test/3.root']
+        # }}}
+
+    def test_chunked_registration(self):
+        # {{{
+        _, info = self.create_dbs_dataset('test_chunked', lumis=11, filesize=3)
+        info.files['/test/range.root'].lumis = LumiRange(2, 5, 9)
+        info.total_units += 5
+        wflow = Workflow('test_chunked', None, command='foo', unique_arguments=['a', 'b'])
+
+        with util.PartiallyMutable.unlock():
+            self.interface.config.advanced.registration_chunk_size = 4
+        try:
+            self.interface.register_dataset(wflow, info)
+        finally:
+            with util.PartiallyMutable.unlock():
+                self.interface.config.advanced.registration_chunk_size = 100000
+
+        units = list(self.interface.db.execute("""
+            select files.filename, run, lumi, arg
+            from units join files on files.id=units.file
+            where units.workflow=(select id from workflows where label='test_chunked')"""))
+        expected = [(fn, run, lumi, arg) for fn, finfo in info.files.items() for arg in ('a', 'b') for (run, lumi) in finfo.lumis]
+        assert sorted(units) == sorted(expected)
+
+        (available,) = self.interface.db.execute(
+            "select count(*) from available where workflow=(select id from workflows where label='test_chunked')").fetchone()
+        assert available == 32
+
+        (units, left) = self.interface.db.execute(
+            "select units, units_left from workflows where label='test_chunked'").fetchone()
+        assert units == left == 32
+        # }}}
+
 
 class TestCMSSWProvider(object):
 
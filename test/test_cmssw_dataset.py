@@ -0,0 +1,174 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from lobster.cmssw.dataset import BlockQuery, Cache, LumiMask
+from lobster.core.dataset import LumiArray
+
+from WMCore.DataStructs.LumiList import LumiList
+
+
+class FakeDbs(object):
+
+    """Stand-in for `DbsApi`, returning one file per block.
+
+    Parameters
+    ----------
+        delay : float
+            Maximum random delay of each call.
+        failures : int
+            How many calls to fail for each block.
+        hang : float
+            How long the first call for each block takes.
+    """
+
+    lock = threading.Lock()
+
+    def __init__(self, calls, delay=0, failures=0, hang=0):
+        self.calls = calls
+        self.delay = delay
+        self.failures = failures
+        self.hang = hang
+
+    def listFileLumis(self, block_name):
+        with self.lock:
+            self.calls[block_name] = self.calls.get(block_name, 0) + 1
+            count = self.calls[block_name]
+        if self.hang and count == 1:
+            time.sleep(self.hang)
+        if count <= self.failures:
+            raise IOError('server error')
+        time.sleep(random.random() * self.delay)
+        return [{'logical_file_name': block_name + '.root', 'run_num': 1, 'lumi_section_num': [count]}]
+
+
+class TestBlockQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.blocks = ['/block#{0}'.format(i) for i in range(50)]
+        self.calls = {}
+        self.clients = []
+
+    def factory(self, **kwargs):
+        def create():
+            self.clients.append(FakeDbs(self.calls, **kwargs))
+            return self.clients[-1]
+        return create
+
+    def test_order(self):
+        query = BlockQuery(self.factory(delay=0.01), threads=8)
+        res = [runs[0]['logical_file_name'] for runs in query(self.blocks)]
+        assert res == [b + '.root' for b in self.blocks]
+        assert len(self.clients) <= 8
+
+    def test_retry(self):
+        query = BlockQuery(self.factory(failures=2), threads=4, backoff=0.001)
+        res = [runs[0]['lumi_section_num'] for runs in query(self.blocks)]
+        assert res == [[3]] * len(self.blocks)
+
+    def test_give_up(self):
+        query = BlockQuery(self.factory(failures=5), threads=4, attempts=3, backoff=0.001)
+        with self.assertRaises(IOError):
+            list(query(self.blocks))
+
+    def test_timeout(self):
+        query = BlockQuery(self.factory(hang=0.5), threads=8, timeout=0.05, backoff=0.001)
+        start = time.time()
+        res = [runs[0]['lumi_section_num'] for runs in query(self.blocks[:8])]
+        assert res == [[2]] * 8
+        assert time.time() - start < 0.5
+
+    def test_timeout_threads(self):
+        threads = threading.active_count()
+        query = BlockQuery(self.factory(hang=0.2), threads=2, timeout=0.01, attempts=10, backoff=0.01)
+        res = [runs[0]['logical_file_name'] for runs in query(self.blocks[:16])]
+        assert res == [b + '.root' for b in self.blocks[:16]]
+        # hanging calls occupy the workers of the call pool, but do not
+        # spawn new threads
+        assert threading.active_count() - threads <= 2 * 2 + 3
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.cache = Cache(self.cachedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def files(self, block, n=3):
+        return [('{0}_{1}.root'.format(block, i), LumiArray([(1, i * 10 + l) for l in range(10)])) for i in range(n)]
+
+    def test_validation(self):
+        legacy = os.path.join(self.cachedir, 'foo-{0}.pkl'.format('0123abcd' * 8))
+        other = os.path.join(self.cachedir, 'other.pkl')
+        for fn in (legacy, other):
+            with open(fn, 'w') as f:
+                f.write('stale')
+        for block in ('a', 'b', 'c'):
+            self.cache.cache('/foo', block, block + '1', self.files(block))
+        self.cache.cache('/bar', 'd', 'd1', self.files('d'))
+        assert not os.path.exists(legacy)
+        assert os.path.exists(other)
+
+        cached = self.cache.cached('/foo', {'a': 'a1', 'b': 'b2', 'd': 'd1'})
+        assert cached.keys() == ['a']
+        assert sorted(cached['a']) == sorted(self.files('a'))
+
+        self.cache.cache('/foo', 'b', 'b2', self.files('b', 2))
+        cached = self.cache.cached('/foo', {'a': 'a1', 'b': 'b2'})
+        assert sorted(cached.keys()) == ['a', 'b']
+        assert len(cached['b']) == 2
+
+    def test_eviction(self):
+        for block in ('a', 'b', 'c', 'd'):
+            self.cache.cache('/foo', block, block, self.files(block))
+            time.sleep(0.01)
+        self.cache.cached('/foo', {'a': 'a'})
+
+        (size,) = self.cache.db.execute("select size from blocks where name='a'").fetchone()
+        self.cache.evict(2 * size)
+
+        cached = self.cache.cached('/foo', dict((b, b) for b in 'abcd'))
+        assert sorted(cached.keys()) == ['a', 'd']
+        (files,) = self.cache.db.execute("select count(*) from files").fetchone()
+        assert files == 6
+
+
+class TestLumiMask(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'1': [[1, 10], [20, 30]], '3': [[5, 5]], '4': [[1, 100]]}, f)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_apply(self):
+        files = [
+            ('a', LumiArray([(1, l) for l in range(0, 40)])),
+            ('b', LumiArray()),
+            ('c', LumiArray([(2, 3), (3, 4), (3, 5), (3, 6), (4, 1), (4, 100), (4, 101), (5, 1)]))
+        ]
+        res, masked = LumiMask(self.filename).apply(files)
+
+        assert res == [
+            ('a', [(1, l) for l in range(1, 11) + range(20, 31)]),
+            ('c', [(3, 5), (4, 1), (4, 100)])
+        ]
+        assert masked == 19 + 5
+
+    def test_compatible(self):
+        lumis = LumiArray((random.randint(0, 5), random.randint(0, 120)) for _ in range(1000))
+        reference = LumiList(filename=self.filename)
+
+        res, masked = LumiMask(self.filename).apply([('a', lumis)])
+        assert res[0][1] == [lumi for lumi in lumis if lumi in reference]
+        assert masked == len([lumi for lumi in lumis if lumi not in reference])
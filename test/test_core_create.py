@@ -0,0 +1,46 @@
+import os
+import unittest
+
+from lobster import se
+from lobster.core.config import AdvancedOptions, Config
+from lobster.core.create import Algo
+from lobster.core.workflow import Category, Workflow
+
+
+class TestAlgo(unittest.TestCase):
+
+    def setUp(self):
+        os.environ['LOCALRT'] = ''
+        self.algo = Algo(
+            Config(
+                label='test',
+                workdir='/tmp/lobster_test_algo',
+                storage=se.StorageConfiguration(output=['file:///tmp/lobster_test_algo']),
+                workflows=[],
+                advanced=AdvancedOptions(proxy=False, dashboard=False, osg_version="3.3", payload=10)
+            )
+        )
+        self.large = Category('large', cores=1, memory=4000)
+
+    def queued(self):
+        return {'plain': {'running': 0, 'queued': 0}, 'large': {'running': 0, 'queued': 0}}
+
+    def test_cores(self):
+        remaining = {Workflow('foo', None, category=self.large, command='foo'): (True, 1000, 1000)}
+        assert self.algo.run(100, self.queued(), remaining) == [('foo', 110, 1.)]
+
+    def test_memory(self):
+        remaining = {Workflow('foo', None, category=self.large, command='foo'): (True, 1000, 1000)}
+        total = {'cores': 100, 'memory': 200000, 'disk': 0}
+        assert self.algo.run(total, self.queued(), remaining) == [('foo', 55, 1.)]
+
+    def test_mixed(self):
+        remaining = {
+            Workflow('foo', None, category=self.large, command='foo'): (True, 1000, 1000),
+            Workflow('bar', None, category=Category('plain'), command='foo'): (True, 1000, 1000)
+        }
+        total = {'cores': 100, 'memory': 100000, 'disk': 0}
+
+        # memory runs out first, after which the remaining cores are
+        # filled with tasks that do not need memory
+        assert sorted(self.algo.run(total, self.queued(), remaining)) == [('bar', 83, 1.), ('foo', 28, 1.)]
@@ -1,12 +1,24 @@
 import os
+import pickle
 import shutil
 import tempfile
 import unittest
 
 from lobster.core import Dataset
+from lobster.core.dataset import DatasetInfo, LumiArray
 from lobster import fs, se, util
 
 
+def count_characters(fn):
+    with open(os.path.join(TestDataset.workdir, fn)) as f:
+        return len(f.read())
+
+
+def count_probes(fn):
+    TestDataset.probed.append(fn)
+    return 1
+
+
 class TestDataset(unittest.TestCase):
 
     @classmethod
@@ -73,3 +85,86 @@ class TestDataset(unittest.TestCase):
 
                 info = Dataset(files=['spam'], patterns=['[12].txt']).get_info()
                 assert len(info.files) == 2
+
+    def test_recursive(self):
+        with util.PartiallyMutable.unlock():
+            s = se.StorageConfiguration(
+                output=[], input=['file://' + self.workdir])
+            s.activate()
+
+            with fs.alternative():
+                info = Dataset(files=['spam'], recursive=True).get_info()
+                assert len(info.files) == 10
+                assert 'spam/log' not in info.files
+
+                info = Dataset(files=['spam', 'ham/1.txt'], patterns=['*.log', '*.txt'], recursive=True).get_info()
+                assert len(info.files) == 9
+
+                info = Dataset(files=['eggs', 'ham/1.txt'], sizes=True).get_info()
+                assert len(info.files) == 11
+                assert info.files['eggs/1.txt'].size == len('stir-fry')
+                assert info.files['ham/1.txt'].size == len('bacon')
+
+    def test_probe(self):
+        with util.PartiallyMutable.unlock():
+            s = se.StorageConfiguration(
+                output=[], input=['file://' + self.workdir])
+            s.activate()
+
+            with fs.alternative():
+                info = Dataset(files=['eggs', 'ham'], events_reader=count_characters, events_per_task=20).get_info()
+                assert info.split_by == 'events'
+                assert info.tasksize == 20
+                assert info.files['eggs/1.txt'].events == len('stir-fry')
+                assert info.total_events == 10 * len('stir-fry') + 5 * len('bacon')
+
+                info = Dataset(files=['ham'], bytes_per_task=100).get_info()
+                assert info.split_by == 'bytes'
+                assert info.files['ham/1.txt'].size == len('bacon')
+
+        with self.assertRaises(AttributeError):
+            Dataset(files=['ham'], events_per_task=100)
+
+    def test_probe_rescan(self):
+        TestDataset.probed = []
+        with util.PartiallyMutable.unlock():
+            s = se.StorageConfiguration(
+                output=[], input=['file://' + self.workdir])
+            s.activate()
+
+            with fs.alternative():
+                dataset = Dataset(files=['ham'], events_reader=count_probes, events_per_task=20, watch=True)
+                assert dataset.get_info().total_events == 5
+                assert len(self.probed) == 5
+
+                assert dataset.get_info().total_events == 5
+                assert len(self.probed) == 5
+
+                with open(os.path.join(self.workdir, 'ham', 'new.txt'), 'w') as f:
+                    f.write('bacon')
+                try:
+                    assert dataset.get_info().total_events == 6
+                    assert self.probed[5:] == ['ham/new.txt']
+                finally:
+                    os.unlink(os.path.join(self.workdir, 'ham', 'new.txt'))
+
+
+class TestDatasetInfo(unittest.TestCase):
+
+    def test_lumis(self):
+        info = DatasetInfo()
+        info.files['a'].lumis = [(1, 2), (1, 3)]
+        info.files['a'].lumis.append((2, 1))
+        info.files['a'].lumis += [(2, 5)]
+        info.files['b'].lumis.append((-1, -1))
+
+        assert isinstance(info.files['a'].lumis, LumiArray)
+        assert info.files['a'].lumis == [(1, 2), (1, 3), (2, 1), (2, 5)]
+        assert len(info.files['a'].lumis) == 4
+        assert info.files['a'].lumis[-1] == (2, 5)
+        assert sum([f.lumis for f in info.files.values()], []) == [(1, 2), (1, 3), (2, 1), (2, 5), (-1, -1)]
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(info, protocol))
+            assert copy.files['a'].lumis == info.files['a'].lumis
+            assert copy.files['b'].lumis == [(-1, -1)]
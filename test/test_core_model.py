@@ -0,0 +1,51 @@
+import pickle
+import unittest
+
+from lobster.core.model import EWMARuntimeModel
+
+
+class TestEWMARuntimeModel(unittest.TestCase):
+
+    def setUp(self):
+        self.model = EWMARuntimeModel(alpha=0.2, minimum=5)
+
+    def test_minimum(self):
+        for _ in range(4):
+            assert self.model.observe('foo', 10, 100.) is None
+        assert self.model.tasksize('foo', 100) is None
+        assert self.model.predict('foo', 10) is None
+
+        self.model.observe('foo', 10, 100.)
+        assert self.model.tasksize('foo', 100) == 10
+        assert self.model.tasksize('bar', 100) is None
+
+    def test_drift(self):
+        for _ in range(10):
+            self.model.observe('foo', 10, 100.)
+        for _ in range(30):
+            error = self.model.observe('foo', 10, 200.)
+        assert error < 0.01
+        assert abs(self.model.predict('foo', 10) - 200) < 1
+
+    def test_cache(self):
+        for n in range(20):
+            self.model.observe('foo', 10, 100. if n % 2 else 300., cache=n % 2)
+        assert abs(self.model.predict('foo', 10, cache=0) - 300) < 1e-6
+        assert abs(self.model.predict('foo', 10, cache=1) - 100) < 1e-6
+        assert 4 <= self.model.tasksize('foo', 100) <= 6
+        assert self.model.error(['foo']) < 1e-6
+
+    def test_hosts(self):
+        for n in range(40):
+            self.model.observe('foo', 10, 100. if n % 4 else 200., host='slow' if n % 4 == 0 else 'fast')
+        assert self.model.predict('foo', 10, host='slow') > 150
+        assert self.model.predict('foo', 10, host='fast') < 120
+        assert self.model.error(['foo']) < 0.2
+
+    def test_pickle(self):
+        for _ in range(10):
+            self.model.observe('foo', 10, 100.)
+        model = pickle.loads(pickle.dumps(self.model))
+        assert model.alpha == 0.2
+        assert not model.known('foo')
+        assert self.model.known('foo')
@@ -1,9 +1,11 @@
 from collections import defaultdict, Counter
+import json
 import os
 import unittest
 
+from lobster import se
 from lobster.core.task import TaskHandler
-from lobster.core.source import ReleaseSummary
+from lobster.core.source import ReleaseSummary, parameter_template, split_parameters
 
 
 class DummyTask(object):
@@ -36,3 +38,54 @@ class TestTask(unittest.TestCase):
                                  (1, 276), (1, 277), (1, 278), (1, 279), (1, 280)]
         assert outinfo.events == 4000
         assert outinfo.size == 15037503
+
+    def test_summary_update(self):
+        serial = ReleaseSummary()
+        combined = ReleaseSummary()
+        for tag, code, result in (('1', 0, 0), ('2', 1, 0), ('3', 0, 32), ('4', 1, 0)):
+            part = ReleaseSummary()
+            for summary in (serial, part):
+                if result:
+                    summary.wq(result, tag)
+                else:
+                    summary.exe(code, tag)
+                if code or result:
+                    summary.dir(tag, os.path.join('failed', tag))
+                summary.monitor(tag)
+            combined.update(part)
+        assert str(combined) == str(serial)
+
+    def test_split_parameters(self):
+        template = {'executable': 'cmsRun', 'input': ['file:///a', 'file:///b'], 'mask': {'lumis': None}}
+        parameters = {'executable': 'cmsRun', 'input': ['file:///b', 'file:///a'], 'mask': {'lumis': [[1, 2]]},
+                      'output files': [['out.root', 'out_1.root']]}
+        delta = split_parameters(parameters, template)
+        assert 'executable' not in delta
+        merged = dict(template)
+        merged.update(delta)
+        assert merged == parameters
+
+        del parameters['executable']
+        assert split_parameters(parameters, template) is None
+
+    def test_split_shuffled_parameters(self):
+        storage = se.StorageConfiguration(
+            input=['file:///{0}'.format(i) for i in range(10)],
+            output=['file:///out'],
+            shuffle_inputs=True
+        )
+
+        def parameters(i):
+            res = {'executable': 'cmsRun', 'mask': {'lumis': [[i, i]]}}
+            storage.preprocess(res, False)
+            return res
+
+        template = parameter_template(parameters(0))
+        # as the template file is read by the task
+        written = json.loads(json.dumps(template))
+        for i in range(1, 10):
+            config = parameters(i)
+            expected = json.loads(json.dumps(config))
+            merged = dict(written)
+            merged.update(split_parameters(config, template))
+            assert merged == expected
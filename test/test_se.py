@@ -126,5 +126,24 @@ class TestFailure(TestSE):
         self.query(['file:///fuckup', 'file://' + self.workdir])
 
 
+class TestPreprocess(unittest.TestCase):
+
+    def runTest(self):
+        urls = ['file:///{0}'.format(i) for i in range(10)]
+        s = se.StorageConfiguration(output=urls, input=urls, shuffle_inputs=True, shuffle_outputs=True)
+        urls = list(s.input)
+
+        random.seed(1)
+        for merge in (False, True):
+            parameters = {}
+            s.preprocess(parameters, merge)
+            assert sorted(parameters['input']) == sorted(urls)
+            assert sorted(parameters['output']) == sorted(urls)
+            assert parameters['input'] is not s.input
+            assert parameters['output'] is not s.output
+        assert s.input == urls
+        assert s.output == urls
+
+
 if __name__ == '__main__':
     unittest.main()